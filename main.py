@@ -1,23 +1,263 @@
 """The main entry point for the text-based game.
 
-This script initializes the game control and starts the main game loop.
+This script initializes the game control and starts the main game loop,
+replays a command script headlessly when run with ``--batch``, or hosts
+network sessions when run with ``--serve`` (TCP/telnet, or the HTTP JSON
+API with ``--http``).
 """
+import argparse
+import sys
 
-from src.control import Control
+from src import startup
 
+# The server, batch, metrics and slow-log modules (and the asyncio, HTTP,
+# socket, multiprocessing and cProfile machinery they pull in) are imported
+# only by the modes that use them, so playing locally does not pay for them.
+with startup.phase("imports"):
+    from src.control import Control
 
-def main():
-    """Initializes and runs the game.
+# Kept in step with src.slowlog.DEFAULT_THRESHOLD_MS, which is not imported
+# just to build the command line.
+DEFAULT_SLOW_MS = 50.0
+
+
+def parse_args(argv=None):
+    """Parses the command line.
+
+    Args:
+        argv: The arguments to parse. Defaults to sys.argv[1:].
+
+    Returns:
+        argparse.Namespace: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="TextGameTemplate")
+    parser.add_argument(
+        "--batch", metavar="FILE",
+        help="run the commands in FILE (or '-' for stdin) without prompting"
+    )
+    parser.add_argument(
+        "--output", metavar="FILE",
+        help="batch mode: write responses to FILE instead of stdout"
+    )
+    parser.add_argument(
+        "--transcript", metavar="FILE",
+        help="batch mode: write a JSON Lines transcript of every command to FILE"
+    )
+    parser.add_argument(
+        "--quiet", action="store_true",
+        help="batch mode: discard responses (useful with --transcript or for timing)"
+    )
+    parser.add_argument(
+        "--metrics", action="store_true",
+        help="measure how long each command takes; the 'stats' command (and batch mode, on stderr) reports it"
+    )
+    parser.add_argument(
+        "--profile", type=int, default=0, metavar="N",
+        help="with --metrics: keep cProfile results for the N slowest commands"
+    )
+    parser.add_argument(
+        "--slow-log", metavar="FILE",
+        help="append commands slower than --slow-ms to FILE, with a phase breakdown and a snapshot to replay them"
+    )
+    parser.add_argument(
+        "--slow-ms", type=float, default=DEFAULT_SLOW_MS, metavar="MS",
+        help=f"with --slow-log: the threshold in milliseconds (default {DEFAULT_SLOW_MS:g})"
+    )
+    parser.add_argument(
+        "--state", metavar="FILE",
+        help="batch mode: start from a saved state, such as a slow-log snapshot"
+    )
+    parser.add_argument(
+        "--trace-events", action="store_true",
+        help="batch mode: time every event, condition and action and report the most expensive on stderr"
+    )
+    parser.add_argument(
+        "--serve", action="store_true",
+        help="host multiplayer sessions over TCP/telnet instead of playing locally"
+    )
+    parser.add_argument(
+        "--http", action="store_true",
+        help="server mode: serve the HTTP JSON API instead of TCP/telnet"
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="server mode: interface to listen on")
+    parser.add_argument(
+        "--port", type=int,
+        help="server mode: port to listen on (default 4000, or 8000 with --http)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="server mode: worker processes to shard sessions across (0 for one per CPU)"
+    )
+    parser.add_argument(
+        "--max-active", type=int, metavar="N",
+        help="server mode: keep at most N games in memory per process, hibernating idle ones to disk"
+    )
+    parser.add_argument(
+        "--pool", type=int, default=0, metavar="N",
+        help="server mode: keep N fresh games built ahead of time for new sessions"
+    )
+    parser.add_argument(
+        "--fork", action="store_true",
+        help="server mode: serve each TCP connection from a process forked off a loaded game"
+    )
+    parser.add_argument(
+        "--shared", action="store_true",
+        help="server mode: put every TCP player in one shared, persistent world"
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, metavar="PORT",
+        help="server mode: time commands and serve Prometheus metrics at http://HOST:PORT/metrics"
+    )
+    parser.add_argument(
+        "--admin-token", metavar="TOKEN",
+        help="with --http: enable POST /admin/profile for requests sending 'Authorization: Bearer TOKEN'"
+    )
+    parser.add_argument(
+        "--save-dir", default="saves",
+        help="server mode: directory where sessions are autosaved"
+    )
+    return parser.parse_args(argv)
+
+
+def make_metrics(args):
+    """Creates the command metrics requested on the command line.
+
+    Args:
+        args: The parsed command line arguments.
+
+    Returns:
+        CommandMetrics: The metrics, or None if --metrics was not given.
+    """
+    if not args.metrics:
+        return None
+    from src.metrics import CommandMetrics
+    return CommandMetrics(profile=args.profile)
+
+
+def make_slowlog(args):
+    """Creates the slow-command log requested on the command line.
+
+    Args:
+        args: The parsed command line arguments.
+
+    Returns:
+        SlowCommandLog: The log, or None if --slow-log was not given.
+    """
+    if not args.slow_log:
+        return None
+    from src.slowlog import SlowCommandLog
+    return SlowCommandLog(args.slow_log, args.slow_ms)
 
-    This function creates a Control instance and starts the main game loop.
+
+def run_batch(args):
+    """Runs a command script headlessly and reports throughput on stderr.
 
     Args:
+        args: The parsed command line arguments.
+
+    Returns:
         None
+    """
+    with startup.phase("imports"):
+        from src.batch import BatchRunner
+        from src.event_trace import EventTracer
+        from src.slowlog import load_snapshot
+
+    files = []
+    try:
+        if args.quiet:
+            output = None
+        elif args.output:
+            output = open(args.output, "w")
+            files.append(output)
+        else:
+            output = sys.stdout
+        transcript = None
+        if args.transcript:
+            transcript = open(args.transcript, "w")
+            files.append(transcript)
+        if args.batch == "-":
+            source = sys.stdin
+        else:
+            source = open(args.batch, "r")
+            files.append(source)
+
+        metrics = make_metrics(args)
+        slowlog = make_slowlog(args)
+        with startup.phase("Control.__init__"):
+            control = Control(metrics=metrics, slowlog=slowlog)
+        if args.state:
+            load_snapshot(control, args.state)
+        startup.finish()
+        if args.trace_events:
+            control.game.tracer = EventTracer()
+        stats = BatchRunner(control, output=output, transcript=transcript).run(source)
+        print(
+            f"{stats['commands']} commands in {stats['seconds']:.3f}s "
+            f"({stats['commands_per_second']:.0f}/s)",
+            file=sys.stderr
+        )
+        if metrics is not None:
+            print(metrics.report(profiles=True), file=sys.stderr)
+        if slowlog is not None and slowlog.logged:
+            print(f"{slowlog.logged} slow commands logged to {args.slow_log}", file=sys.stderr)
+        if control.game.tracer is not None:
+            print(control.game.tracer.report(), file=sys.stderr)
+    finally:
+        for f in files:
+            f.close()
+
+
+def main(argv=None):
+    """Initializes and runs the game.
+
+    This function creates a Control instance and starts the main game loop,
+    or runs a batch script if requested on the command line.
+
+    Args:
+        argv: The command line arguments. Defaults to sys.argv[1:].
 
     Returns:
         None
     """
-    app = Control()
+    with startup.phase("parse arguments"):
+        args = parse_args(argv)
+    if args.batch:
+        run_batch(args)
+        return
+    if args.serve and args.shared:
+        from src.shared_world import serve_shared
+        serve_shared(args.host, args.port or 4000, args.save_dir)
+        return
+    if args.serve and args.fork:
+        from src.forkserver import serve_forked
+        serve_forked(args.host, args.port or 4000, args.save_dir)
+        return
+    if args.serve and args.workers != 1:
+        protocol = "http" if args.http else "tcp"
+        port = args.port or (8000 if args.http else 4000)
+        from src.supervisor import serve_sharded
+        serve_sharded(
+            args.host, port, args.workers or None, protocol, args.save_dir, args.max_active, args.pool,
+            args.metrics_port, make_slowlog(args), args.admin_token
+        )
+        return
+    if args.serve and args.http:
+        from src.http_api import serve_http
+        serve_http(
+            args.host, args.port or 8000, args.save_dir, args.max_active, args.pool, args.metrics_port,
+            make_slowlog(args), args.admin_token
+        )
+        return
+    if args.serve:
+        from src.server import serve
+        serve(
+            args.host, args.port or 4000, args.save_dir, args.max_active, args.pool, args.metrics_port,
+            make_slowlog(args)
+        )
+        return
+    with startup.phase("Control.__init__"):
+        app = Control(metrics=make_metrics(args), slowlog=make_slowlog(args))
     app.main_game_loop()
 
 
@@ -0,0 +1,133 @@
+"""Headless batch mode for replaying command scripts.
+
+This module contains the BatchRunner class, which feeds commands from a file
+or stream to a Control instance without prompting or printing, writing the
+responses to a buffered output sink and optionally a JSON Lines transcript.
+"""
+import json
+import time
+from src.control import Control
+
+
+class BatchRunner:
+    """Runs commands against a game without terminal I/O.
+
+    Args:
+        control: The Control instance to drive. A new one is created if omitted.
+        output: A writable text stream receiving the responses, or None to
+            discard them.
+        transcript: A writable text stream receiving one JSON object per
+            command, or None.
+        buffer_size: The number of responses collected before they are
+            written to `output` in one call.
+    """
+
+    def __init__(self, control=None, output=None, transcript=None, buffer_size=1000):
+        self.control = control if control is not None else Control()
+        self.output = output
+        self.transcript = transcript
+        self.buffer_size = buffer_size
+        self._pending = []
+
+    @property
+    def game(self):
+        """Game: The game the commands run against."""
+        return self.control.game
+
+    def run_command(self, line):
+        """Runs one command line, which may chain several commands.
+
+        Args:
+            line: The command as typed by a player.
+
+        Returns:
+            str: The response, or None if the line produced no output.
+        """
+        outputs = self.control.handle_line(line)
+        if not outputs:
+            return None
+        return "\n".join(outputs)
+
+    def run(self, lines):
+        """Runs commands until the input ends or a command quits the game.
+
+        Blank lines and lines starting with ``#`` are skipped.
+
+        Args:
+            lines: An iterable of command lines (a list, or an open file).
+
+        Returns:
+            dict: Run statistics with keys "commands", "seconds" and
+            "commands_per_second".
+        """
+        count = 0
+        start = time.perf_counter()
+        try:
+            for line in lines:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+
+                response = self.run_command(line)
+                count += 1
+                if response is not None:
+                    self._write(response)
+                if self.transcript is not None:
+                    self._record(count, line, response)
+                if self.control.done:
+                    break
+        finally:
+            self.flush()
+        seconds = time.perf_counter() - start
+        return {
+            "commands": count,
+            "seconds": seconds,
+            "commands_per_second": count / seconds if seconds else 0.0,
+        }
+
+    def flush(self):
+        """Writes any buffered responses to the output sink.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self._pending and self.output is not None:
+            self.output.write("\n".join(self._pending) + "\n")
+            self.output.flush()
+        self._pending = []
+
+    def _write(self, response):
+        if self.output is None:
+            return
+        self._pending.append(response)
+        if len(self._pending) >= self.buffer_size:
+            self.flush()
+
+    def _record(self, index, line, response):
+        record = {
+            "index": index,
+            "command": line,
+            "response": response,
+            "location": self.game.player_location,
+            "dialogue_active": self.game.dialogue_active,
+        }
+        self.transcript.write(json.dumps(record) + "\n")
+
+
+def run_script(path, output=None, transcript=None):
+    """Replays a command script file in a fresh game.
+
+    Args:
+        path: The script file, one command per line.
+        output: A writable text stream for the responses, or None.
+        transcript: A writable text stream for the JSON Lines transcript, or None.
+
+    Returns:
+        dict: Run statistics (see `BatchRunner.run`).
+    """
+    runner = BatchRunner(output=output, transcript=transcript)
+    with open(path, "r") as f:
+        return runner.run(f)
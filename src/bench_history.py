@@ -0,0 +1,343 @@
+"""Benchmark history and regression comparison.
+
+This module stores benchmark runs (see `src.benchmarks`) in a JSON Lines
+history file, each with the machine fingerprint, Python version and git
+commit it was measured on, and compares a run against a baseline run. The
+repetitions of each benchmark are compared with a two-sided Mann-Whitney U
+test, so a change is only reported when it is both larger than a threshold
+and unlikely to be noise. Run with ``python -m src.bench_history --help``.
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+DEFAULT_THRESHOLD = 0.05
+DEFAULT_ALPHA = 0.05
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Exact U distributions are used for samples up to this size (without ties).
+_EXACT_LIMIT = 30
+
+
+def machine_fingerprint():
+    """Returns a short id of the machine benchmarks run on.
+
+    Runs are only directly comparable on the same hardware; the fingerprint
+    covers the host name, architecture, CPU model and CPU count.
+
+    Args:
+        None
+
+    Returns:
+        str: 12 hex digits.
+    """
+    cpu = platform.processor()
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    cpu = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    parts = (platform.node(), platform.machine(), cpu, str(os.cpu_count()))
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:12]
+
+
+def git_commit():
+    """Returns the checked out git commit of the repository.
+
+    Args:
+        None
+
+    Returns:
+        tuple: (commit, dirty), where `commit` is the full hash (or None
+        outside a git checkout) and `dirty` whether there are uncommitted
+        changes.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=_REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=_REPO_DIR, capture_output=True,
+            text=True, check=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, bool(status.strip())
+
+
+def make_run(report):
+    """Adds the identity of this machine and checkout to a benchmark report.
+
+    Args:
+        report: A report from `src.benchmarks.run_suite`.
+
+    Returns:
+        dict: The run: the report plus "id", "timestamp", "commit", "dirty"
+        and "machine".
+    """
+    commit, dirty = git_commit()
+    timestamp = time.time()
+    run = {
+        "id": time.strftime("%Y%m%dT%H%M%S", time.gmtime(timestamp)) + (f"-{commit[:8]}" if commit else ""),
+        "timestamp": timestamp,
+        "commit": commit,
+        "dirty": dirty,
+        "machine": machine_fingerprint(),
+    }
+    run.update(report)
+    return run
+
+
+def append_run(path, run):
+    """Appends a run to a history file.
+
+    Args:
+        path: The history file (JSON Lines, created if missing).
+        run: The run (see `make_run`).
+
+    Returns:
+        None
+    """
+    with open(path, "a") as f:
+        f.write(json.dumps(run, separators=(",", ":")) + "\n")
+
+
+def load_history(path):
+    """Reads every run from a history file.
+
+    Args:
+        path: The history file.
+
+    Returns:
+        list: The runs, oldest first (empty if the file does not exist).
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_run(history, ref):
+    """Finds a run in a history.
+
+    Args:
+        history: The runs, oldest first.
+        ref: ``latest``, a negative index (``-2`` is the run before the
+            latest), a run id, or a commit hash prefix (the latest run of
+            that commit is used).
+
+    Returns:
+        dict: The run.
+
+    Raises:
+        LookupError: If no run matches.
+    """
+    if not history:
+        raise LookupError("The benchmark history is empty.")
+    if ref == "latest":
+        return history[-1]
+    if ref.startswith("-") and ref[1:].isdigit():
+        try:
+            return history[int(ref)]
+        except IndexError:
+            raise LookupError(f"The benchmark history only has {len(history)} runs.") from None
+    for run in reversed(history):
+        if run["id"] == ref or (len(ref) >= 4 and (run.get("commit") or "").startswith(ref)):
+            return run
+    raise LookupError(f"No benchmark run matches {ref!r}.")
+
+
+def mann_whitney_u(first, second):
+    """Runs a two-sided Mann-Whitney U test on two samples.
+
+    Small samples without ties use the exact distribution of U; otherwise
+    the normal approximation with tie and continuity corrections is used.
+
+    Args:
+        first: The first sample.
+        second: The second sample.
+
+    Returns:
+        tuple: (u, p) where `u` is the U statistic of the first sample and
+        `p` the two-sided p-value.
+    """
+    n1, n2 = len(first), len(second)
+    if not n1 or not n2:
+        return 0.0, 1.0
+    values = sorted((value, group) for group, sample in enumerate((first, second)) for value in sample)
+    ranks = [0.0] * len(values)
+    ties = []
+    start = 0
+    while start < len(values):
+        end = start
+        while end + 1 < len(values) and values[end + 1][0] == values[start][0]:
+            end += 1
+        for position in range(start, end + 1):
+            ranks[position] = (start + end) / 2 + 1
+        if end > start:
+            ties.append(end - start + 1)
+        start = end + 1
+    rank_sum = sum(rank for rank, (_, group) in zip(ranks, values) if group == 0)
+    u = rank_sum - n1 * (n1 + 1) / 2
+
+    if not ties and n1 <= _EXACT_LIMIT and n2 <= _EXACT_LIMIT:
+        counts = _u_distribution(n1, n2)
+        total = sum(counts)
+        tail = min(u, n1 * n2 - u)
+        p = 2 * sum(counts[:int(tail) + 1]) / total
+        return u, min(1.0, p)
+
+    mean = n1 * n2 / 2
+    n = n1 + n2
+    tie_term = sum(count ** 3 - count for count in ties) / (n * (n - 1))
+    variance = n1 * n2 / 12 * ((n + 1) - tie_term)
+    if variance <= 0:
+        return u, 1.0
+    z = (abs(u - mean) - 0.5) / math.sqrt(variance)
+    return u, min(1.0, math.erfc(max(z, 0.0) / math.sqrt(2)))
+
+
+def _u_distribution(n1, n2):
+    # counts[u] is the number of orderings of n1 + n2 distinct values in
+    # which the first sample has statistic u.
+    table = {(0, 0): [1]}
+    for i in range(n1 + 1):
+        for j in range(n2 + 1):
+            if i == 0 and j == 0:
+                continue
+            counts = [0] * (i * j + 1)
+            if i:
+                # The largest value belongs to the first sample: it beats all j.
+                for u, count in enumerate(table[(i - 1, j)]):
+                    counts[u + j] += count
+            if j:
+                for u, count in enumerate(table[(i, j - 1)]):
+                    counts[u] += count
+            table[(i, j)] = counts
+    return table[(n1, n2)]
+
+
+def compare_runs(baseline, current, threshold=DEFAULT_THRESHOLD, alpha=DEFAULT_ALPHA):
+    """Compares every benchmark present in two runs.
+
+    A benchmark regressed when its median time grew by more than `threshold`
+    and the Mann-Whitney p-value of the repetitions is below `alpha`;
+    improvements are judged the same way.
+
+    Args:
+        baseline: The baseline run.
+        current: The run to judge.
+        threshold: The smallest relative change that counts, e.g. 0.05.
+        alpha: The significance level.
+
+    Returns:
+        list: One dictionary per benchmark and size in both runs, with
+        "name", "size", "baseline_us" and "current_us" (medians), "change"
+        (relative), "p" and "verdict" ("regression", "improvement" or "same").
+    """
+    base = {(result["name"], result["size"]): result for result in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        key = (result["name"], result["size"])
+        if key not in base:
+            continue
+        before = base[key]["samples_us"]
+        after = result["samples_us"]
+        before_median = statistics.median(before)
+        after_median = statistics.median(after)
+        change = after_median / before_median - 1 if before_median else 0.0
+        _, p = mann_whitney_u(before, after)
+        verdict = "same"
+        if p < alpha and change > threshold:
+            verdict = "regression"
+        elif p < alpha and change < -threshold:
+            verdict = "improvement"
+        rows.append({
+            "name": key[0], "size": key[1], "baseline_us": before_median, "current_us": after_median,
+            "change": change, "p": p, "verdict": verdict,
+        })
+    return rows
+
+
+def format_comparison(baseline, current, rows):
+    """Formats a comparison as a report.
+
+    Args:
+        baseline: The baseline run.
+        current: The compared run.
+        rows: The rows from `compare_runs`.
+
+    Returns:
+        str: The report.
+    """
+    lines = [
+        f"Baseline: {_describe(baseline)}",
+        f"Current:  {_describe(current)}",
+    ]
+    if baseline.get("machine") != current.get("machine"):
+        lines.append("Warning: the runs were measured on different machines.")
+    if baseline.get("python") != current.get("python"):
+        lines.append("Warning: the runs used different Python versions.")
+    lines.append(f"{'benchmark':<22}{'size':>7}{'baseline us':>14}{'current us':>14}{'change':>9}{'p':>9}  verdict")
+    for row in rows:
+        lines.append(
+            f"{row['name']:<22}{row['size']:>7}{row['baseline_us']:>14.2f}{row['current_us']:>14.2f}"
+            f"{row['change']:>+9.1%}{row['p']:>9.4f}  {row['verdict']}"
+        )
+    regressions = sum(1 for row in rows if row["verdict"] == "regression")
+    lines.append(f"{regressions} regression(s) in {len(rows)} benchmark(s).")
+    return "\n".join(lines)
+
+
+def _describe(run):
+    commit = (run.get("commit") or "unknown")[:10]
+    dirty = "+changes" if run.get("dirty") else ""
+    return f"{run.get('id', '(not stored)')} commit {commit}{dirty}, Python {run.get('python')}, " \
+           f"machine {run.get('machine')}"
+
+
+def main(argv=None):
+    """Compares two runs from a history file.
+
+    Args:
+        argv: The command line arguments. Defaults to sys.argv[1:].
+
+    Returns:
+        int: The exit status: 1 if the current run regressed, else 0.
+    """
+    parser = argparse.ArgumentParser(description="Compare benchmark runs from a history file")
+    parser.add_argument("history", help="the history file written by 'python -m src.benchmarks --history'")
+    parser.add_argument("--baseline", default="-2", help="baseline run: latest, -N, run id or commit (default -2)")
+    parser.add_argument("--current", default="latest", help="run to judge (default latest)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="smallest relative slowdown that counts (default 0.05)")
+    parser.add_argument("--alpha", type=float, default=DEFAULT_ALPHA, help="significance level (default 0.05)")
+    parser.add_argument("--list", action="store_true", help="list the stored runs and exit")
+    args = parser.parse_args(argv)
+
+    history = load_history(args.history)
+    if args.list:
+        for run in history:
+            print(_describe(run))
+        return 0
+    try:
+        baseline = find_run(history, args.baseline)
+        current = find_run(history, args.current)
+    except LookupError as e:
+        parser.error(str(e))
+    rows = compare_runs(baseline, current, args.threshold, args.alpha)
+    print(format_comparison(baseline, current, rows))
+    return 1 if any(row["verdict"] == "regression" for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,426 @@
+"""Micro-benchmarks for the hot Game methods.
+
+Each benchmark builds a synthetic world of a given size (rooms, items in
+every room, global events and pending timers all scale with it), then times
+one operation repeatedly: moving between rooms, taking an item, examining an
+item at the bottom of nested containers, checking the global events, choosing
+a dialogue option, passing time and saving and loading the game.
+
+The harness is stdlib only. Every benchmark is warmed up first, which also
+picks how many operations each repetition runs, then timed for several
+repetitions with the garbage collector paused. Results are reported per
+operation and can be written as JSON, or stored in a history file and
+compared against an earlier run (see `src.bench_history`). Run with
+``python -m src.benchmarks --help``.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from src.bench_history import (
+    DEFAULT_ALPHA, DEFAULT_THRESHOLD, append_run, compare_runs, find_run, format_comparison, load_history,
+    make_run,
+)
+from src.game import Game
+
+DEFAULT_SIZES = (10, 100, 1000)
+DEFAULT_DEPTH = 16
+
+
+def make_state(size, depth=DEFAULT_DEPTH, events=True, timers=True):
+    """Builds a synthetic saved game (see `Game.dump_state`) of a given size.
+
+    The world is a corridor of `size` rooms linked north and south, starting
+    at ``start``. Every room holds a lamp and a crate with a coin in it. The
+    start room also holds a chest with `depth` nested open boxes, the
+    innermost holding a gem, and a sage whose dialogue option loops back to
+    itself. There are `size` global events whose conditions never pass and
+    `size` timers far in the future.
+
+    Args:
+        size: The number of rooms, global events and timers.
+        depth: How many boxes deep the gem is.
+        events: Whether to add the global events.
+        timers: Whether to add the timers.
+
+    Returns:
+        dict: The game state, for `Game.restore_state`.
+    """
+    rooms = {}
+    ids = ["start"] + [f"room_{number}" for number in range(1, size)]
+    for number, room_id in enumerate(ids):
+        exits = {}
+        if number + 1 < size:
+            exits["north"] = ids[number + 1]
+        if number:
+            exits["south"] = ids[number - 1]
+        rooms[room_id] = {
+            "id": room_id,
+            "description": f"Room number {number} of a long corridor.",
+            "exits": exits,
+            "items": [
+                {"name": "lamp", "description": "A brass lamp."},
+                {
+                    "name": "crate", "description": "A wooden crate.", "is_container": True, "is_open": True,
+                    "contents": [{"name": "coin", "description": "A copper coin."}],
+                },
+            ],
+            "characters": [],
+            "events": {},
+        }
+
+    gem = {"name": "gem", "description": "A glittering gem."}
+    for level in range(depth, 0, -1):
+        gem = {
+            "name": f"box {level}", "description": "A small box.", "is_container": True, "is_open": True,
+            "contents": [gem],
+        }
+    rooms["start"]["items"].append({
+        "name": "chest", "description": "An old chest.", "is_container": True, "is_open": True,
+        "contents": [gem],
+    })
+    rooms["start"]["characters"].append({
+        "name": "sage",
+        "description": "A patient old sage.",
+        "dialogue": {
+            "start_node": "start",
+            "nodes": {
+                "start": {
+                    "text": "Ask me anything.",
+                    "options": [
+                        {"text": "Tell me more.", "condition": {"var_false": "sage_done"}, "next_node": "start"},
+                        {"text": "Goodbye."},
+                    ],
+                },
+            },
+        },
+    })
+
+    global_events = []
+    if events:
+        for number in range(size):
+            kind = number % 3
+            if kind == 0:
+                condition = {"var_true": f"flag_{number}"}
+            elif kind == 1:
+                condition = {"has_item": f"relic_{number}"}
+            else:
+                condition = {"in_location": "start", "visited": {"room": ids[number % size], "count": 1000}}
+            global_events.append({
+                "condition": condition,
+                "actions": [{"type": "print", "message": f"Event {number} happens."}],
+                "repeatable": True,
+            })
+
+    timer_list = []
+    if timers:
+        for number in range(size):
+            timer_list.append({
+                "trigger_time": 10 ** 9 + number,
+                "actions": [{"type": "print", "message": f"Timer {number} rings."}],
+            })
+
+    return {
+        "player_location": "start",
+        "inventory": [],
+        "visited_counts": {"start": 1},
+        "game_state": {},
+        "world_map": rooms,
+        "player_stats": {"hp": 100, "max_hp": 100, "str": 10, "def": 10, "spd": 10},
+        "time_system": {"total_minutes": 0, "timers": timer_list},
+        "global_events": global_events,
+    }
+
+
+def make_game(size, depth=DEFAULT_DEPTH, events=True, timers=True):
+    """Creates a Game holding a synthetic world (see `make_state`).
+
+    Args:
+        size: The number of rooms, global events and timers.
+        depth: How many boxes deep the gem is.
+        events: Whether to add the global events.
+        timers: Whether to add the timers.
+
+    Returns:
+        Game: The game, with the player in the start room.
+    """
+    game = Game()
+    game.restore_state(make_state(size, depth, events, timers))
+    return game
+
+
+def _move_player(size, depth):
+    game = make_game(size, depth)
+
+    def run():
+        game.move_player("north" if game.player_location == "start" else "south")
+    return run
+
+
+def _take_item(size, depth):
+    game = make_game(size, depth)
+
+    def run():
+        # Dropped again so every call takes the lamp from the room.
+        game.take_item("lamp")
+        game.drop_item("lamp")
+    return run
+
+
+def _examine_item(size, depth):
+    game = make_game(size, depth)
+    return lambda: game.examine_item("gem")
+
+
+def _check_global_events(size, depth):
+    game = make_game(size, depth)
+    return game.check_global_events
+
+
+def _make_dialogue_choice(size, depth):
+    game = make_game(size, depth)
+    game.talk_to_character("sage")
+    return lambda: game.make_dialogue_choice(1)
+
+
+def _pass_time(size, depth):
+    game = make_game(size, depth, events=False)
+    return lambda: game.pass_time(1)
+
+
+def _save_game(size, depth):
+    game = make_game(size, depth)
+    path = _scratch_file()
+    return lambda: game.save_game(path)
+
+
+def _load_game(size, depth):
+    game = make_game(size, depth)
+    path = _scratch_file()
+    game.save_game(path)
+    return lambda: game.load_game(path)
+
+
+def _scratch_file():
+    handle, path = tempfile.mkstemp(prefix="bench-", suffix=".json")
+    os.close(handle)
+    _SCRATCH.append(path)
+    return path
+
+
+_SCRATCH = []
+
+# Name: (function building the operation for a world size and depth, description).
+BENCHMARKS = {
+    "move_player": (_move_player, "move to a neighbouring room (global events checked)"),
+    "take_item": (_take_item, "take an item and drop it again"),
+    "examine_item": (_examine_item, "examine an item inside nested open containers"),
+    "check_global_events": (_check_global_events, "check every global event, none passing"),
+    "make_dialogue_choice": (_make_dialogue_choice, "choose a dialogue option"),
+    "pass_time": (_pass_time, "pass one minute with every timer pending"),
+    "save_game": (_save_game, "save the game to a file"),
+    "load_game": (_load_game, "load the game from a file"),
+}
+
+
+def measure(operation, repetitions=10, warmup=0.2, min_time=0.05):
+    """Times an operation.
+
+    The operation first runs for `warmup` seconds. Each repetition then runs
+    it enough times to take about `min_time` seconds, with the garbage
+    collector paused.
+
+    Args:
+        operation: The callable to time.
+        repetitions: How many timed repetitions to run.
+        warmup: Seconds to run the operation before timing it.
+        min_time: The target duration of each repetition, in seconds.
+
+    Returns:
+        tuple: (number, samples) where `number` is how many operations each
+        repetition ran and `samples` the seconds per operation of each
+        repetition.
+    """
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        operation()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= warmup:
+            break
+    number = max(1, int(min_time / (elapsed / calls)))
+
+    samples = []
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repetitions):
+            start = time.perf_counter()
+            for _ in range(number):
+                operation()
+            samples.append((time.perf_counter() - start) / number)
+    finally:
+        if enabled:
+            gc.enable()
+    return number, samples
+
+
+def run_benchmark(name, size, depth=DEFAULT_DEPTH, repetitions=10, warmup=0.2, min_time=0.05):
+    """Runs one benchmark at one world size.
+
+    Args:
+        name: The benchmark (a key of `BENCHMARKS`).
+        size: The world size.
+        depth: The container depth for ``examine_item``.
+        repetitions: How many timed repetitions to run.
+        warmup: Seconds to run the operation before timing it.
+        min_time: The target duration of each repetition, in seconds.
+
+    Returns:
+        dict: The result, with "name", "size", "number", "samples_us" (one
+        per repetition) and "mean_us", "median_us", "stdev_us" and "min_us".
+    """
+    build, _ = BENCHMARKS[name]
+    try:
+        operation = build(size, depth)
+        number, samples = measure(operation, repetitions, warmup, min_time)
+    finally:
+        while _SCRATCH:
+            os.remove(_SCRATCH.pop())
+    micros = [sample * 1e6 for sample in samples]
+    return {
+        "name": name,
+        "size": size,
+        "number": number,
+        "samples_us": micros,
+        "mean_us": statistics.fmean(micros),
+        "median_us": statistics.median(micros),
+        "stdev_us": statistics.stdev(micros) if len(micros) > 1 else 0.0,
+        "min_us": min(micros),
+    }
+
+
+def run_suite(names=None, sizes=DEFAULT_SIZES, depth=DEFAULT_DEPTH, repetitions=10, warmup=0.2, min_time=0.05,
+              progress=None):
+    """Runs benchmarks at several world sizes.
+
+    Args:
+        names: The benchmarks to run. Defaults to all of them.
+        sizes: The world sizes.
+        depth: The container depth for ``examine_item``.
+        repetitions: How many timed repetitions each benchmark runs.
+        warmup: Seconds each benchmark runs before being timed.
+        min_time: The target duration of each repetition, in seconds.
+        progress: Called with each result as it is produced, if given.
+
+    Returns:
+        dict: The report, with the run's "settings", "python" version,
+        "platform" and "results" (see `run_benchmark`).
+    """
+    results = []
+    for name in names or BENCHMARKS:
+        for size in sizes:
+            result = run_benchmark(name, size, depth, repetitions, warmup, min_time)
+            results.append(result)
+            if progress is not None:
+                progress(result)
+    return {
+        "settings": {
+            "sizes": list(sizes), "depth": depth, "repetitions": repetitions, "warmup": warmup,
+            "min_time": min_time,
+        },
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def format_result(result):
+    """Formats one result as a table row.
+
+    Args:
+        result: A result from `run_benchmark`.
+
+    Returns:
+        str: The row.
+    """
+    return (
+        f"{result['name']:<22}{result['size']:>7}{result['median_us']:>12.2f}{result['min_us']:>12.2f}"
+        f"{result['stdev_us']:>10.2f}{result['number']:>9}"
+    )
+
+
+def main(argv=None):
+    """Runs the benchmarks from the command line.
+
+    Args:
+        argv: The command line arguments. Defaults to sys.argv[1:].
+
+    Returns:
+        int: The exit status: 1 if a comparison found a regression, else 0.
+    """
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the hot Game methods")
+    parser.add_argument("names", nargs="*", metavar="NAME", help=f"benchmarks to run: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="world sizes")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH, help="container depth for examine_item")
+    parser.add_argument("--repetitions", type=int, default=10, help="timed repetitions per benchmark")
+    parser.add_argument("--warmup", type=float, default=0.2, help="seconds of warmup per benchmark")
+    parser.add_argument("--min-time", type=float, default=0.05, help="target seconds per repetition")
+    parser.add_argument("--json", metavar="FILE", help="write the results as JSON to FILE")
+    parser.add_argument("--history", metavar="FILE", help="append the run, with machine and commit, to FILE")
+    parser.add_argument(
+        "--compare", metavar="REF",
+        help="compare against a run in --history (latest, -N, run id or commit); exit 1 on regression"
+    )
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="with --compare: smallest relative slowdown that counts (default 0.05)")
+    parser.add_argument("--alpha", type=float, default=DEFAULT_ALPHA,
+                        help="with --compare: significance level (default 0.05)")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, (_, description) in BENCHMARKS.items():
+            print(f"{name:<22}{description}")
+        return 0
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(unknown)}")
+    baseline = None
+    if args.compare:
+        if not args.history:
+            parser.error("--compare needs --history")
+        try:
+            baseline = find_run(load_history(args.history), args.compare)
+        except LookupError as e:
+            parser.error(str(e))
+
+    print(f"{'benchmark':<22}{'size':>7}{'median us':>12}{'min us':>12}{'stdev':>10}{'number':>9}")
+    report = run_suite(
+        args.names, args.sizes, args.depth, args.repetitions, args.warmup, args.min_time,
+        progress=lambda result: print(format_result(result), flush=True)
+    )
+    run = make_run(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(run, f, indent=4)
+        print(f"Results written to {args.json}", file=sys.stderr)
+    if args.history:
+        append_run(args.history, run)
+        print(f"Run {run['id']} added to {args.history}", file=sys.stderr)
+    if baseline is None:
+        return 0
+    rows = compare_runs(baseline, run, args.threshold, args.alpha)
+    print()
+    print(format_comparison(baseline, run, rows))
+    return 1 if any(row["verdict"] == "regression" for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+"""
+Per-room and world-wide character indexes.
+"""
+import copy
+from src.vocabulary import Vocabulary
+
+
+class CharacterCollection:
+    """The characters in a room, indexed by name.
+
+    Collections behave like the lists they replace (iteration, ``len``,
+    ``append``, ``remove``, indexing) while name lookups, membership tests
+    and removal are O(1). Membership is by identity.
+
+    Every collection belongs to a holder room id and reports every change to
+    the ``CharacterIndex`` that created it.
+    """
+
+    __slots__ = ("_characters", "_names", "_by_name", "holder", "_index")
+
+    def __init__(self, characters=(), holder=None, index=None):
+        self._characters = {}
+        self._names = {}
+        self._by_name = {}
+        self.holder = holder
+        self._index = index
+        for character in characters:
+            self.append(character)
+
+    def append(self, character):
+        """Adds a character to the end of the collection.
+
+        If the character is currently in another room of the same index it
+        is moved here rather than duplicated.
+
+        Args:
+            character: The character dictionary.
+        """
+        self._index.attach(character, self)
+        self._add(character)
+
+    def extend(self, characters):
+        """Adds several characters to the end of the collection.
+
+        Args:
+            characters: An iterable of character dictionaries.
+        """
+        for character in characters:
+            self.append(character)
+
+    def remove(self, character):
+        """Removes a character from the collection and the world.
+
+        Args:
+            character: The character dictionary.
+
+        Raises:
+            ValueError: If the character is not in the collection.
+        """
+        if character not in self:
+            raise ValueError("CharacterCollection.remove(x): x not in collection")
+        self._discard(character)
+        self._index.detach(character)
+
+    def pop(self, position=-1):
+        """Removes and returns the character at a position (the last by default).
+
+        Args:
+            position: The position of the character to remove.
+
+        Returns:
+            The removed character dictionary.
+        """
+        character = self[position]
+        self.remove(character)
+        return character
+
+    def move(self, character, destination):
+        """Moves a character to another room's collection.
+
+        Args:
+            character: The character dictionary.
+            destination: The collection receiving the character.
+
+        Raises:
+            ValueError: If the character is not in this collection.
+        """
+        if character not in self:
+            raise ValueError("CharacterCollection.move(x): x not in collection")
+        self._discard(character)
+        destination._add(character)
+        self._index.reparent(character, destination)
+
+    def clear(self):
+        """Removes every character from the collection and the world."""
+        for character in list(self._characters.values()):
+            self.remove(character)
+
+    def find(self, name):
+        """Returns the first character with an exact name, or None.
+
+        A miss rescans the room once, so characters renamed in place since
+        they were added are still found.
+
+        Args:
+            name: The character name.
+
+        Returns:
+            The character dictionary, or None.
+        """
+        same_name = self._by_name.get(name)
+        if same_name:
+            for character in same_name.values():
+                if character.get("name") == name:
+                    return character
+        self._reindex()
+        same_name = self._by_name.get(name)
+        return next(iter(same_name.values())) if same_name else None
+
+    def _add(self, character):
+        key = id(character)
+        name = character.get("name")
+        self._characters[key] = character
+        self._names[key] = name
+        self._by_name.setdefault(name, {})[key] = character
+
+    def _discard(self, character):
+        key = id(character)
+        del self._characters[key]
+        _unname(self._names, self._by_name, key)
+
+    def _reindex(self):
+        self._names = {}
+        self._by_name = {}
+        for character in self._characters.values():
+            self._add(character)
+
+    def __contains__(self, character):
+        return self._characters.get(id(character)) is character
+
+    def __iter__(self):
+        return iter(self._characters.values())
+
+    def __len__(self):
+        return len(self._characters)
+
+    def __getitem__(self, position):
+        return list(self._characters.values())[position]
+
+    def __eq__(self, other):
+        if isinstance(other, (CharacterCollection, list)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"CharacterCollection({list(self._characters.values())!r})"
+
+    def __deepcopy__(self, memo):
+        # Copies are detached from the world, so they are plain lists.
+        return [copy.deepcopy(character, memo) for character in self._characters.values()]
+
+
+class CharacterIndex:
+    """Tracks every character in the world, which room it is in and its name.
+
+    Lookups by name across the whole world do not have to walk every room.
+    ``vocabulary`` indexes characters by the words players can refer to them
+    by (see `src.vocabulary`).
+    """
+
+    def __init__(self):
+        self._characters = {}
+        self._parents = {}
+        self._names = {}
+        self._by_name = {}
+        self.vocabulary = Vocabulary()
+
+    def rebuild(self, world_map):
+        """Rebuilds the index from scratch, adopting any plain character lists.
+
+        Args:
+            world_map: The rooms of the world, keyed by room id.
+        """
+        self._characters = {}
+        self._parents = {}
+        self._names = {}
+        self._by_name = {}
+        self.vocabulary.clear()
+        for room_id, room in world_map.items():
+            if "characters" in room:
+                room["characters"] = self.adopt(room["characters"], room_id)
+
+    def adopt(self, characters, holder):
+        """Returns an indexed collection holding the given characters.
+
+        Args:
+            characters: A list or collection of character dictionaries.
+            holder: The id of the room the characters are in.
+
+        Returns:
+            CharacterCollection: The collection (`characters` itself if already one).
+        """
+        if isinstance(characters, CharacterCollection) and characters._index is self:
+            characters.holder = holder
+            for character in characters:
+                self._register(character, characters)
+            return characters
+        return CharacterCollection(characters or (), holder, self)
+
+    def attach(self, character, collection):
+        """Registers a character as being in a room's collection.
+
+        Args:
+            character: The character dictionary.
+            collection: The collection the character is being added to.
+        """
+        parent = self._parents.get(id(character))
+        if parent is not None and parent is not collection and character in parent:
+            # Keep a single room per character: adding elsewhere is a move.
+            parent._discard(character)
+        self._register(character, collection)
+
+    def detach(self, character):
+        """Forgets a character.
+
+        Args:
+            character: The character dictionary.
+        """
+        key = id(character)
+        if self._characters.get(key) is not character:
+            return
+        del self._characters[key]
+        del self._parents[key]
+        _unname(self._names, self._by_name, key)
+        self.vocabulary.discard(key)
+
+    def reparent(self, character, collection):
+        """Records that an indexed character is now in another room.
+
+        Args:
+            character: The character dictionary.
+            collection: The collection now holding the character.
+        """
+        self._parents[id(character)] = collection
+
+    def location(self, character):
+        """Returns the id of the room a character is recorded to be in, or None."""
+        key = id(character)
+        if self._characters.get(key) is not character:
+            return None
+        return self._parents[key].holder
+
+    def parent(self, character):
+        """Returns the collection holding a character, or None if not indexed."""
+        key = id(character)
+        if self._characters.get(key) is not character:
+            return None
+        return self._parents[key]
+
+    def find(self, name):
+        """Returns the indexed characters with an exact name.
+
+        Args:
+            name: The character name.
+
+        Returns:
+            list: The matching characters, in the order they were indexed.
+        """
+        same_name = self._by_name.get(name)
+        return list(same_name.values()) if same_name else []
+
+    def _register(self, character, collection):
+        key = id(character)
+        self._characters[key] = character
+        self._parents[key] = collection
+        _unname(self._names, self._by_name, key)
+        name = character.get("name")
+        self._names[key] = name
+        self._by_name.setdefault(name, {})[key] = character
+        self.vocabulary.add(key, character)
+
+
+def _unname(names, by_name, key):
+    name = names.pop(key, None)
+    same_name = by_name.get(name)
+    if same_name is not None:
+        same_name.pop(key, None)
+        if not same_name:
+            del by_name[name]
@@ -0,0 +1,243 @@
+"""
+Declarative command grammar compiled into a token trie.
+
+Each verb is described by a small dictionary (its aliases, the shape of its
+arguments and the prompts shown when they are missing). The grammar is
+compiled once into a trie keyed by input words, so resolving a command walks
+only the words of the verb phrase, however many verbs there are, and yields
+the handler name and the parsed arguments together.
+
+A line may hold several commands separated by periods or the word ``then``
+(see `split_commands`).
+"""
+import re
+
+DIRECTION_WORDS = {
+    "n": "north",
+    "north": "north",
+    "s": "south",
+    "south": "south",
+    "e": "east",
+    "east": "east",
+    "w": "west",
+    "west": "west",
+    "ne": "northeast",
+    "northeast": "northeast",
+    "nw": "northwest",
+    "northwest": "northwest",
+    "se": "southeast",
+    "southeast": "southeast",
+    "sw": "southwest",
+    "southwest": "southwest",
+    "u": "up",
+    "up": "up",
+    "d": "down",
+    "down": "down",
+}
+
+# Argument shapes:
+#   none       - no arguments; extra words are ignored.
+#   text       - the rest of the line as one phrase.
+#   word       - the first word after the verb.
+#   direction  - a direction word (or abbreviation) after the verb.
+#   split      - two phrases separated by the entry's "preposition".
+#   number     - an optional whole number, defaulting to the entry's "default".
+GRAMMAR = (
+    {"verb": "quit"},
+    {"verb": "go", "handler": "move", "args": "direction", "prompt": "Go where?"},
+    {"verb": "look", "aliases": ["l"]},
+    {"verb": "take", "aliases": ["get", "g"], "args": "text", "prompt": "Take what?"},
+    {"verb": "drop", "args": "text", "prompt": "Drop what?"},
+    {"verb": "inventory", "aliases": ["i", "inv"]},
+    {"verb": "examine", "aliases": ["x", "ex"], "args": "text", "prompt": "Examine what?"},
+    {"verb": "talk", "aliases": ["talk to"], "args": "text", "prompt": "Talk to whom?"},
+    {"verb": "save", "args": "word", "prompt": "Save to which file?"},
+    {"verb": "load", "args": "word", "prompt": "Load from which file?"},
+    {"verb": "open", "args": "text", "prompt": "Open what?"},
+    {"verb": "close", "args": "text", "prompt": "Close what?"},
+    {
+        "verb": "put", "args": "split", "preposition": "in",
+        "prompt": "Put what in what?", "usage": "Usage: put <item> in <container>",
+    },
+    {"verb": "time"},
+    {"verb": "wait", "aliases": ["z"], "args": "number", "default": 10},
+)
+
+_END = None
+_COMMAND_SEPARATOR = re.compile(r"\.(?=\s|$)")
+_THEN = "then"
+
+
+def split_commands(line):
+    """Splits an input line into the words of each command it holds.
+
+    Commands are separated by a period followed by a space (or ending the
+    line), so file names such as ``game.json`` are kept whole, or by the
+    word ``then``.
+
+    Args:
+        line: The line as typed by the player.
+
+    Returns:
+        list: A list of word lists (lowercase), one per command.
+    """
+    commands = []
+    for part in _COMMAND_SEPARATOR.split(line.lower()):
+        words = []
+        for word in part.split():
+            if word == _THEN:
+                if words:
+                    commands.append(words)
+                words = []
+            else:
+                words.append(word)
+        if words:
+            commands.append(words)
+    return commands
+
+
+class Command:
+    """A compiled grammar entry.
+
+    Args:
+        entry: The grammar dictionary (see `GRAMMAR`).
+        fixed_args: Arguments supplied by the phrase itself (e.g. the
+            direction of ``n``) instead of parsed from the input.
+    """
+
+    __slots__ = (
+        "verb", "handler", "shape", "preposition", "default", "prompt", "usage", "fixed_args",
+    )
+
+    def __init__(self, entry, fixed_args=None):
+        self.verb = entry["verb"]
+        self.handler = entry.get("handler", self.verb)
+        self.shape = entry.get("args", "none")
+        self.preposition = entry.get("preposition")
+        self.default = entry.get("default")
+        self.prompt = entry.get("prompt")
+        self.usage = entry.get("usage", self.prompt)
+        self.fixed_args = fixed_args
+
+    def parse_args(self, words, directions):
+        """Parses the words following the verb phrase.
+
+        Args:
+            words: The remaining input words.
+            directions: The direction abbreviations table.
+
+        Returns:
+            tuple: (args, error). `args` is the tuple of handler arguments, or
+            None with `error` holding the message to show instead.
+        """
+        if self.fixed_args is not None:
+            return self.fixed_args, None
+        shape = self.shape
+        if shape == "none":
+            return (), None
+        if shape == "number":
+            if words and words[0].isdigit():
+                return (int(words[0]),), None
+            return (self.default,), None
+        if shape == "split":
+            # Without the preposition (even with no words at all) the
+            # command shows its usage rather than its prompt.
+            if self.preposition not in words:
+                return None, self.usage
+            split = words.index(self.preposition)
+            first = " ".join(words[:split])
+            second = " ".join(words[split + 1:])
+            if first and second:
+                return (first, second), None
+            return None, self.prompt
+        if not words:
+            return None, self.prompt
+        if shape == "text":
+            return (" ".join(words),), None
+        if shape == "word":
+            return (words[0],), None
+        if shape == "direction":
+            return (directions.get(words[0], words[0]),), None
+        raise ValueError(f"Unknown argument shape: {shape}")
+
+
+class CommandGrammar:
+    """A trie of verb phrases mapping input words to compiled commands.
+
+    Args:
+        grammar: An iterable of grammar entries. Defaults to `GRAMMAR`.
+        directions: Direction words, each of which becomes a ``move``
+            command. Defaults to `DIRECTION_WORDS`.
+    """
+
+    def __init__(self, grammar=GRAMMAR, directions=DIRECTION_WORDS):
+        self._root = {}
+        self.directions = dict(directions)
+        for word, direction in self.directions.items():
+            self.add_phrase(word, Command({"verb": direction, "handler": "move"}, (direction,)))
+        for entry in grammar:
+            self.add_verb(entry)
+
+    def add_verb(self, entry):
+        """Compiles a grammar entry and adds its verb and aliases to the trie.
+
+        Args:
+            entry: The grammar dictionary.
+
+        Returns:
+            Command: The compiled command.
+        """
+        command = Command(entry)
+        for phrase in (entry["verb"], *entry.get("aliases", ())):
+            self.add_phrase(phrase, command)
+        return command
+
+    def add_phrase(self, phrase, command):
+        """Maps a (possibly multi-word) phrase to a command.
+
+        Args:
+            phrase: The words that select the command, e.g. ``"talk to"``.
+            command: The compiled command.
+        """
+        node = self._root
+        for word in phrase.split():
+            node = node.setdefault(word, {})
+        node[_END] = command
+
+    def match(self, words):
+        """Finds the longest verb phrase at the start of the input.
+
+        Args:
+            words: The input words.
+
+        Returns:
+            tuple: (command, length) where `length` is the number of words the
+            phrase used, or (None, 0) if no phrase matches.
+        """
+        node = self._root
+        found, length = None, 0
+        for position, word in enumerate(words):
+            node = node.get(word)
+            if node is None:
+                break
+            command = node.get(_END)
+            if command is not None:
+                found, length = command, position + 1
+        return found, length
+
+    def parse(self, words):
+        """Resolves input words to a command and its arguments.
+
+        Args:
+            words: The input words (lowercase).
+
+        Returns:
+            tuple: (command, args, error). `command` is None for unknown
+            verbs; otherwise either `args` holds the handler arguments or
+            `error` the prompt to show.
+        """
+        command, length = self.match(words)
+        if command is None:
+            return None, None, None
+        args, error = command.parse_args(words[length:], self.directions)
+        return command, args, error
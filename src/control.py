@@ -3,7 +3,10 @@
 This module contains the Control class, which manages the game's main loop,
 processing user input and interacting with the Game instance.
 """
+import time
+from src.commands import CommandGrammar, split_commands
 from src.game import Game
+from src.startup import finish as finish_startup, phase
 
 
 class Control:
@@ -13,53 +16,197 @@ class Control:
     Game object, and displays the results to the user.
     """
 
-    def __init__(self):
+    def __init__(self, game=None, metrics=None, slowlog=None):
         """Initializes the Control class.
 
-        Sets up the game instance, the 'done' flag, and the direction mappings.
+        Sets up the game instance, the 'done' flag and the command grammar.
 
         Args:
-            None
+            game: The Game to control. A new one is created if omitted.
+            metrics: A `src.metrics.CommandMetrics` recording how long each
+                command takes, or None to not measure commands. With metrics,
+                the ``stats`` command shows them.
+            slowlog: A `src.slowlog.SlowCommandLog` logging the commands
+                slower than its threshold, or None.
 
         Returns:
             None
         """
         self.done = False
-        self.game = Game()
-        self.directions = {
-            "n": "north",
-            "north": "north",
-            "s": "south",
-            "south": "south",
-            "e": "east",
-            "east": "east",
-            "w": "west",
-            "west": "west",
-            "ne": "northeast",
-            "northeast": "northeast",
-            "nw": "northwest",
-            "northwest": "northwest",
-            "se": "southeast",
-            "southeast": "southeast",
-            "sw": "southwest",
-            "southwest": "southwest",
-            "u": "up",
-            "up": "up",
-            "d": "down",
-            "down": "down",
-        }
-        self.aliases = {
-            "l": "look",
-            "i": "inventory",
-            "inv": "inventory",
-            "x": "examine",
-            "ex": "examine",
-            "get": "take",
-            "g": "take",
-            "wait": "wait",
-            "z": "wait",
-            "time": "time",
+        if game is None:
+            with phase("Game.__init__"):
+                game = Game()
+        self.game = game
+        with phase("command grammar"):
+            self.grammar = CommandGrammar()
+        self.directions = self.grammar.directions
+        # Handlers are Control methods, or the names of Game methods (looked
+        # up on each call, so the game can be replaced or patched).
+        self.handlers = {
+            "quit": self.quit,
+            "move": "move_player",
+            "look": "get_location_description",
+            "take": "take_item",
+            "drop": "drop_item",
+            "inventory": "get_inventory",
+            "examine": "examine_item",
+            "talk": "talk_to_character",
+            "save": "save_game",
+            "load": "load_game",
+            "open": "open_item",
+            "close": "close_item",
+            "put": "put_item",
+            "time": self.time,
+            "wait": self.wait,
         }
+        self.metrics = metrics
+        self.slowlog = slowlog
+        if metrics is not None:
+            self.register_command({"verb": "stats"}, self.stats)
+
+    def register_command(self, entry, handler):
+        """Adds a verb to the grammar.
+
+        Args:
+            entry: The grammar dictionary (see `src.commands.GRAMMAR`).
+            handler: Called with the parsed arguments; returns the text to
+                show, or None. A string names a Game method instead.
+
+        Returns:
+            None
+        """
+        command = self.grammar.add_verb(entry)
+        self.handlers[command.handler] = handler
+
+    def handle_line(self, line):
+        """Runs every command on an input line.
+
+        Commands are separated by periods or ``then`` (see
+        `src.commands.split_commands`) and run in order until one quits the
+        game. Each command runs its own global event checks, exactly as
+        it would on a line of its own. If a command raises an exception,
+        the game's flight recorder (if any) records it and dumps its trace
+        before the exception propagates.
+
+        Args:
+            line: The line as typed by the player.
+
+        Returns:
+            list: The responses to show, in order.
+        """
+        outputs = []
+        game = self.game
+        if self.slowlog is not None:
+            self.slowlog.line(self, line)
+        try:
+            for words in split_commands(line):
+                output = self.handle_command(words)
+                if output is not None:
+                    outputs.append(output)
+                if self.done:
+                    break
+        except Exception as e:
+            if game.recorder is not None:
+                game.recorder.crashed(e, game)
+            raise
+        return outputs
+
+    def handle_command(self, words):
+        """Runs one command.
+
+        Args:
+            words: The input words (lowercase).
+
+        Returns:
+            str: The text to show the player, or None.
+        """
+        recorder = self.game.recorder
+        if self.game.dialogue_active:
+            if recorder is not None:
+                recorder.append(("command", time.time(), " ".join(words), "dialogue"))
+            if words[0] in ["quit", "exit", "bye"]:
+                self.game.end_dialogue()
+                return "You stop talking."
+            if words[0].isdigit():
+                if self.slowlog is not None:
+                    return self.slowlog.call(
+                        self, words, "dialogue", self.game.make_dialogue_choice, (int(words[0]),), 0
+                    )
+                if self.metrics is not None:
+                    return self.metrics.call(
+                        "dialogue", self.game.make_dialogue_choice, (int(words[0]),), words[0]
+                    )
+                return self.game.make_dialogue_choice(int(words[0]))
+            return "Please enter the number of your choice, or 'quit' to end the conversation."
+
+        slowlog = self.slowlog
+        if slowlog is not None:
+            start = time.perf_counter_ns()
+        command, args, error = self.grammar.parse(words)
+        if slowlog is not None:
+            parse_ns = time.perf_counter_ns() - start
+        if recorder is not None:
+            recorder.append(("command", time.time(), " ".join(words), command and command.handler))
+        if command is None:
+            return "Unknown command."
+        if error is not None:
+            return error
+        handler = self.handlers[command.handler]
+        if isinstance(handler, str):
+            handler = getattr(self.game, handler)
+        if slowlog is not None:
+            return slowlog.call(self, words, command.handler, handler, args, parse_ns)
+        if self.metrics is not None:
+            return self.metrics.call(command.handler, handler, args, " ".join(words))
+        return handler(*args)
+
+    def quit(self):
+        """Ends the main loop.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self.done = True
+
+    def time(self):
+        """Reports the in-game date and time.
+
+        Args:
+            None
+
+        Returns:
+            str: The formatted date and time.
+        """
+        return self.game.time_system.get_date_time_string()
+
+    def stats(self):
+        """Reports how long commands have taken (only registered with metrics).
+
+        Args:
+            None
+
+        Returns:
+            str: The metrics table.
+        """
+        return self.metrics.report()
+
+    def wait(self, minutes):
+        """Lets time pass.
+
+        Args:
+            minutes: The number of minutes to wait.
+
+        Returns:
+            str: The wait message followed by any timed event messages.
+        """
+        msgs = self.game.pass_time(minutes)
+        text = f"You wait for {minutes} minutes."
+        if msgs:
+            text += "\n" + "\n".join(msgs)
+        return text
 
     def main_game_loop(self):
         """The main game loop.
@@ -75,127 +222,9 @@ class Control:
         """
         print("Welcome to TextGameTemplate!")
         print(self.game.get_location_description(arrival=True))
+        finish_startup()
         while not self.done:
-            raw_input = input("> ").lower().split()
-            if not raw_input:
-                continue
-
-            if self.game.dialogue_active:
-                if raw_input[0] in ["quit", "exit", "bye"]:
-                    self.game.end_dialogue()
-                    print("You stop talking.")
-                elif raw_input[0].isdigit():
-                    print(self.game.make_dialogue_choice(int(raw_input[0])))
-                else:
-                    print("Please enter the number of your choice, or 'quit' to end the conversation.")
-                continue
-
-            # Use raw input instead of filtering stop words
-            user_input = raw_input
-            if not user_input:
-                continue
-
-            command = user_input[0]
-            if command in self.aliases:
-                command = self.aliases[command]
-
-            if command == "quit":
-                self.done = True
-            elif command in self.directions:
-                direction = self.directions[command]
-                print(self.game.move_player(direction))
-            elif command == "go":
-                if len(user_input) > 1:
-                    direction = user_input[1]
-                    if direction in self.directions:
-                        direction = self.directions[direction]
-                    print(self.game.move_player(direction))
-                else:
-                    print("Go where?")
-            elif command == "look":
-                print(self.game.get_location_description())
-            elif command == "take":
-                if len(user_input) > 1:
-                    item = " ".join(user_input[1:])
-                    print(self.game.take_item(item))
-                else:
-                    print("Take what?")
-            elif command == "drop":
-                if len(user_input) > 1:
-                    item = " ".join(user_input[1:])
-                    print(self.game.drop_item(item))
-                else:
-                    print("Drop what?")
-            elif command == "inventory":
-                print(self.game.get_inventory())
-            elif command == "examine":
-                if len(user_input) > 1:
-                    item_name = " ".join(user_input[1:])
-                    print(self.game.examine_item(item_name))
-                else:
-                    print("Examine what?")
-            elif command == "talk":
-                if len(user_input) > 1:
-                    # check for "talk to <name>"
-                    # But we filtered "to" ? Wait, "to" is not in stop words ["a", "an", "the"]
-                    if user_input[1] == "to":
-                        if len(user_input) > 2:
-                            char_name = " ".join(user_input[2:])
-                            print(self.game.talk_to_character(char_name))
-                        else:
-                            print("Talk to whom?")
-                    else:
-                        char_name = " ".join(user_input[1:])
-                        print(self.game.talk_to_character(char_name))
-                else:
-                    print("Talk to whom?")
-            elif command == "save":
-                if len(user_input) > 1:
-                    filename = user_input[1]
-                    print(self.game.save_game(filename))
-                else:
-                    print("Save to which file?")
-            elif command == "load":
-                if len(user_input) > 1:
-                    filename = user_input[1]
-                    print(self.game.load_game(filename))
-                else:
-                    print("Load from which file?")
-            elif command == "open":
-                if len(user_input) > 1:
-                    item = " ".join(user_input[1:])
-                    print(self.game.open_item(item))
-                else:
-                    print("Open what?")
-            elif command == "close":
-                if len(user_input) > 1:
-                    item = " ".join(user_input[1:])
-                    print(self.game.close_item(item))
-                else:
-                    print("Close what?")
-            elif command == "put":
-                # put item in container
-                # Need to find "in"
-                if "in" in user_input:
-                    idx = user_input.index("in")
-                    item = " ".join(user_input[1:idx])
-                    container = " ".join(user_input[idx+1:])
-                    if item and container:
-                        print(self.game.put_item(item, container))
-                    else:
-                        print("Put what in what?")
-                else:
-                     print("Usage: put <item> in <container>")
-            elif command == "time":
-                print(self.game.time_system.get_date_time_string())
-            elif command == "wait":
-                minutes = 10  # default wait time
-                if len(user_input) > 1 and user_input[1].isdigit():
-                    minutes = int(user_input[1])
-                print(f"You wait for {minutes} minutes.")
-                msgs = self.game.pass_time(minutes)
-                if msgs:
-                    print("\n".join(msgs))
-            else:
-                print("Unknown command.")
+            outputs = self.handle_line(input("> "))
+            if outputs:
+                print("\n".join(outputs))
         print("Thanks for playing!")
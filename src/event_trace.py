@@ -0,0 +1,158 @@
+"""Tracing of event, condition and action evaluation.
+
+This module contains the EventTracer class. Attached to a Game (as its
+`tracer`), it counts and times every condition check, every event trigger
+processed for a room, item or character, every action performed and every
+global event check, attributed to the content that caused them, and reports
+the entries that cost the most time. Content authors use it to find the few
+events that dominate the cost of a command.
+
+Games without a tracer only pay for checking that they have none.
+"""
+import time
+from src.model import Character, Item, Room
+
+OTHER = "(command)"
+
+
+def source_label(source):
+    """Returns a short name for the content holding some events.
+
+    Args:
+        source: A Room, Item or Character (or a plain dictionary).
+
+    Returns:
+        str: For example ``room cellar`` or ``item lamp``.
+    """
+    if isinstance(source, Room):
+        return f"room {source.id}"
+    if isinstance(source, Item):
+        return f"item {source.name}"
+    if isinstance(source, Character):
+        return f"character {source.name}"
+    name = source.get("id") or source.get("name")
+    return f"{type(source).__name__.lower()} {name}"
+
+
+class EventTracer:
+    """Counts and times event processing per kind, detail and source.
+
+    Each entry is keyed by (kind, detail, source):
+
+    - ``events``: a trigger (the detail, e.g. ``enter``) processed for a room,
+      item or character.
+    - ``global``: one global event (the source, e.g. ``global 3``) checked and
+      possibly run, and ``global pass`` for a whole check of the global events.
+    - ``condition``: a condition check, attributed to the event being
+      processed.
+    - ``action``: an action of a type (the detail), attributed to the event
+      that performed it.
+
+    Times are inclusive: an event's time includes its conditions and actions.
+    Conditions and actions outside any event (dialogue options, timers) are
+    attributed to ``(command)``.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self._sources = []
+
+    def run(self, kind, detail, source, function, *args):
+        """Runs a function and records its time under an entry.
+
+        Args:
+            kind: The kind of entry (see the class description).
+            detail: The trigger or action type, or "".
+            source: The label of the content being processed, which
+                conditions and actions run by `function` are attributed to,
+                or None to use the current one.
+            function: The callable to run.
+            *args: Its arguments.
+
+        Returns:
+            The function's return value.
+        """
+        if source is None:
+            source = self._sources[-1] if self._sources else OTHER
+            pushed = False
+        else:
+            self._sources.append(source)
+            pushed = True
+        start = time.perf_counter_ns()
+        try:
+            result = function(*args)
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            if pushed:
+                self._sources.pop()
+            key = (kind, detail, source)
+            entry = self.entries.get(key)
+            if entry is None:
+                self.entries[key] = [1, elapsed, 0]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+        if kind == "condition" and result:
+            self.entries[key][2] += 1
+        return result
+
+    def top(self, limit=20, kind=None):
+        """Returns the entries that took the most time.
+
+        Args:
+            limit: The most entries to return.
+            kind: Only return entries of this kind, if given.
+
+        Returns:
+            list: Dictionaries with "kind", "detail", "source", "calls",
+            "total_ms" and "mean_us" (and "passed" for conditions), most
+            expensive first.
+        """
+        rows = []
+        for (entry_kind, detail, source), (calls, nanos, passed) in self.entries.items():
+            if kind is not None and entry_kind != kind:
+                continue
+            row = {
+                "kind": entry_kind,
+                "detail": detail,
+                "source": source,
+                "calls": calls,
+                "total_ms": nanos / 1e6,
+                "mean_us": nanos / calls / 1e3,
+            }
+            if entry_kind == "condition":
+                row["passed"] = passed
+            rows.append(row)
+        rows.sort(key=lambda row: row["total_ms"], reverse=True)
+        return rows[:limit]
+
+    def report(self, limit=20):
+        """Formats the most expensive entries as a table.
+
+        Args:
+            limit: The most entries to list.
+
+        Returns:
+            str: The report.
+        """
+        lines = [f"{'total ms':>10}{'calls':>9}{'mean us':>10}  {'kind':<12}{'detail':<20}source"]
+        for row in self.top(limit):
+            detail = row["detail"]
+            if "passed" in row:
+                detail = f"{row['passed']} passed"
+            lines.append(
+                f"{row['total_ms']:>10.3f}{row['calls']:>9}{row['mean_us']:>10.1f}  "
+                f"{row['kind']:<12}{detail:<20}{row['source']}"
+            )
+        return "\n".join(lines)
+
+    def reset(self):
+        """Clears all entries.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self.entries = {}
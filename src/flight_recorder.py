@@ -0,0 +1,140 @@
+"""Per-session ring buffer of trace records for post-mortem debugging.
+
+This module contains the FlightRecorder class. Attached to a Game (as its
+`recorder`), it keeps the most recent records of what the game did: the
+commands run and the handlers they resolved to, the events and global events
+that fired, the actions performed (including every variable written) and the
+time that passed. Only the last `size` records are kept, as tuples holding
+references to the content involved, so recording costs an append and the
+memory per session is bounded. The records are formatted only when dumped,
+on demand or when a command raises an exception.
+
+Record shapes (the first field is the kind):
+
+    ("command", wall time, text, handler)   handler None for unknown verbs
+    ("event", source, trigger)              a room, item or character event
+    ("global", index)                       a global event that fired
+    ("action", type, action)                the action dictionary
+    ("time", minutes, total minutes)        time passed
+    ("error", wall time, description)       an exception escaped a command
+"""
+import json
+import os
+import time
+from collections import deque
+from src.event_trace import source_label
+from src.model import Model
+
+DEFAULT_SIZE = 200
+
+
+class FlightRecorder:
+    """Keeps the last records of a game's activity.
+
+    Args:
+        size: The number of records kept.
+        name: A name for the dump files (such as the session id).
+        dump_dir: Where `crashed` writes a dump, or None to not write one.
+    """
+
+    __slots__ = ("name", "dump_dir", "dumps", "_records", "append")
+
+    def __init__(self, size=DEFAULT_SIZE, name=None, dump_dir=None):
+        self.name = name
+        self.dump_dir = dump_dir
+        self.dumps = 0
+        self._records = deque(maxlen=size)
+        # Recording is the deque's own append: no Python-level call.
+        self.append = self._records.append
+
+    def __len__(self):
+        return len(self._records)
+
+    def records(self):
+        """Returns the kept records in a JSON-friendly form, oldest first.
+
+        Args:
+            None
+
+        Returns:
+            list: One dictionary per record, with its "kind" and fields.
+        """
+        result = []
+        for record in list(self._records):
+            kind = record[0]
+            if kind == "command":
+                entry = {"time": record[1], "command": record[2], "handler": record[3]}
+            elif kind == "event":
+                entry = {"source": source_label(record[1]), "trigger": record[2]}
+            elif kind == "global":
+                entry = {"index": record[1]}
+            elif kind == "action":
+                entry = {"type": record[1], "action": record[2]}
+            elif kind == "time":
+                entry = {"minutes": record[1], "total_minutes": record[2]}
+            else:
+                entry = {"time": record[1], "error": record[2]}
+            entry["kind"] = kind
+            result.append(entry)
+        return result
+
+    def dump(self, path, game=None, reason="requested"):
+        """Writes the records, and optionally the game state, to a file.
+
+        Args:
+            path: The file to write (compact JSON).
+            game: A Game whose current state is included, if given.
+            reason: Why the dump was written.
+
+        Returns:
+            str: The path written.
+        """
+        document = {"name": self.name, "dumped": time.time(), "reason": reason, "records": self.records()}
+        if game is not None:
+            try:
+                document["state"] = json.loads(game.dump_state(compact=True, dialogue=True))
+            except Exception as e:
+                document["state_error"] = repr(e)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(document, f, separators=(",", ":"), default=_plain)
+        os.replace(temporary, path)
+        self.dumps += 1
+        return path
+
+    def crashed(self, error, game=None):
+        """Records an exception and dumps the records if a dump directory is set.
+
+        Args:
+            error: The exception.
+            game: The game whose state is included in the dump.
+
+        Returns:
+            str: The dump file, or None if none was written.
+        """
+        self.append(("error", time.time(), f"{type(error).__name__}: {error}"))
+        if self.dump_dir is None:
+            return None
+        return self.dump(self.dump_path(), game, reason="exception")
+
+    def dump_path(self):
+        """Returns a new file name for a dump in the dump directory.
+
+        Args:
+            None
+
+        Returns:
+            str: The path.
+        """
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+        return os.path.join(self.dump_dir or ".", f"{self.name or 'trace'}-{stamp}-{self.dumps}.json")
+
+
+def _plain(value):
+    if isinstance(value, Model):
+        return value.to_dict()
+    try:
+        return list(value)
+    except TypeError:
+        return repr(value)
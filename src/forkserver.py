@@ -0,0 +1,199 @@
+"""Fork-per-connection TCP server.
+
+This module contains the ForkServer class. The parent process builds one
+fresh game and then only accepts connections: each connection is served by a
+child forked from the parent, which starts with the already built game in
+copy-on-write memory instead of loading the world itself. Children speak the
+same line protocol as `src.server.GameServer`, autosave on disconnect and
+accept ``resume <id>``.
+"""
+import os
+import selectors
+import signal
+import socket
+import threading
+from src.control import Control
+from src.server import PROMPT, _encode, _greeting, strip_telnet
+from src.sessions import SessionManager
+from src.startup import finish as finish_startup
+
+
+class ForkServer:
+    """Serves every TCP connection from its own forked process.
+
+    Args:
+        host: The interface to listen on.
+        port: The port to listen on (0 picks a free one).
+        save_dir: Where sessions are autosaved on disconnect or shutdown.
+        control_factory: Called with no arguments to build the game that
+            every child starts from.
+    """
+
+    def __init__(self, host="127.0.0.1", port=4000, save_dir="saves", control_factory=Control):
+        self.host = host
+        self.port = port
+        self.save_dir = save_dir
+        self.control_factory = control_factory
+        self.children = set()
+        self._listener = None
+        self._template = None
+        self._intro = None
+        self._stopping = False
+
+    def start(self):
+        """Builds the template game and starts listening. `port` is updated if a free port was requested.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._template = self.control_factory()
+        self._intro = SessionManager(control_factory=self.control_factory).intro()
+        self._listener = socket.create_server((self.host, self.port), backlog=1024)
+        self.port = self._listener.getsockname()[1]
+
+    def serve_forever(self):
+        """Forks a child per connection until `stop` is called (or SIGINT/SIGTERM is received).
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self._listener is None:
+            self.start()
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(sig, lambda signum, frame: self.stop())
+        selector = selectors.DefaultSelector()
+        selector.register(self._listener, selectors.EVENT_READ)
+        try:
+            while not self._stopping:
+                if selector.select(timeout=0.5):
+                    self._accept()
+                self._reap()
+        finally:
+            selector.close()
+            self.shutdown()
+
+    def stop(self):
+        """Asks `serve_forever` to shut down. Safe to call from any thread.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._stopping = True
+
+    def shutdown(self):
+        """Closes the listener and asks every child to autosave and exit.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(self.children):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self.children.clear()
+
+    def _accept(self):
+        try:
+            conn, _ = self._listener.accept()
+        except BlockingIOError:
+            return
+        pid = os.fork()
+        if pid:
+            conn.close()
+            self.children.add(pid)
+            return
+        status = 0
+        try:
+            self._listener.close()
+            self._serve_connection(conn)
+        except BaseException:
+            status = 1
+        finally:
+            os._exit(status)
+
+    def _reap(self):
+        while self.children:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if not pid:
+                return
+            self.children.discard(pid)
+
+    def _serve_connection(self, conn):
+        # Runs in the child. The template game is this process's own copy.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, _raise_system_exit)
+        sessions = SessionManager(self.save_dir, control_factory=lambda: self._template)
+        session = sessions.create(resumable=True)
+        reader = conn.makefile("rb")
+        try:
+            conn.sendall(_encode(_greeting(self._intro, session.id, self.save_dir)))
+            while True:
+                data = reader.readline()
+                if not data:
+                    break
+                line = strip_telnet(data).decode("utf-8", "replace").strip()
+                outputs = session.handle_line(line) if line else []
+                if session.done:
+                    outputs.append("Thanks for playing!")
+                    conn.sendall(_encode("\n".join(outputs) + "\n"))
+                    break
+                text = "\n".join(outputs) + "\n" + PROMPT if outputs else PROMPT
+                conn.sendall(_encode(text))
+        except SystemExit:
+            try:
+                conn.sendall(b"\r\nThe server is shutting down. Your game has been saved.\r\n")
+            except OSError:
+                pass
+        except OSError:
+            pass
+        finally:
+            sessions.close(session.id, save=not session.done)
+            conn.close()
+
+
+def _raise_system_exit(signum, frame):
+    raise SystemExit(0)
+
+
+def serve_forked(host="127.0.0.1", port=4000, save_dir="saves"):
+    """Runs a ForkServer until interrupted.
+
+    Args:
+        host: The interface to listen on.
+        port: The port to listen on.
+        save_dir: Where sessions are autosaved.
+
+    Returns:
+        None
+    """
+    server = ForkServer(host, port, save_dir)
+    server.start()
+    print(f"Serving on {host}:{server.port}, one process per connection")
+    finish_startup()
+    server.serve_forever()
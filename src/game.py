@@ -3,9 +3,16 @@
 This module contains the Game class, which manages the game's state,
 including the player's location, inventory, and the world map.
 """
+import copy
 import json
 from collections import defaultdict
+from src.character_index import CharacterCollection, CharacterIndex
+from src.event_trace import source_label
+from src.item_index import ItemCollection, ItemIndex, INVENTORY
 from src.loader import load_world_data, load_global_data
+from src.model import Event, Exits, Item, Model, WorldMap, build_world
+from src.startup import phase
+from src.vocabulary import phrase_words, refers_to
 from src.time_system import TimeSystem
 
 
@@ -16,22 +23,34 @@ class Game:
     interaction with items, and tracking the state of the world.
     """
 
-    def __init__(self):
+    def __init__(self, world=None, inventory_holder=INVENTORY):
         """Initializes the Game class.
 
         Sets up the initial player location, inventory, visited counts, and the world map.
 
         Args:
-            None
+            world: A SharedWorld (see `src.shared_world`) whose rooms, items,
+                characters, variables, time and global events this game uses
+                instead of loading its own. The game then only holds one
+                player's location, inventory, stats and conversation.
+            inventory_holder: The item index holder of the player's
+                inventory. Each player sharing a world needs their own.
 
         Returns:
             None
         """
         self.player_location = "start"
+        self.world = world
+        self.inventory_holder = inventory_holder
+        if world is None:
+            self.item_index = ItemIndex()
+            self.character_index = CharacterIndex()
+        else:
+            self.item_index = world.game.item_index
+            self.character_index = world.game.character_index
         self.inventory = []
         self.visited_counts = defaultdict(int)
         self.visited_counts["start"] = 1
-        self.game_state = {}
         self.player_stats = {
             "hp": 100,
             "max_hp": 100,
@@ -43,14 +62,55 @@ class Game:
         self.dialogue_active = False
         self.current_dialogue = None
         self.current_dialogue_node_id = None
+        self.current_character = None
         self.current_character_name = None
         self.processing_global_events = False
+        # An `src.event_trace.EventTracer` timing event processing, if any.
+        self.tracer = None
+        # An `src.flight_recorder.FlightRecorder` keeping recent activity, if any.
+        self.recorder = None
+        # Activity counters read by the metrics exporter (`src.prometheus`).
+        self.global_event_passes = 0
+        self.global_event_evaluations = 0
+        # How many times `restore_state` replaced the state (see `src.slowlog`).
+        self.restores = 0
+
+        if world is not None:
+            owner = world.game
+            self._world_map = owner.world_map
+            self.game_state = owner.game_state
+            self.time_system = owner.time_system
+            self.global_events = owner.global_events
+            return
 
+        self.game_state = {}
         self.time_system = TimeSystem()
 
         self._init_world_map()
         self._init_global_data()
 
+    @property
+    def inventory(self):
+        """ItemCollection: The items the player is carrying."""
+        return self._inventory
+
+    @inventory.setter
+    def inventory(self, items):
+        previous = getattr(self, "_inventory", None)
+        if previous is not None and previous is not items:
+            for item in list(previous):
+                self.item_index.detach(item)
+        self._inventory = self.item_index.adopt(items, self.inventory_holder)
+
+    @property
+    def world_map(self):
+        """WorldMap: The rooms of the world keyed by room id."""
+        return self._world_map
+
+    @world_map.setter
+    def world_map(self, rooms):
+        self._world_map = rooms if isinstance(rooms, WorldMap) else WorldMap(rooms)
+
     def save_game(self, filename):
         """Saves the current game state to a file.
 
@@ -61,22 +121,79 @@ class Game:
             str: A message indicating the result of the save operation.
         """
         try:
-            data = {
-                "player_location": self.player_location,
-                "inventory": self.inventory,
-                "visited_counts": dict(self.visited_counts),
-                "game_state": self.game_state,
-                "world_map": self.world_map,
-                "player_stats": self.player_stats,
-                "time_system": self.time_system.to_dict(),
-                "global_events": self.global_events
-            }
+            state = self.dump_state()
             with open(filename, 'w') as f:
-                json.dump(data, f, indent=4)
+                f.write(state)
             return f"Game saved to {filename}."
         except Exception as e:
             return f"Error saving game: {e}"
 
+    def dump_state(self, compact=False, dialogue=False):
+        """Serializes the game state to JSON.
+
+        Args:
+            compact: Whether to omit whitespace. Save files are indented.
+            dialogue: Whether to include the conversation in progress, which
+                save files leave out.
+
+        Returns:
+            str: The JSON document.
+        """
+        data = {
+            "player_location": self.player_location,
+            "inventory": self.inventory,
+            "visited_counts": dict(self.visited_counts),
+            "game_state": self.game_state,
+            "world_map": self.world_map,
+            "player_stats": self.player_stats,
+            "time_system": self.time_system.to_dict(),
+            "global_events": self.global_events
+        }
+        if dialogue:
+            data["dialogue"] = {
+                "active": self.dialogue_active,
+                "dialogue": self.current_dialogue,
+                "node_id": self.current_dialogue_node_id,
+                "character_name": self.current_character_name,
+            }
+        if compact:
+            return json.dumps(data, separators=(",", ":"), default=_to_json)
+        return json.dumps(data, indent=4, default=_to_json)
+
+    def dump_player(self):
+        """Serializes the player's own state to JSON.
+
+        In a shared world this is what one player's game adds to the world:
+        location, inventory, visited rooms and stats.
+
+        Args:
+            None
+
+        Returns:
+            str: The JSON document.
+        """
+        data = {
+            "player_location": self.player_location,
+            "inventory": self.inventory,
+            "visited_counts": dict(self.visited_counts),
+            "player_stats": self.player_stats,
+        }
+        return json.dumps(data, separators=(",", ":"), default=_to_json)
+
+    def restore_player(self, data):
+        """Replaces the player's own state with one produced by `dump_player`.
+
+        Args:
+            data: The parsed JSON document.
+
+        Returns:
+            None
+        """
+        self.player_location = data["player_location"]
+        self.inventory = [Item.from_dict(item) for item in data["inventory"]]
+        self.visited_counts = defaultdict(int, data["visited_counts"])
+        self.player_stats = data["player_stats"]
+
     def load_game(self, filename):
         """Loads a game state from a file.
 
@@ -89,32 +206,56 @@ class Game:
         try:
             with open(filename, 'r') as f:
                 data = json.load(f)
-
-            self.player_location = data["player_location"]
-            self.inventory = data["inventory"]
-            self.visited_counts = defaultdict(int, data["visited_counts"])
-            self.game_state = data["game_state"]
-            self.world_map = data["world_map"]
-            self.player_stats = data.get("player_stats", {
-                "hp": 100,
-                "max_hp": 100,
-                "str": 10,
-                "def": 10,
-                "spd": 10
-            })
-            self.global_events = data.get("global_events", [])
-
-            if "time_system" in data:
-                self.time_system.from_dict(data["time_system"])
-            else:
-                self.time_system = TimeSystem()
-
+            self.restore_state(data)
             return f"Game loaded from {filename}."
         except FileNotFoundError:
             return f"Save file {filename} not found."
         except Exception as e:
             return f"Error loading game: {e}"
 
+    def restore_state(self, data):
+        """Replaces the game state with one produced by `dump_state`.
+
+        Args:
+            data: The parsed JSON document.
+
+        Returns:
+            None
+        """
+        self.restores += 1
+        self.player_location = data["player_location"]
+        self.item_index = ItemIndex()
+        self.inventory = [Item.from_dict(item) for item in data["inventory"]]
+        self.visited_counts = defaultdict(int, data["visited_counts"])
+        self.game_state = data["game_state"]
+        self.world_map = build_world(data["world_map"])
+        self.player_stats = data.get("player_stats", {
+            "hp": 100,
+            "max_hp": 100,
+            "str": 10,
+            "def": 10,
+            "spd": 10
+        })
+        self.global_events = [Event.from_dict(event) for event in data.get("global_events", [])]
+
+        if "time_system" in data:
+            self.time_system.from_dict(data["time_system"])
+        else:
+            self.time_system = TimeSystem()
+
+        if "dialogue" in data:
+            dialogue = data["dialogue"]
+            self.dialogue_active = dialogue["active"]
+            self.current_dialogue = dialogue["dialogue"]
+            self.current_dialogue_node_id = dialogue["node_id"]
+            self.current_character_name = dialogue["character_name"]
+
+        self.rebuild_item_index()
+        self.character_index.rebuild(self.world_map)
+        if self.dialogue_active:
+            # The conversation continues with the loaded copy of the NPC.
+            self.current_character = self._room_characters().find(self.current_character_name)
+
     def _name_matches(self, item_name, input_name):
         """Checks if the user input matches the item name, allowing for articles.
 
@@ -136,11 +277,151 @@ class Game:
         return False
 
     def _init_world_map(self):
-        self.world_map = load_world_data()
+        with phase("load_world_data"):
+            data = load_world_data()
+        with phase("build world"):
+            self.world_map = build_world(data)
+        with phase("index items"):
+            self.rebuild_item_index()
+        with phase("index characters"):
+            self.character_index.rebuild(self.world_map)
+
+    def rebuild_item_index(self):
+        """Rebuilds the world-wide item location index.
+
+        Item collections keep the index up to date as items move. Code that
+        replaces item lists inside `world_map` directly can call this to
+        adopt them and resynchronize the index.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self.item_index.rebuild(self.world_map, self._inventories())
+
+    def _inventories(self):
+        """Returns every inventory in the world, keyed by item index holder.
+
+        Args:
+            None
+
+        Returns:
+            dict: The inventory collections. Only this player's, unless the
+            world is shared.
+        """
+        if self.world is not None:
+            return self.world.inventories()
+        return {self.inventory_holder: self.inventory}
+
+    def _room_items(self, room_id=None):
+        """Returns the item collection of a room, adopting a plain list if needed.
+
+        Args:
+            room_id: The room id. Defaults to the player's location.
+
+        Returns:
+            ItemCollection: The room's items.
+        """
+        if room_id is None:
+            room_id = self.player_location
+        room = self.world_map[room_id]
+        items = room.contents
+        if not isinstance(items, ItemCollection):
+            items = room.contents = self.item_index.adopt(items, room_id)
+        return items
+
+    def _room_characters(self, room_id=None):
+        """Returns a room's character collection, adopting a plain list if needed.
+
+        Args:
+            room_id: The room id. Defaults to the player's location.
+
+        Returns:
+            CharacterCollection: The room's characters.
+        """
+        if room_id is None:
+            room_id = self.player_location
+        room = self.world_map[room_id]
+        characters = room.characters
+        if not isinstance(characters, CharacterCollection):
+            characters = room.characters = self.character_index.adopt(characters, room_id)
+        return characters
+
+    def _find_character_here(self, character_name, scan=True):
+        """Resolves a noun phrase to a character in the current location.
+
+        Candidates come from the character vocabulary index. If the index
+        knows no match, the room is scanned once (when `scan` is True) in case
+        characters were changed behind the index's back.
+
+        Args:
+            character_name: The phrase provided by the user.
+            scan: Whether to fall back to scanning the room.
+
+        Returns:
+            tuple: (character, prompt)
+                character: The character dictionary, or None.
+                prompt: A disambiguation question if the phrase fits several
+                    different characters, otherwise None.
+        """
+        words = phrase_words(character_name)
+        characters = self._room_characters()
+        if not words or not characters:
+            return None, None
+        found = [
+            char for char in self.character_index.vocabulary.lookup(words)
+            if char in characters and refers_to(char, words)
+        ]
+        if not found and scan:
+            found = [char for char in characters if refers_to(char, words)]
+            for char in found:
+                self.character_index.attach(char, characters)
+        return self._disambiguate(found, words)
+
+    def find_character(self, character_name):
+        """Finds a character anywhere in the world by exact name.
+
+        Args:
+            character_name: The character's name.
+
+        Returns:
+            tuple: (character, room_id), or (None, None) if there is no such character.
+        """
+        for attempt in range(2):
+            for character in self.character_index.find(character_name):
+                room_id = self.character_index.location(character)
+                room = self.world_map.get(room_id)
+                if (character.get("name") == character_name and room is not None
+                        and character in self._room_characters(room_id)):
+                    return character, room_id
+            if attempt == 0:
+                # Rooms or character lists were replaced directly; resync once.
+                self.character_index.rebuild(self.world_map)
+        return None, None
+
+    def _contents(self, container):
+        """Returns the contents of a container, adopting a plain list if needed.
+
+        Args:
+            container: The container item dictionary.
+
+        Returns:
+            ItemCollection: The container's contents, or an empty tuple if it
+            has none.
+        """
+        contents = container.get("contents")
+        if contents is None:
+            return ()
+        if not isinstance(contents, ItemCollection):
+            contents = container["contents"] = self.item_index.adopt(contents, container)
+        return contents
 
     def _init_global_data(self):
-        data = load_global_data()
-        self.global_events = data.get("events", [])
+        with phase("global data"):
+            data = load_global_data()
+            self.global_events = [Event.from_dict(event) for event in data.get("events", [])]
 
     def check_condition(self, condition):
         """Checks if a condition is met.
@@ -153,9 +434,14 @@ class Game:
         """
         if not condition:
             return True
+        if self.tracer is not None:
+            return self.tracer.run("condition", "", None, self._evaluate_condition, condition)
+        return self._evaluate_condition(condition)
 
+    def _evaluate_condition(self, condition):
         if "not" in condition:
-            if self.check_condition(condition["not"]):
+            negated = condition["not"]
+            if not negated or self._evaluate_condition(negated):
                 return False
 
         if "has_item" in condition:
@@ -224,27 +510,7 @@ class Game:
             prop = condition["item_state"].get("property")
             value = condition["item_state"].get("value")
 
-            # Find item
-            target_item = None
-            # Check inventory
-            found = self._find_item_system(self.inventory, item_name)
-            if found:
-                target_item = found
-            else:
-                # Check room
-                found = self._find_item_system(self.world_map[self.player_location]["items"], item_name)
-                if found:
-                    target_item = found
-                else:
-                     # Check all rooms? Expensive but maybe needed.
-                     # For now let's assume item must be near.
-                     # Actually, users might want to check state of item anywhere.
-                     # Let's search all rooms.
-                     for room in self.world_map.values():
-                         found = self._find_item_system(room["items"], item_name)
-                         if found:
-                             target_item = found
-                             break
+            target_item = self._find_item_anywhere(item_name)
 
             if not target_item:
                 return False # Item not found, condition fails
@@ -254,13 +520,8 @@ class Game:
 
         # Check NPC stats (only valid if we are in a dialogue with a character)
         if ("npc_stat_ge" in condition or "npc_stat_le" in condition) and self.current_character_name:
-            current_npc = None
-            room = self.world_map[self.player_location]
-            if "characters" in room:
-                for char in room["characters"]:
-                    if char["name"] == self.current_character_name:
-                        current_npc = char
-                        break
+            # The dialogue session holds the NPC, so no room scan is needed.
+            current_npc = self.current_character
 
             if current_npc:
                 npc_stats = current_npc.get("stats", {})
@@ -291,30 +552,49 @@ class Game:
             return []
 
         self.processing_global_events = True
+        self.global_event_passes += 1
         messages = []
 
         try:
             if not hasattr(self, 'global_events'):
                 return messages
 
-            for event in self.global_events:
-                # Skip if not repeatable and already triggered
-                if not event.get("repeatable", False) and event.get("triggered", False):
-                    continue
-
-                if self.check_condition(event.get("condition")):
-                    # Mark as triggered
-                    event["triggered"] = True
-
-                    for action in event.get("actions", []):
-                        msg = self.perform_action(action)
-                        if msg:
-                            messages.append(msg)
+            tracer = self.tracer
+            if tracer is not None:
+                tracer.run("global pass", "", "global", self._run_global_events, messages, tracer)
+            else:
+                self._run_global_events(messages)
         finally:
             self.processing_global_events = False
 
         return messages
 
+    def _run_global_events(self, messages, tracer=None):
+        evaluated = 0
+        for index, event in enumerate(self.global_events):
+            # Skip if not repeatable and already triggered
+            if event.triggered and not event.repeatable:
+                continue
+
+            evaluated += 1
+            if tracer is not None:
+                tracer.run("global", "", f"global {index}", self._run_global_event, index, event, messages)
+            else:
+                self._run_global_event(index, event, messages)
+        self.global_event_evaluations += evaluated
+
+    def _run_global_event(self, index, event, messages):
+        if self.check_condition(event.condition):
+            # Mark as triggered
+            event.triggered = True
+            if self.recorder is not None:
+                self.recorder.append(("global", index))
+
+            for action in event.actions or ():
+                msg = self.perform_action(action)
+                if msg:
+                    messages.append(msg)
+
     def pass_time(self, minutes):
         """Advances time and processes triggered events.
 
@@ -324,12 +604,20 @@ class Game:
         Returns:
             list: List of messages from triggered events.
         """
-        triggered_actions = self.time_system.advance_time(minutes)
+        expired = self.time_system.advance(minutes)
+        if self.recorder is not None:
+            self.recorder.append(("time", minutes, self.time_system.total_minutes))
         messages = []
-        for action in triggered_actions:
-            msg = self.perform_action(action)
-            if msg:
-                messages.append(msg)
+        for timer in expired:
+            owner = timer.get("owner")
+            if owner is not None and owner != self.inventory_holder:
+                # Another player's timer, in a shared world.
+                self.world.run_timer(owner, timer["actions"])
+                continue
+            for action in timer["actions"]:
+                msg = self.perform_action(action)
+                if msg:
+                    messages.append(msg)
 
         # Check global events after time passes
         global_msgs = self.check_global_events()
@@ -346,6 +634,13 @@ class Game:
         Returns:
             str: A message if the action produces output, None otherwise.
         """
+        if self.recorder is not None:
+            self.recorder.append(("action", action.get("type"), action))
+        if self.tracer is not None:
+            return self.tracer.run("action", action.get("type"), None, self._perform_action, action)
+        return self._perform_action(action)
+
+    def _perform_action(self, action):
         action_type = action.get("type")
 
         if action_type == "print":
@@ -354,7 +649,10 @@ class Game:
         elif action_type == "start_timer":
             minutes = action.get("minutes", 0)
             timer_actions = action.get("actions", [])
-            self.time_system.schedule_event(minutes, timer_actions)
+            # In a shared world the clock is shared, but the actions are
+            # this player's.
+            owner = self.inventory_holder if self.world is not None else None
+            self.time_system.schedule_event(minutes, timer_actions, owner)
 
         elif action_type == "set_true":
             self.game_state[action["target"]] = True
@@ -368,19 +666,32 @@ class Game:
         elif action_type == "modify_room":
             room_id = action.get("room_id")
             if room_id in self.world_map:
-                self.world_map[room_id][action["property"]] = action["value"]
+                room = self.world_map[room_id]
+                if action["property"] == "items":
+                    for item in list(room.get("items", [])):
+                        self.item_index.detach(item)
+                    # Content data is shared by every firing (and every
+                    # player of a shared world), so the room gets copies.
+                    items = [Item.from_dict(item) for item in copy.deepcopy(action["value"])]
+                    room["items"] = self.item_index.adopt(items, room_id)
+                elif action["property"] == "characters":
+                    for character in list(room.get("characters", [])):
+                        self.character_index.detach(character)
+                    room["characters"] = self.character_index.adopt(action["value"], room_id)
+                else:
+                    room[action["property"]] = action["value"]
 
         elif action_type == "add_item":
             item = action.get("item")
             if item:
-                self.inventory.append(item)
+                self.inventory.append(Item.from_dict(copy.deepcopy(item)))
 
         elif action_type == "remove_item":
             item_name = action.get("item_name")
-            for item in self.inventory:
-                 if item["name"] == item_name:
-                      self.inventory.remove(item)
-                      break
+            for item in self.item_index.find(item_name):
+                if self.item_index.parent(item) is self.inventory:
+                    self.inventory.remove(item)
+                    break
 
         elif action_type == "modify_player_stat":
             stat = action["stat"]
@@ -410,26 +721,10 @@ class Game:
             prop = action.get("property")
             value = action.get("value")
 
-            target_item = None
-            found = self._find_item_system(self.inventory, item_name)
-            if found:
-                target_item = found
-            else:
-                # Check current room first
-                current_room_items = self.world_map[self.player_location]["items"]
-                found = self._find_item_system(current_room_items, item_name)
-                if found:
-                    target_item = found
-                else:
-                    # Check all rooms
-                    for room in self.world_map.values():
-                        found = self._find_item_system(room["items"], item_name)
-                        if found:
-                            target_item = found
-                            break
+            target_item = self._find_item_anywhere(item_name)
 
             if target_item:
-                target_item[prop] = value
+                self.item_index.set_property(target_item, prop, value)
 
                 # Check global events immediately after item change
                 msgs = self.check_global_events()
@@ -472,23 +767,34 @@ class Game:
                 messages (list): A list of messages produced by the events.
                 blocked (bool): True if an action blocked the operation, False otherwise.
         """
+        events = source.get("events")
+        if not events or trigger not in events:
+            return [], False
+        if self.recorder is not None:
+            self.recorder.append(("event", source, trigger))
+        if self.tracer is not None:
+            return self.tracer.run(
+                "events", trigger, source_label(source), self._process_events, events[trigger]
+            )
+        return self._process_events(events[trigger])
+
+    def _process_events(self, events):
         messages = []
         blocked = False
-        if "events" in source and trigger in source["events"]:
-            for event in source["events"][trigger]:
-                if self.check_condition(event.get("condition")):
-                    for action in event.get("actions", []):
-                        if action.get("type") == "block":
-                            blocked = True
-                            if "message" in action:
-                                messages.append(action["message"])
-                            # If blocked, we usually stop processing further events for this trigger
-                            # or at least signal blocking.
-                            return messages, blocked
-
-                        msg = self.perform_action(action)
-                        if msg:
-                            messages.append(msg)
+        for event in events:
+            if self.check_condition(event.get("condition")):
+                for action in event.get("actions", []):
+                    if action.get("type") == "block":
+                        blocked = True
+                        if "message" in action:
+                            messages.append(action["message"])
+                        # If blocked, we usually stop processing further events for this trigger
+                        # or at least signal blocking.
+                        return messages, blocked
+
+                    msg = self.perform_action(action)
+                    if msg:
+                        messages.append(msg)
         return messages, blocked
 
     def _get_article(self, word):
@@ -547,28 +853,28 @@ class Game:
 
         if arrival:
             # Add transition text if present
-            if "transition_text" in room:
-                description_parts.append(room["transition_text"])
+            if room.transition_text is not None:
+                description_parts.append(room.transition_text)
 
             count = self.visited_counts[self.player_location]
 
             # Check for first arrival text
-            if count == 1 and "first_arrival_text" in room:
-                description_parts.append(room["first_arrival_text"])
+            if count == 1 and room.first_arrival_text is not None:
+                description_parts.append(room.first_arrival_text)
             # Check for nth arrival text
-            elif "nth_arrival_text" in room and count in room["nth_arrival_text"]:
-                description_parts.append(room["nth_arrival_text"][count])
+            elif room.nth_arrival_text and count in room.nth_arrival_text:
+                description_parts.append(room.nth_arrival_text[count])
             else:
                 description_parts.append(room["description"])
         else:
             # Just looking around
             description_parts.append(room["description"])
 
-        items = room["items"]
+        items = room.contents
         if items:
             description_parts.append(f"You see {self._format_item_list(items)}.")
 
-        characters = room.get("characters", [])
+        characters = room.characters
         if characters:
             char_names = [char["name"] for char in characters]
             description_parts.append("You see " + ", ".join(char_names) + ".")
@@ -586,8 +892,8 @@ class Game:
             such as the new room description or an error message if blocked.
         """
         current_room = self.world_map[self.player_location]
-        if direction in current_room["exits"]:
-            next_location = current_room["exits"][direction]
+        next_location = current_room.exits.get(direction)
+        if next_location is not None:
 
             # Check specific directional exit events first (for blocks)
             exit_trigger = f"exit_{direction}"
@@ -626,24 +932,20 @@ class Game:
         else:
             return "You can't go that way."
 
-    def _contains_recursive(self, container, item):
-        """Checks if a container recursively contains an item.
+    def _is_inside(self, item, container):
+        """Checks if an item is a container or is nested anywhere inside it.
+
+        Walks up the item's parent chain in the item index, so the cost is
+        proportional to the nesting depth rather than the container's contents.
 
         Args:
-            container: The container dictionary to search in.
-            item: The item dictionary to search for.
+            item: The item dictionary to check.
+            container: The container dictionary.
 
         Returns:
-            bool: True if item is found inside container (recursively), False otherwise.
+            bool: True if item is container or inside it (recursively), False otherwise.
         """
-        if container is item:
-            return True
-
-        if container.get("is_container"):
-            for child in container.get("contents", []):
-                if self._contains_recursive(child, item):
-                    return True
-        return False
+        return self.item_index.is_inside(item, container)
 
     def _find_item_recursive(self, items_list, item_name, container_name=None):
         """Recursively finds an item in a list of items (and their open containers).
@@ -665,7 +967,7 @@ class Game:
 
             if item.get("is_container") and item.get("is_open"):
                 found, parent, source = self._find_item_recursive(
-                    item.get("contents", []),
+                    self._contents(item),
                     item_name,
                     item["name"]
                 )
@@ -689,11 +991,222 @@ class Game:
                 return item
 
             if item.get("is_container"):
-                found = self._find_item_system(item.get("contents", []), item_name)
+                found = self._find_item_system(self._contents(item), item_name)
                 if found:
                     return found
         return None
 
+    def _find_item_anywhere(self, item_name):
+        """Finds an item anywhere in the world, ignoring container state.
+
+        The inventory and the current room are searched first. Items elsewhere
+        are resolved through the item index rather than by scanning every room.
+
+        Args:
+            item_name: Name of item to find.
+
+        Returns:
+            item: The found item dictionary, or None.
+        """
+        found = self._find_item_system(self.inventory, item_name)
+        if found:
+            return found
+
+        found = self._find_item_system(self._room_items(), item_name)
+        if found:
+            return found
+
+        stale = False
+        for name in self._indexed_names(item_name):
+            for item in self.item_index.find(name):
+                if self._is_index_entry_current(item):
+                    return item
+                stale = True
+
+        if stale:
+            # Something moved items behind the index's back; resync once.
+            self.rebuild_item_index()
+            for name in self._indexed_names(item_name):
+                items = self.item_index.find(name)
+                if items:
+                    return items[0]
+        return None
+
+    def _indexed_names(self, input_name):
+        """Returns the item names that `_name_matches` would accept for an input.
+
+        Args:
+            input_name: The name provided by the user.
+
+        Returns:
+            list: The candidate item names.
+        """
+        names = [input_name]
+        for article in ("the ", "a ", "an "):
+            if input_name.startswith(article):
+                names.append(input_name[len(article):])
+        return names
+
+    def _is_index_entry_current(self, item):
+        """Checks that the index's recorded location for an item is still true.
+
+        Args:
+            item: The item dictionary.
+
+        Returns:
+            bool: True if the item is still where the index says it is.
+        """
+        while True:
+            location = self.item_index.location(item)
+            if location is None:
+                return False
+            collection, holder = location
+            if item not in collection:
+                return False
+            if holder == self.inventory_holder:
+                return collection is self.inventory
+            if isinstance(holder, str):
+                room = self.world_map.get(holder)
+                if room is None:
+                    # Another player's inventory, in a shared world.
+                    return self._inventories().get(holder) is collection
+                return room.get("items") is collection
+            if holder.get("contents") is not collection:
+                return False
+            item = holder
+
+    def _resolve_item(self, phrase, scopes, scan=False):
+        """Resolves a noun phrase to an item through the vocabulary index.
+
+        Candidates come from the item vocabulary index and are kept if they
+        are visible from one of the scopes, which only walks up each
+        candidate's parent chain. Item collections and `ItemIndex.set_property`
+        keep the index current, so a miss is final; `scan` is a consistency
+        check for items changed behind the index's back, which rescans the
+        scopes on a miss.
+
+        Args:
+            phrase: The phrase provided by the user.
+            scopes: (collection, min_depth, max_depth) tuples, searched in
+                order. Depth 0 is directly in the collection, and each open
+                container the item is nested in adds one. A max_depth of None
+                allows any depth.
+            scan: Whether to fall back to scanning the scopes on a miss.
+
+        Returns:
+            tuple: (item, parent, source, prompt)
+                item: The found item dictionary, or None.
+                parent: The collection holding the item.
+                source: Name of the container holding it, or None if top-level.
+                prompt: A disambiguation question if the phrase fits several
+                    different items, otherwise None.
+        """
+        words = phrase_words(phrase)
+        if not words:
+            return None, None, None, None
+
+        candidates = self.item_index.vocabulary.lookup(words)
+        for collection, min_depth, max_depth in scopes:
+            visible = []
+            for item in candidates:
+                depth = self._visible_depth(item, collection)
+                if (depth is not None and depth >= min_depth
+                        and (max_depth is None or depth <= max_depth) and refers_to(item, words)):
+                    visible.append((depth, item))
+            if visible:
+                visible.sort(key=lambda entry: entry[0])
+                item, prompt = self._disambiguate([item for _, item in visible], words)
+                if prompt:
+                    return None, None, None, prompt
+                depth = next(depth for depth, found in visible if found is item)
+                parent = self.item_index.parent(item)
+                return item, parent, parent.holder["name"] if depth else None, None
+
+        if scan:
+            for collection, min_depth, max_depth in scopes:
+                found = self._scan_items(collection, words, min_depth, max_depth)
+                if found:
+                    item, parent, source = found
+                    # Re-register so the next lookup hits the index.
+                    self.item_index.attach(item, parent)
+                    return item, parent, source, None
+        return None, None, None, None
+
+    def _visible_depth(self, item, collection):
+        """Returns how deeply an item is nested in open containers within a collection.
+
+        Args:
+            item: The item dictionary.
+            collection: The collection to look from.
+
+        Returns:
+            int: 0 if the item is directly in `collection`, 1 if inside an open
+            container there, and so on; None if it cannot be seen from there.
+        """
+        depth = 0
+        while True:
+            parent = self.item_index.parent(item)
+            if parent is None or item not in parent:
+                return None
+            if parent is collection:
+                return depth
+            holder = parent.holder
+            if (isinstance(holder, str) or holder.get("contents") is not parent
+                    or not (holder.get("is_container") and holder.get("is_open"))):
+                return None
+            item = holder
+            depth += 1
+
+    def _scan_items(self, items_list, words, min_depth, max_depth, container_name=None, depth=0):
+        """Scans a list of items (and their open containers) for a phrase.
+
+        Args:
+            items_list: The list of items to search.
+            words: The words of the phrase (see `src.vocabulary.phrase_words`).
+            min_depth: The shallowest nesting depth to accept.
+            max_depth: The deepest nesting depth to accept, or None.
+            container_name: The name of the container these items are in.
+            depth: The nesting depth of `items_list`.
+
+        Returns:
+            tuple: (item, parent_list, source_name), or None.
+        """
+        for item in items_list:
+            if depth >= min_depth and refers_to(item, words):
+                return item, items_list, container_name
+
+            if item.get("is_container") and item.get("is_open") and (max_depth is None or depth < max_depth):
+                found = self._scan_items(
+                    self._contents(item), words, min_depth, max_depth, item["name"], depth + 1
+                )
+                if found:
+                    return found
+        return None
+
+    def _disambiguate(self, candidates, words):
+        """Picks the object a phrase refers to, or asks which one was meant.
+
+        An exact name match wins over partial matches. Several candidates
+        with the same name are interchangeable, so the first is used.
+
+        Args:
+            candidates: Matching items or characters, most preferred first.
+            words: The words of the phrase.
+
+        Returns:
+            tuple: (object, prompt); object is None when a prompt is returned
+            or there are no candidates.
+        """
+        if not candidates:
+            return None, None
+        exact = [obj for obj in candidates if phrase_words(obj["name"]) == words]
+        candidates = exact or candidates
+        names = list(dict.fromkeys(obj["name"] for obj in candidates))
+        if len(names) == 1:
+            return candidates[0], None
+        options = [f"the {name}" for name in names]
+        return None, f"Which do you mean, {', '.join(options[:-1])} or {options[-1]}?"
+
     def take_item(self, item_name):
         """Takes an item from the current location or a container and adds it to the player's inventory.
 
@@ -703,17 +1216,21 @@ class Game:
         Returns:
             str: A message indicating whether the item was successfully taken or not.
         """
-        # 1. Check current location items (recursive)
-        location_items = self.world_map[self.player_location]["items"]
-        item, parent, source = self._find_item_recursive(location_items, item_name)
+        # Items in the room (including open containers), then items inside
+        # open containers in the inventory. Items directly in the inventory
+        # are already held.
+        item, parent, source, prompt = self._resolve_item(
+            item_name, [(self._room_items(), 0, None), (self.inventory, 1, None)]
+        )
+        if prompt:
+            return prompt
 
         if item:
             msgs, blocked = self.process_events(item, "take")
             if blocked:
                 return "\n".join(msgs)
 
-            parent.remove(item)
-            self.inventory.append(item)
+            parent.move(item, self.inventory)
 
             if source:
                 msg = f"You take the {item['name']} from the {source}."
@@ -724,29 +1241,6 @@ class Game:
             output_msgs.extend(msgs)
             return "\n".join(output_msgs)
 
-        # 2. Check inside open containers in inventory (recursive)
-        # We must ignore items that are directly in inventory (not in a container),
-        # as the user already has them.
-        for inv_item in self.inventory:
-            if inv_item.get("is_container") and inv_item.get("is_open"):
-                item, parent, source = self._find_item_recursive(
-                    inv_item.get("contents", []),
-                    item_name,
-                    inv_item["name"]
-                )
-                if item:
-                    msgs, blocked = self.process_events(item, "take")
-                    if blocked:
-                        return "\n".join(msgs)
-
-                    parent.remove(item)
-                    self.inventory.append(item)
-
-                    msg = f"You take the {item['name']} from the {source}."
-                    output_msgs = [msg]
-                    output_msgs.extend(msgs)
-                    return "\n".join(output_msgs)
-
         return f"There is no {item_name} here."
 
     def put_item(self, item_name, container_name):
@@ -760,48 +1254,38 @@ class Game:
             str: Result message.
         """
         # Find item in inventory
-        item_to_put = None
-        for item in self.inventory:
-            if self._name_matches(item["name"], item_name):
-                item_to_put = item
-                break
+        item_to_put, _, _, prompt = self._resolve_item(item_name, [(self.inventory, 0, 0)])
+        if prompt:
+            return prompt
 
         if not item_to_put:
             return f"You don't have a {item_name}."
 
-        # Find container (using recursive search)
-        target_container = None
-
-        # Check inventory for container
-        item, _, _ = self._find_item_recursive(self.inventory, container_name)
-        if item:
-            target_container = item
-
-        # Check room for container
-        if not target_container:
-            item, _, _ = self._find_item_recursive(self.world_map[self.player_location]["items"], container_name)
-            if item:
-                target_container = item
+        # Find container in the inventory or the room (including open containers)
+        target_container, _, _, prompt = self._resolve_item(
+            container_name, [(self.inventory, 0, None), (self._room_items(), 0, None)]
+        )
+        if prompt:
+            return prompt
 
         if not target_container:
             return f"You don't see a {container_name} here."
 
         if not target_container.get("is_container"):
-            return f"The {container_name} is not a container."
+            return f"The {target_container['name']} is not a container."
 
         if not target_container.get("is_open"):
-            return f"The {container_name} is closed."
+            return f"The {target_container['name']} is closed."
 
-        if self._contains_recursive(item_to_put, target_container):
+        if self._is_inside(target_container, item_to_put):
             return "You can't put an item inside itself or its own contents."
 
         # Move item
-        self.inventory.remove(item_to_put)
         if "contents" not in target_container:
             target_container["contents"] = []
-        target_container["contents"].append(item_to_put)
+        self.inventory.move(item_to_put, self._contents(target_container))
 
-        return f"You put the {item_name} in the {container_name}."
+        return f"You put the {item_to_put['name']} in the {target_container['name']}."
 
     def open_item(self, item_name):
         """Opens a container.
@@ -812,15 +1296,15 @@ class Game:
         Returns:
             str: Result message.
         """
-        target = None
-        # Check inventory
-        item, _, _ = self._find_item_recursive(self.inventory, item_name)
-        if item:
-            target = item
+        # Check inventory, then the room
+        target, _, _, prompt = self._resolve_item(
+            item_name, [(self.inventory, 0, None), (self._room_items(), 0, None)]
+        )
+        if prompt:
+            return prompt
 
-        # Check room
         if not target:
-            item, _, _ = self._find_item_recursive(self.world_map[self.player_location]["items"], item_name)
+            item, _, _ = self._find_item_recursive(self._room_items(), item_name)
             if item:
                 target = item
 
@@ -831,13 +1315,13 @@ class Game:
             return f"You can't open that."
 
         if target.get("is_locked"):
-             return f"The {item['name']} is locked."
+             return f"The {target['name']} is locked."
 
         if target.get("is_open"):
-            return f"The {item['name']} is already open."
+            return f"The {target['name']} is already open."
 
         target["is_open"] = True
-        return f"You open the {item['name']}."
+        return f"You open the {target['name']}."
 
     def close_item(self, item_name):
         """Closes a container.
@@ -848,15 +1332,15 @@ class Game:
         Returns:
             str: Result message.
         """
-        target = None
-        # Check inventory
-        item, _, _ = self._find_item_recursive(self.inventory, item_name)
-        if item:
-            target = item
+        # Check inventory, then the room
+        target, _, _, prompt = self._resolve_item(
+            item_name, [(self.inventory, 0, None), (self._room_items(), 0, None)]
+        )
+        if prompt:
+            return prompt
 
-        # Check room
         if not target:
-            item, _, _ = self._find_item_recursive(self.world_map[self.player_location]["items"], item_name)
+            item, _, _ = self._find_item_recursive(self._room_items(), item_name)
             if item:
                 target = item
 
@@ -867,10 +1351,10 @@ class Game:
             return f"You can't close that."
 
         if not target.get("is_open"):
-            return f"The {item['name']} is already closed."
+            return f"The {target['name']} is already closed."
 
         target["is_open"] = False
-        return f"You close the {item['name']}."
+        return f"You close the {target['name']}."
 
     def drop_item(self, item_name):
         """Drops an item from the player's inventory into the current location.
@@ -881,20 +1365,22 @@ class Game:
         Returns:
             str: A message indicating whether the item was successfully dropped or not.
         """
-        for item in self.inventory:
-            if self._name_matches(item["name"], item_name):
-                msgs, blocked = self.process_events(item, "drop")
+        item, _, _, prompt = self._resolve_item(item_name, [(self.inventory, 0, 0)])
+        if prompt:
+            return prompt
 
-                if blocked:
-                    return "\n".join(msgs)
+        if item:
+            msgs, blocked = self.process_events(item, "drop")
 
-                self.inventory.remove(item)
-                self.world_map[self.player_location]["items"].append(item)
+            if blocked:
+                return "\n".join(msgs)
+
+            self.inventory.move(item, self._room_items())
 
-                output_msgs = [f"You drop the {item['name']}."]
-                output_msgs.extend(msgs)
+            output_msgs = [f"You drop the {item['name']}."]
+            output_msgs.extend(msgs)
 
-                return "\n".join(output_msgs)
+            return "\n".join(output_msgs)
         return f"You don't have a {item_name}."
 
     def get_inventory(self):
@@ -953,26 +1439,25 @@ class Game:
                 return desc + "\n" + "\n".join(msgs)
             return desc
 
-        # Check inventory (including nested)
-        item, _, _ = self._find_item_recursive(self.inventory, item_name)
-        if item:
-            return self._get_examination_desc(item)
-
-        # Check current location items (including nested)
-        item, _, _ = self._find_item_recursive(self.world_map[self.player_location]["items"], item_name)
+        # Inventory, then the room (both including open containers), then the
+        # room's characters.
+        item, _, _, prompt = self._resolve_item(
+            item_name, [(self.inventory, 0, None), (self._room_items(), 0, None)]
+        )
+        if prompt:
+            return prompt
         if item:
             return self._get_examination_desc(item)
 
-        # Check current location characters
-        room = self.world_map[self.player_location]
-        if "characters" in room:
-            for char in room["characters"]:
-                if self._name_matches(char["name"], item_name):
-                    msgs, _ = self.process_events(char, "examine")
-                    desc = char["description"]
-                    if msgs:
-                        return desc + "\n" + "\n".join(msgs)
-                    return desc
+        char, prompt = self._find_character_here(item_name)
+        if prompt:
+            return prompt
+        if char is not None:
+            msgs, _ = self.process_events(char, "examine")
+            desc = char["description"]
+            if msgs:
+                return desc + "\n" + "\n".join(msgs)
+            return desc
 
         return f"You don't see a {item_name} here."
 
@@ -985,27 +1470,28 @@ class Game:
         Returns:
             str: The character's dialogue, or a message if the character is not found.
         """
-        room = self.world_map[self.player_location]
-        if "characters" in room:
-            for char in room["characters"]:
-                if self._name_matches(char["name"], character_name):
-                    msgs, blocked = self.process_events(char, "talk")
-                    if blocked:
-                        return "\n".join(msgs)
-
-                    dialogue = char.get("dialogue", "They have nothing to say.")
-
-                    if isinstance(dialogue, dict):
-                        # Start complex dialogue
-                        self.dialogue_active = True
-                        self.current_dialogue = dialogue
-                        self.current_dialogue_node_id = dialogue.get("start_node")
-                        self.current_character_name = char["name"]
-                        return self._get_dialogue_text(msgs)
-
-                    if msgs:
-                         return dialogue + "\n" + "\n".join(msgs)
-                    return f'{char["name"]} says: "{dialogue}"'
+        char, prompt = self._find_character_here(character_name)
+        if prompt:
+            return prompt
+        if char is not None:
+            msgs, blocked = self.process_events(char, "talk")
+            if blocked:
+                return "\n".join(msgs)
+
+            dialogue = char.get("dialogue", "They have nothing to say.")
+
+            if isinstance(dialogue, dict):
+                # Start complex dialogue
+                self.dialogue_active = True
+                self.current_dialogue = dialogue
+                self.current_dialogue_node_id = dialogue.get("start_node")
+                self.current_character = char
+                self.current_character_name = char["name"]
+                return self._get_dialogue_text(msgs)
+
+            if msgs:
+                 return dialogue + "\n" + "\n".join(msgs)
+            return f'{char["name"]} says: "{dialogue}"'
 
         return f"There is no one named {character_name} here."
 
@@ -1094,4 +1580,21 @@ class Game:
         self.dialogue_active = False
         self.current_dialogue = None
         self.current_dialogue_node_id = None
+        self.current_character = None
         self.current_character_name = None
+
+
+def _to_json(value):
+    """Serializes the game's model objects and item and character collections for `json.dump`.
+
+    Args:
+        value: An object the default JSON encoder cannot handle.
+
+    Returns:
+        The plain dict or list equivalent of the value.
+    """
+    if isinstance(value, (Model, Exits)):
+        return value.to_dict()
+    if isinstance(value, (ItemCollection, CharacterCollection)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
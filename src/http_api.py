@@ -0,0 +1,309 @@
+"""HTTP JSON API for driving game sessions with requests and responses.
+
+This module contains the ApiServer and ApiRequestHandler classes, built on
+the standard library's threading HTTP server with HTTP/1.1 keep-alive.
+
+Endpoints (all bodies are JSON):
+
+    POST   /sessions                      create a session -> {"session_id", "output"}
+    POST   /sessions/<id>/command         {"command": "take key"} -> {"output", "done", "location"}
+    GET    /sessions/<id>/room            -> {"location", "description"}
+    GET    /sessions/<id>/inventory       -> {"items", "text"}
+    POST   /sessions/<id>/save            {"slot": "name"} (optional) -> {"message"}
+    POST   /sessions/<id>/load            {"slot": "name"} (optional) -> {"message"}
+    GET    /sessions/<id>/trace           the flight recorder's records -> {"records"}
+    POST   /sessions/<id>/trace           dump the trace to the trace directory -> {"file"}
+    DELETE /sessions/<id>                 end a session
+    GET    /stats                         -> {"sessions", "started", "hibernated", "lines"}
+    POST   /admin/profile                 {"seconds": 10} (optional) sample the server's stacks
+                                          -> {"samples", "file", "collapsed"} (see `src.sampler`)
+
+The admin endpoint exists only on servers given an admin token, and requires
+an ``Authorization: Bearer <token>`` header.
+
+Save files always live in the server's save directory; clients choose only
+a slot name, through these endpoints or the ``save``/``load`` commands.
+"""
+import hmac
+import json
+import os
+import threading
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.metrics import CommandMetrics
+from src.prometheus import collect, start_exporter
+from src.sampler import install_signal_handler, profile_for, profile_path
+from src.sessions import SessionManager
+from src.startup import finish as finish_startup
+
+MAX_BODY = 64 * 1024
+MAX_PROFILE_SECONDS = 300
+_ACTIONS = ("command", "room", "inventory", "save", "load", "trace")
+
+
+class ApiError(Exception):
+    """An error reported to the client with an HTTP status code."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ApiRequestHandler(BaseHTTPRequestHandler):
+    """Routes API requests to the server's sessions."""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "TextGameTemplate"
+    # Headers and body are written separately; with Nagle's algorithm on,
+    # every keep-alive response would wait for the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def log_message(self, format, *args):
+        # Per-request logging to stderr costs more than the game logic.
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _dispatch(self, method):
+        self._body = b""
+        try:
+            # The body is always consumed so that an error response leaves
+            # the keep-alive connection ready for the next request.
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > MAX_BODY:
+                self.close_connection = True
+                raise ApiError(413, "Request body too large")
+            self._body = self.rfile.read(length) if length > 0 else b""
+            parts = [part for part in self.path.split("?", 1)[0].split("/") if part]
+            status, payload = self._route(method, parts)
+        except ApiError as e:
+            status, payload = e.status, {"error": e.message}
+        except ValueError as e:
+            status, payload = 400, {"error": str(e)}
+        except Exception:
+            # Logged like socketserver's handle_error, but the client still
+            # gets a response and the keep-alive connection stays usable.
+            traceback.print_exc()
+            status, payload = 500, {"error": "internal error"}
+        self._send(status, payload)
+
+    def _route(self, method, parts):
+        sessions = self.server.sessions
+        if parts == ["stats"] and method == "GET":
+            return 200, sessions.stats()
+        if parts == ["admin", "profile"]:
+            self._check_admin()
+            if method != "POST":
+                raise ApiError(405, "Method not allowed")
+            return 200, self._profile(self._read_json())
+        if not parts or parts[0] != "sessions":
+            raise ApiError(404, "Not found")
+
+        if len(parts) == 1:
+            if method != "POST":
+                raise ApiError(405, "Method not allowed")
+            session_id = self._read_json().get("session_id")
+            if session_id is not None and not sessions.owns(session_id):
+                raise ApiError(421, "Session id belongs to another worker")
+            session = sessions.create(session_id)
+            return 201, {"session_id": session.id, "output": sessions.intro()}
+
+        if not sessions.owns(parts[1]):
+            # Sharded mode: this connection was routed for another session.
+            raise ApiError(421, "Session is hosted by another worker; reconnect")
+        session = sessions.get(parts[1])
+        if session is None:
+            raise ApiError(404, f"No session {parts[1]}")
+        action = parts[2] if len(parts) > 2 else None
+
+        if action is None and method == "DELETE":
+            sessions.close(session.id, save=True)
+            return 200, {"session_id": session.id, "closed": True}
+        if action == "command" and method == "POST":
+            line = self._read_json().get("command")
+            if not isinstance(line, str):
+                raise ApiError(400, "Expected {\"command\": \"...\"}")
+            with session.lock:
+                output = session.handle_line(line)
+                return 200, {
+                    "output": output,
+                    "done": session.done,
+                    "location": session.game.player_location,
+                }
+        if action == "room" and method == "GET":
+            with session.lock:
+                game = session.game
+                return 200, {"location": game.player_location, "description": game.get_location_description()}
+        if action == "inventory" and method == "GET":
+            with session.lock:
+                game = session.game
+                return 200, {"items": [item["name"] for item in game.inventory], "text": game.get_inventory()}
+        if action in ("save", "load") and method == "POST":
+            if sessions.save_dir is None:
+                raise ApiError(503, "Saving is disabled on this server")
+            slot = self._read_json().get("slot")
+            with session.lock:
+                message = session.save_slot(slot) if action == "save" else session.load_slot(slot)
+            return 200, {"message": message}
+        if action == "trace" and method in ("GET", "POST"):
+            if session.recorder is None:
+                raise ApiError(503, "Tracing is disabled on this server")
+            if method == "GET":
+                return 200, {"records": session.recorder.records()}
+            if sessions.trace_dir is None:
+                raise ApiError(503, "Trace dumps are disabled on this server")
+            with session.lock:
+                path = session.dump_trace()
+            return 200, {"file": os.path.basename(path)}
+        if action is None or action in _ACTIONS:
+            raise ApiError(405, "Method not allowed")
+        raise ApiError(404, "Not found")
+
+    def _check_admin(self):
+        token = self.server.admin_token
+        if token is None:
+            raise ApiError(404, "Not found")
+        supplied = self.headers.get("Authorization", "")
+        if not hmac.compare_digest(supplied.encode("utf-8"), f"Bearer {token}".encode("utf-8")):
+            raise ApiError(403, "Admin token required")
+
+    def _profile(self, body):
+        seconds = body.get("seconds", 10)
+        if not isinstance(seconds, (int, float)) or not 0 < seconds <= MAX_PROFILE_SECONDS:
+            raise ApiError(400, f"seconds must be a number from 0 to {MAX_PROFILE_SECONDS}")
+        save_dir = self.server.sessions.save_dir
+        path = profile_path(os.path.join(save_dir, "profiles")) if save_dir is not None else None
+        try:
+            profiler = profile_for(seconds, path, stream=None)
+        except RuntimeError as e:
+            raise ApiError(409, str(e))
+        profiler.wait()
+        return {
+            "samples": profiler.samples,
+            "file": os.path.basename(path) if path is not None else None,
+            "collapsed": profiler.collapsed(),
+        }
+
+    def _read_json(self):
+        if not self._body:
+            return {}
+        try:
+            body = json.loads(self._body)
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            raise ApiError(400, "Request body is not valid JSON")
+        if not isinstance(body, dict):
+            raise ApiError(400, "Request body must be a JSON object")
+        return body
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class ApiServer(ThreadingHTTPServer):
+    """Serves the JSON API, handling each connection on its own thread.
+
+    Args:
+        host: The interface to listen on.
+        port: The port to listen on (0 picks a free one).
+        sessions: The SessionManager to use. Defaults to one autosaving to `save_dir`.
+        save_dir: Where sessions are saved.
+        verbose: Whether to log every request to stderr.
+        bind_and_activate: Whether to listen on `host` and `port`. Workers
+            serving connections accepted by a supervisor pass False.
+        admin_token: The bearer token admin requests must carry, or None to
+            serve no admin endpoints.
+    """
+
+    daemon_threads = True
+    # socketserver's default backlog of 5 resets bursts of new connections.
+    request_queue_size = 256
+
+    def __init__(self, host="127.0.0.1", port=8000, sessions=None, save_dir="saves", verbose=False,
+                 bind_and_activate=True, admin_token=None):
+        super().__init__((host, port), ApiRequestHandler, bind_and_activate)
+        self.sessions = sessions if sessions is not None else SessionManager(save_dir)
+        self.verbose = verbose
+        self.admin_token = admin_token
+
+    @property
+    def port(self):
+        """int: The port the server is listening on."""
+        return self.server_address[1]
+
+    def start_background(self):
+        """Serves requests on a daemon thread.
+
+        Args:
+            None
+
+        Returns:
+            threading.Thread: The serving thread.
+        """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """Stops serving, autosaves every session and closes the socket.
+
+        Args:
+            None
+
+        Returns:
+            list: The autosave files written.
+        """
+        self.shutdown()
+        saved = self.sessions.autosave_all()
+        self.server_close()
+        return saved
+
+
+def serve_http(host="127.0.0.1", port=8000, save_dir="saves", max_active=None, pool_size=0, metrics_port=None,
+               slowlog=None, admin_token=None):
+    """Runs an ApiServer until interrupted, then autosaves every session.
+
+    Args:
+        host: The interface to listen on.
+        port: The port to listen on.
+        save_dir: Where sessions are saved.
+        max_active: The most games kept in memory before idle sessions are
+            hibernated to disk, or None for no limit.
+        pool_size: The number of fresh games to keep built ahead of time.
+        metrics_port: If given, commands are timed and Prometheus metrics
+            are served on this port (see `src.prometheus`).
+        slowlog: A `src.slowlog.SlowCommandLog` for slow commands, or None.
+        admin_token: The bearer token enabling the admin endpoints, or None.
+
+    Returns:
+        None
+    """
+    metrics = CommandMetrics() if metrics_port is not None else None
+    sessions = SessionManager(save_dir, max_active=max_active, pool_size=pool_size, metrics=metrics, slowlog=slowlog)
+    server = ApiServer(host, port, sessions=sessions, admin_token=admin_token)
+    if metrics_port is not None:
+        start_exporter(lambda: collect(sessions), host, metrics_port)
+    if save_dir is not None:
+        install_signal_handler(os.path.join(save_dir, "profiles"))
+    print(f"Serving HTTP API on {host}:{server.port}")
+    finish_startup()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.sessions.autosave_all()
+        server.server_close()
@@ -0,0 +1,339 @@
+"""
+Item location index and id-keyed item collections.
+"""
+import copy
+import itertools
+from src.vocabulary import Vocabulary
+
+INVENTORY = "inventory"
+
+
+class ItemCollection:
+    """An insertion-ordered collection of items keyed by instance id.
+
+    Collections behave like the lists they replace (iteration, ``len``,
+    ``append``, ``remove``, indexing) but membership tests and removal are
+    O(1). Indexing walks from the nearer end, so it is O(1) only for the
+    first and last items. Membership is by identity: an item is in the collection only if
+    that exact item object was added to it.
+
+    Every collection belongs to a holder, which is a room id, an inventory
+    holder (``INVENTORY``, or one per player in a shared world) or the
+    container item whose ``contents`` it is, and reports every change to the
+    ``ItemIndex`` that created it.
+    """
+
+    __slots__ = ("_items", "holder", "_index")
+
+    def __init__(self, items=(), holder=None, index=None):
+        self._items = {}
+        self.holder = holder
+        self._index = index
+        for item in items:
+            self.append(item)
+
+    def append(self, item):
+        """Adds an item to the end of the collection.
+
+        If the item is currently held by another collection of the same
+        index it is moved here rather than duplicated.
+
+        Args:
+            item: The item dictionary.
+        """
+        self._index.attach(item, self)
+        self._items[item["instance_id"]] = item
+
+    def extend(self, items):
+        """Adds several items to the end of the collection.
+
+        Args:
+            items: An iterable of item dictionaries.
+        """
+        for item in items:
+            self.append(item)
+
+    def remove(self, item):
+        """Removes an item (and its contents) from the collection and the world.
+
+        Args:
+            item: The item dictionary.
+
+        Raises:
+            ValueError: If the item is not in the collection.
+        """
+        if item not in self:
+            raise ValueError("ItemCollection.remove(x): x not in collection")
+        del self._items[item["instance_id"]]
+        self._index.detach(item)
+
+    def pop(self, position=-1):
+        """Removes and returns the item at a position (the last by default).
+
+        Args:
+            position: The position of the item to remove.
+
+        Returns:
+            The removed item dictionary.
+        """
+        item = self[position]
+        self.remove(item)
+        return item
+
+    def move(self, item, destination):
+        """Moves an item to another collection, keeping its contents indexed.
+
+        Args:
+            item: The item dictionary.
+            destination: The collection receiving the item.
+
+        Raises:
+            ValueError: If the item is not in this collection.
+        """
+        if item not in self:
+            raise ValueError("ItemCollection.move(x): x not in collection")
+        del self._items[item["instance_id"]]
+        destination._items[item["instance_id"]] = item
+        self._index.reparent(item, destination)
+
+    def clear(self):
+        """Removes every item from the collection and the world."""
+        for item in list(self._items.values()):
+            self.remove(item)
+
+    def __contains__(self, item):
+        try:
+            return self._items.get(item.get("instance_id")) is item
+        except AttributeError:
+            return False
+
+    def __iter__(self):
+        return iter(self._items.values())
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, position):
+        # Walks from the nearer end, so the first and last items are O(1)
+        # and other positions O(distance to an end); slices copy.
+        if isinstance(position, slice):
+            return list(self._items.values())[position]
+        size = len(self._items)
+        if position < 0:
+            position += size
+        if not 0 <= position < size:
+            raise IndexError("ItemCollection index out of range")
+        if position <= size // 2:
+            return next(itertools.islice(iter(self._items.values()), position, None))
+        return next(itertools.islice(reversed(self._items.values()), size - 1 - position, None))
+
+    def __eq__(self, other):
+        if isinstance(other, (ItemCollection, list)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"ItemCollection({list(self._items.values())!r})"
+
+    def __deepcopy__(self, memo):
+        # Copies are detached from the world, so they are plain lists.
+        return [copy.deepcopy(item, memo) for item in self._items.values()]
+
+
+class ItemIndex:
+    """Tracks every item instance in the world and where it is.
+
+    Each item gets a stable ``instance_id`` (stored on the item so it survives
+    save/load) and a parent reference to the ``ItemCollection`` holding it.
+    Items are also indexed by name so that world-wide lookups do not have to
+    walk every room, and containment checks only walk up the parent chain. ``vocabulary`` indexes items by the words
+    players can refer to them by (see `src.vocabulary`).
+    """
+
+    def __init__(self):
+        self._items = {}
+        self._parents = {}
+        self._names = {}
+        self._by_name = {}
+        self._next_id = 1
+        self.vocabulary = Vocabulary()
+
+    def rebuild(self, world_map, inventories):
+        """Rebuilds the index from scratch, adopting any plain item lists.
+
+        Args:
+            world_map: The rooms of the world, keyed by room id.
+            inventories: The players' inventory collections, keyed by holder
+                (``INVENTORY`` for a single player).
+        """
+        self._items = {}
+        self._parents = {}
+        self._names = {}
+        self._by_name = {}
+        self.vocabulary.clear()
+        for room_id, room in world_map.items():
+            if "items" in room:
+                room["items"] = self.adopt(room["items"], room_id)
+        for holder, inventory in inventories.items():
+            self.adopt(inventory, holder)
+
+    def adopt(self, items, holder):
+        """Returns an indexed collection holding the given items.
+
+        Args:
+            items: A list or collection of item dictionaries.
+            holder: The room id, inventory holder or container owning the items.
+
+        Returns:
+            ItemCollection: The collection (`items` itself if already one).
+        """
+        if isinstance(items, ItemCollection) and items._index is self:
+            items.holder = holder
+            for item in items:
+                self._register(item, items)
+            return items
+        return ItemCollection(items or (), holder, self)
+
+    def attach(self, item, collection):
+        """Registers an item (and its contents) as held by a collection.
+
+        Args:
+            item: The item dictionary.
+            collection: The collection the item is being added to.
+        """
+        parent = self._parents.get(item.get("instance_id"))
+        if parent is not None and parent is not collection and item in parent:
+            # Keep a single owner per item: adding elsewhere is a move.
+            del parent._items[item["instance_id"]]
+            self.reparent(item, collection)
+            return
+        self._register(item, collection)
+
+    def detach(self, item):
+        """Forgets an item and, recursively, its contents.
+
+        Args:
+            item: The item dictionary.
+        """
+        instance_id = item.get("instance_id")
+        if self._items.get(instance_id) is not item:
+            return
+        del self._items[instance_id]
+        del self._parents[instance_id]
+        self._unname(instance_id)
+        self.vocabulary.discard(instance_id)
+        contents = item.get("contents")
+        if contents:
+            for child in contents:
+                self.detach(child)
+
+    def reparent(self, item, collection):
+        """Records that an indexed item now lives in another collection.
+
+        Args:
+            item: The item dictionary.
+            collection: The collection now holding the item.
+        """
+        self._parents[item["instance_id"]] = collection
+
+    def set_property(self, item, prop, value):
+        """Sets an item property, re-indexing the item if the change affects it.
+
+        Args:
+            item: The item dictionary.
+            prop: The property name.
+            value: The new value.
+        """
+        indexed = self._items.get(item.get("instance_id")) is item
+        if indexed and prop == "contents":
+            for child in list(item.get("contents") or ()):
+                self.detach(child)
+        item[prop] = value
+        if indexed and prop in ("name", "adjectives", "synonyms", "contents"):
+            self._register(item, self._parents[item["instance_id"]])
+
+    def get(self, instance_id):
+        """Returns the item with an instance id, or None."""
+        return self._items.get(instance_id)
+
+    def parent(self, item):
+        """Returns the collection holding an item, or None if not indexed."""
+        instance_id = item.get("instance_id")
+        if self._items.get(instance_id) is not item:
+            return None
+        return self._parents[instance_id]
+
+    def location(self, item):
+        """Returns where an item is recorded to be.
+
+        Args:
+            item: The item dictionary.
+
+        Returns:
+            tuple: (collection, holder), or None if the item is not indexed.
+        """
+        parent = self.parent(item)
+        if parent is None:
+            return None
+        return parent, parent.holder
+
+    def is_inside(self, item, container):
+        """Checks whether an item is a container or nested anywhere inside it.
+
+        Walks up the item's parent chain, so the cost is O(nesting depth).
+
+        Args:
+            item: The item dictionary.
+            container: The container item dictionary.
+
+        Returns:
+            bool: True if `item` is `container` or nested within it.
+        """
+        while item is not None:
+            if item is container:
+                return True
+            parent = self.parent(item)
+            if parent is None or not isinstance(parent.holder, dict):
+                return False
+            item = parent.holder
+        return False
+
+    def find(self, name):
+        """Returns the indexed items with an exact name.
+
+        Args:
+            name: The item name.
+
+        Returns:
+            list: The matching items, in the order they were indexed.
+        """
+        return list(self._by_name.get(name, {}).values())
+
+    def _register(self, item, collection):
+        instance_id = item.get("instance_id")
+        if not isinstance(instance_id, int) or self._items.get(instance_id, item) is not item:
+            # New item, or a copy of one that is already in the world.
+            instance_id = self._next_id
+            item["instance_id"] = instance_id
+        self._next_id = max(self._next_id, instance_id + 1)
+
+        self._items[instance_id] = item
+        self._parents[instance_id] = collection
+        self._unname(instance_id)
+        name = item.get("name")
+        self._names[instance_id] = name
+        self._by_name.setdefault(name, {})[instance_id] = item
+        self.vocabulary.add(instance_id, item)
+
+        if "contents" in item:
+            item["contents"] = self.adopt(item["contents"], item)
+
+    def _unname(self, instance_id):
+        name = self._names.pop(instance_id, None)
+        same_name = self._by_name.get(name)
+        if same_name is not None:
+            same_name.pop(instance_id, None)
+            if not same_name:
+                del self._by_name[name]
@@ -2,12 +2,13 @@ import json
 import os
 import copy
 from typing import Dict, Any
+from src.startup import phase
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
 
 def load_json_file(filepath: str) -> Dict[str, Any]:
     """Loads a JSON file and returns its content as a dictionary."""
-    with open(filepath, 'r') as f:
+    with phase("parse json"), open(filepath, 'r') as f:
         return json.load(f)
 
 def recursive_merge(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
@@ -28,12 +29,19 @@ def recursive_merge(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str,
             merged[key] = value
     return merged
 
+def _list_dir(path: str) -> list:
+    """Lists a data directory, or returns nothing if it does not exist."""
+    with phase("list directory"):
+        if not os.path.exists(path):
+            return []
+        return os.listdir(path)
+
 def load_items() -> Dict[str, Dict[str, Any]]:
     """Loads all item definitions from the data/items directory."""
     items = {}
     items_dir = os.path.join(DATA_DIR, "items")
-    if os.path.exists(items_dir):
-        for filename in os.listdir(items_dir):
+    with phase("load items"):
+        for filename in _list_dir(items_dir):
             if filename.endswith(".json"):
                 item_id = filename[:-5]
                 items[item_id] = load_json_file(os.path.join(items_dir, filename))
@@ -44,8 +52,8 @@ def load_templates() -> Dict[str, Dict[str, Any]]:
     """Loads all character templates from the data/templates directory."""
     templates = {}
     templates_dir = os.path.join(DATA_DIR, "templates")
-    if os.path.exists(templates_dir):
-        for filename in os.listdir(templates_dir):
+    with phase("load templates"):
+        for filename in _list_dir(templates_dir):
             if filename.endswith(".json"):
                 template_id = filename[:-5]
                 templates[template_id] = load_json_file(os.path.join(templates_dir, filename))
@@ -60,8 +68,8 @@ def load_characters() -> Dict[str, Dict[str, Any]]:
     templates = load_templates()
     characters = {}
     chars_dir = os.path.join(DATA_DIR, "characters")
-    if os.path.exists(chars_dir):
-        for filename in os.listdir(chars_dir):
+    with phase("load characters"):
+        for filename in _list_dir(chars_dir):
             if filename.endswith(".json"):
                 char_id = filename[:-5]
                 char_data = load_json_file(os.path.join(chars_dir, filename))
@@ -70,7 +78,8 @@ def load_characters() -> Dict[str, Dict[str, Any]]:
                     template_id = char_data["template"]
                     if template_id in templates:
                         # Recursively merge character data over the template
-                        char_data = recursive_merge(templates[template_id], char_data)
+                        with phase("merge template"):
+                            char_data = recursive_merge(templates[template_id], char_data)
                     else:
                         print(f"Warning: Template '{template_id}' not found for character '{char_id}'")
 
@@ -94,19 +103,21 @@ def load_world_data() -> Dict[str, Dict[str, Any]]:
     rooms_data = {}
 
     rooms_dir = os.path.join(DATA_DIR, "rooms")
-    if os.path.exists(rooms_dir):
-        for filename in os.listdir(rooms_dir):
-            if filename.endswith(".json"):
-                room = load_json_file(os.path.join(rooms_dir, filename))
-                room_id = room.get("id", filename[:-5])
-
+    with phase("load rooms"):
+        for filename in _list_dir(rooms_dir):
+            if not filename.endswith(".json"):
+                continue
+            room = load_json_file(os.path.join(rooms_dir, filename))
+            room_id = room.get("id", filename[:-5])
+            with phase("resolve references"):
                 # Process items
                 room_items = []
                 for item_ref in room.get("items", []):
                     if isinstance(item_ref, str):
                         if item_ref in items_data:
                             # Create a deep copy to ensure independence
-                            room_items.append(copy.deepcopy(items_data[item_ref]))
+                            with phase("deepcopy"):
+                                room_items.append(copy.deepcopy(items_data[item_ref]))
                         else:
                             print(f"Warning: Item '{item_ref}' not found for room '{room_id}'")
                     else:
@@ -118,7 +129,8 @@ def load_world_data() -> Dict[str, Dict[str, Any]]:
                 for char_ref in room.get("characters", []):
                     if isinstance(char_ref, str):
                         if char_ref in chars_data:
-                            room_chars.append(copy.deepcopy(chars_data[char_ref]))
+                            with phase("deepcopy"):
+                                room_chars.append(copy.deepcopy(chars_data[char_ref]))
                         else:
                             print(f"Warning: Character '{char_ref}' not found for room '{room_id}'")
                     else:
@@ -0,0 +1,205 @@
+"""Local load generator for the game servers.
+
+Opens many concurrent client sessions against a running server (the TCP
+server, or the HTTP API with ``--http``), sends each a sequence of commands
+and reports throughput and response latency percentiles. Run with
+``python -m src.loadgen --help``.
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import threading
+import time
+
+DEFAULT_COMMANDS = ("look", "n", "s", "take key", "drop key", "i", "x guard", "wait")
+PROMPT = b"> "
+
+
+def percentile(sorted_values, fraction):
+    """Returns a percentile of already sorted values (nearest rank).
+
+    Args:
+        sorted_values: The values, sorted ascending.
+        fraction: The percentile as a fraction, e.g. 0.99.
+
+    Returns:
+        float: The value, or 0.0 if there are none.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies, seconds, clients, errors=0):
+    """Builds the report for a load run.
+
+    Args:
+        latencies: Per-command response times in seconds.
+        seconds: The wall-clock duration of the run.
+        clients: The number of clients.
+        errors: The number of clients that failed.
+
+    Returns:
+        dict: The report.
+    """
+    latencies = sorted(latencies)
+    return {
+        "clients": clients,
+        "errors": errors,
+        "commands": len(latencies),
+        "seconds": seconds,
+        "commands_per_second": len(latencies) / seconds if seconds else 0.0,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50) * 1000,
+            "p95": percentile(latencies, 0.95) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000,
+            "max": (latencies[-1] if latencies else 0.0) * 1000,
+        },
+    }
+
+
+async def _tcp_client(host, port, commands, latencies, think_time, gate):
+    async with gate:
+        reader, writer = await asyncio.open_connection(host, port)
+    try:
+        await reader.readuntil(PROMPT)
+        for command in commands:
+            start = time.perf_counter()
+            writer.write(command.encode("utf-8") + b"\r\n")
+            await reader.readuntil(PROMPT)
+            latencies.append(time.perf_counter() - start)
+            if think_time:
+                await asyncio.sleep(think_time)
+        # Quitting ends the session without leaving an autosave behind.
+        writer.write(b"quit\r\n")
+        await reader.read()
+    finally:
+        writer.close()
+
+
+async def run_tcp_load(host, port, clients=100, commands=DEFAULT_COMMANDS, rounds=1, think_time=0.0,
+                       connect_limit=200):
+    """Runs many concurrent telnet-style clients against a GameServer.
+
+    Each client quits after its last command, so no autosaves are left.
+
+    Args:
+        host: The server host.
+        port: The server port.
+        clients: The number of concurrent connections.
+        commands: The commands each client sends per round.
+        rounds: How many times each client repeats the commands.
+        think_time: Seconds each client idles between commands.
+        connect_limit: The most connections opened at the same time.
+
+    Returns:
+        dict: The report (see `summarize`).
+    """
+    latencies = []
+    script = list(commands) * rounds
+    gate = asyncio.Semaphore(connect_limit)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(_tcp_client(host, port, script, latencies, think_time, gate) for _ in range(clients)),
+        return_exceptions=True
+    )
+    seconds = time.perf_counter() - start
+    errors = sum(1 for result in results if isinstance(result, BaseException))
+    return summarize(latencies, seconds, clients, errors)
+
+
+def _http_client(host, port, commands, latencies, errors):
+    # One keep-alive connection per client, like a browser tab.
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    headers = {"Content-Type": "application/json"}
+    try:
+        connection.request("POST", "/sessions", body=b"{}", headers=headers)
+        session_id = json.loads(connection.getresponse().read())["session_id"]
+        path = f"/sessions/{session_id}/command"
+        timings = []
+        for command in commands:
+            start = time.perf_counter()
+            connection.request("POST", path, body=json.dumps({"command": command}), headers=headers)
+            response = connection.getresponse()
+            response.read()
+            timings.append(time.perf_counter() - start)
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}")
+        connection.request("DELETE", f"/sessions/{session_id}")
+        connection.getresponse().read()
+        latencies.extend(timings)
+    except Exception:
+        errors.append(1)
+    finally:
+        connection.close()
+
+
+def run_http_load(host, port, clients=20, commands=DEFAULT_COMMANDS, rounds=1):
+    """Runs concurrent keep-alive clients against the HTTP API.
+
+    Each client creates a session, posts the commands and deletes the session.
+
+    Args:
+        host: The server host.
+        port: The server port.
+        clients: The number of concurrent clients (one thread each).
+        commands: The commands each client sends per round.
+        rounds: How many times each client repeats the commands.
+
+    Returns:
+        dict: The report (see `summarize`).
+    """
+    latencies = []
+    errors = []
+    script = list(commands) * rounds
+    threads = [
+        threading.Thread(target=_http_client, args=(host, port, script, latencies, errors))
+        for _ in range(clients)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    return summarize(latencies, seconds, clients, len(errors))
+
+
+def main(argv=None):
+    """Runs the load generator from the command line.
+
+    Args:
+        argv: The command line arguments. Defaults to sys.argv[1:].
+
+    Returns:
+        None
+    """
+    parser = argparse.ArgumentParser(description="Load generator for the game servers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4000)
+    parser.add_argument("--http", action="store_true", help="drive the HTTP API instead of the TCP server")
+    parser.add_argument("--clients", type=int, default=100, help="concurrent sessions")
+    parser.add_argument("--rounds", type=int, default=1, help="times each client repeats the commands")
+    parser.add_argument("--think", type=float, default=0.0, help="seconds idle between commands")
+    parser.add_argument("--commands", help="file of commands to send, one per line")
+    args = parser.parse_args(argv)
+
+    commands = DEFAULT_COMMANDS
+    if args.commands:
+        with open(args.commands, "r") as f:
+            commands = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+    if args.http:
+        report = run_http_load(args.host, args.port, args.clients, commands, args.rounds)
+    else:
+        report = asyncio.run(run_tcp_load(
+            args.host, args.port, args.clients, commands, args.rounds, args.think
+        ))
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
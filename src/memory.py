@@ -0,0 +1,210 @@
+"""Memory accounting for games and sessions.
+
+This module measures how much memory a Game holds and where it goes. The
+`memory_report` function walks everything a game references and splits the
+total into categories (the rooms, the items in them, characters and their
+dialogue, global events, timers, the inventory, the lookup indexes and the
+player's state). The `allocation_diff` function uses `tracemalloc` to show
+which source lines allocated the memory kept by a call, and
+`startup_allocations` applies it to loading the world and creating a
+session. Run with ``python -m src.memory --help``.
+"""
+import argparse
+import json
+import sys
+import threading
+import tracemalloc
+import types
+from collections import deque
+from src.control import Control
+from src.loader import load_world_data
+
+# Never walked into: code and classes every game shares.
+_SKIPPED_TYPES = (
+    type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+    types.CodeType, type(threading.Lock()), type(threading.RLock()),
+)
+CATEGORIES = (
+    "inventory", "items", "characters", "global_events", "timers", "rooms", "indexes", "state", "other",
+)
+
+
+def deep_size(root, seen=None, stop=()):
+    """Returns the memory held by an object and everything it references.
+
+    Args:
+        root: The object to measure.
+        seen: A set of ids of objects already counted, which are skipped (and
+            to which the objects counted now are added). Sharing one set
+            between calls counts every object once.
+        stop: Ids of objects not to count or walk into.
+
+    Returns:
+        int: The size in bytes, as reported by `sys.getsizeof`.
+    """
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        ident = id(obj)
+        if ident in seen or ident in stop or isinstance(obj, _SKIPPED_TYPES):
+            continue
+        seen.add(ident)
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+        elif not isinstance(obj, (str, bytes, int, float, bool)) and obj is not None:
+            attributes = getattr(obj, "__dict__", None)
+            if attributes is not None:
+                stack.append(attributes)
+            for cls in type(obj).__mro__:
+                slots = cls.__dict__.get("__slots__", ())
+                for slot in (slots,) if isinstance(slots, str) else slots:
+                    if slot not in ("__dict__", "__weakref__"):
+                        value = getattr(obj, slot, None)
+                        if value is not None:
+                            stack.append(value)
+    return size
+
+
+def memory_report(game):
+    """Measures a game's memory, split by category.
+
+    Every object is counted once, in the first category that reaches it, in
+    the order of `CATEGORIES`. The item and character indexes are not walked
+    into from the rooms, so they are counted under ``indexes``; strings and
+    numbers shared with other games are counted for each game.
+
+    Args:
+        game: The Game to measure.
+
+    Returns:
+        dict: Bytes per category (see `CATEGORIES`) and the "total".
+    """
+    seen = set()
+    stop = {id(game), id(game.item_index), id(game.character_index)}
+    rooms = list(game.world_map.values())
+    sizes = {
+        "inventory": deep_size(game.inventory, seen, stop),
+        "items": sum(deep_size(room.contents, seen, stop) for room in rooms),
+        "characters": sum(deep_size(room.characters, seen, stop) for room in rooms),
+        "global_events": deep_size(game.global_events, seen, stop),
+        "timers": deep_size(game.time_system, seen, stop),
+        "rooms": deep_size(game.world_map, seen, stop),
+    }
+    indexes = deep_size(game.item_index, seen, stop - {id(game.item_index)})
+    indexes += deep_size(game.character_index, seen, stop - {id(game.character_index)})
+    sizes["indexes"] = indexes
+    state = (
+        game.game_state, game.visited_counts, game.player_stats, game.current_dialogue,
+        game.current_character,
+    )
+    sizes["state"] = sum(deep_size(value, seen, stop) for value in state)
+    sizes["other"] = deep_size(game, seen, stop - {id(game)})
+    sizes["total"] = sum(sizes.values())
+    return sizes
+
+
+def allocation_diff(function, *args, top=10, key="lineno"):
+    """Shows where the memory kept by a call was allocated.
+
+    Tracing is started for the call if `tracemalloc` is not already
+    tracing (and stopped again afterwards).
+
+    Args:
+        function: The callable to run.
+        *args: Its arguments.
+        top: How many allocation sites to return.
+        key: How to group allocations: "lineno", "filename" or "traceback".
+
+    Returns:
+        tuple: (result, total, lines) where `result` is the function's return
+        value, `total` the net bytes allocated and still held, and `lines`
+        the largest allocation sites, formatted.
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = function(*args)
+        after = tracemalloc.take_snapshot()
+    finally:
+        if started:
+            tracemalloc.stop()
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    differences = after.filter_traces(filters).compare_to(before.filter_traces(filters), key)
+    total = sum(difference.size_diff for difference in differences)
+    return result, total, [str(difference) for difference in differences[:top]]
+
+
+def startup_allocations(top=10):
+    """Measures the memory allocated by loading the world and starting a session.
+
+    Args:
+        top: How many allocation sites to list per phase.
+
+    Returns:
+        dict: For "load_world_data" and "create_session", the net "bytes"
+        allocated and the largest allocation "sites".
+    """
+    report = {}
+    for phase, function in (("load_world_data", load_world_data), ("create_session", Control)):
+        _, total, lines = allocation_diff(function, top=top)
+        report[phase] = {"bytes": total, "sites": lines}
+    return report
+
+
+def format_report(sizes):
+    """Formats a memory report as a table.
+
+    Args:
+        sizes: A report from `memory_report` (or summed reports).
+
+    Returns:
+        str: The table.
+    """
+    total = sizes["total"] or 1
+    lines = [f"{'category':<15}{'bytes':>12}{'share':>8}"]
+    for category in CATEGORIES:
+        lines.append(f"{category:<15}{sizes[category]:>12,}{sizes[category] / total:>8.1%}")
+    lines.append(f"{'total':<15}{sizes['total']:>12,}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """Reports the memory of a fresh game from the command line.
+
+    Args:
+        argv: The command line arguments. Defaults to sys.argv[1:].
+
+    Returns:
+        None
+    """
+    parser = argparse.ArgumentParser(description="Memory report for a game session")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="also list where loading the world and creating a session allocate memory")
+    parser.add_argument("--top", type=int, default=10, help="allocation sites to list per phase")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = {"session": memory_report(Control().game)}
+    if args.tracemalloc:
+        report["allocations"] = startup_allocations(args.top)
+    if args.json:
+        print(json.dumps(report, indent=4))
+        return
+    print(format_report(report["session"]))
+    for phase, allocations in report.get("allocations", {}).items():
+        print(f"\n{phase}: {allocations['bytes']:,} bytes kept")
+        for line in allocations["sites"]:
+            print(f"  {line}")
+
+
+if __name__ == "__main__":
+    main()
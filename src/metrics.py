@@ -0,0 +1,335 @@
+"""Per-command latency metrics.
+
+This module contains the LatencyHistogram class, which counts durations in
+log-linear buckets (in the style of HDR histograms: a fixed number of
+sub-buckets per power of two, so every recorded value is kept to within a few
+percent however large it is), and the CommandMetrics class, which keeps a
+histogram, a count and an error count per command handler, and can profile
+the slowest commands with `cProfile`.
+
+A Control only measures commands when it is given a CommandMetrics, so games
+without one pay nothing. One CommandMetrics may be shared by many Controls.
+"""
+import cProfile
+import heapq
+import io
+import pstats
+import threading
+import time
+
+# 32 sub-buckets per power of two: bucket bounds are within about 3% of the
+# recorded value.
+SUB_BUCKET_BITS = 5
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def bucket_of(value):
+    """Returns the bucket index of a non-negative integer value.
+
+    Args:
+        value: The value (for command latencies, in microseconds).
+
+    Returns:
+        int: The bucket index. Indexes grow with the value.
+    """
+    shift = max(0, value.bit_length() - SUB_BUCKET_BITS - 1)
+    return (shift << SUB_BUCKET_BITS) + (value >> shift)
+
+
+def bucket_bounds(index):
+    """Returns the smallest and largest values counted in a bucket.
+
+    Args:
+        index: The bucket index (see `bucket_of`).
+
+    Returns:
+        tuple: (lowest, highest), inclusive.
+    """
+    if index < 2 << SUB_BUCKET_BITS:
+        return index, index
+    shift = (index >> SUB_BUCKET_BITS) - 1
+    lowest = (index - (shift << SUB_BUCKET_BITS)) << shift
+    return lowest, lowest + (1 << shift) - 1
+
+
+class LatencyHistogram:
+    """Counts durations in log-linear buckets of microseconds."""
+
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, micros):
+        """Counts one duration.
+
+        Args:
+            micros: The duration in whole microseconds.
+
+        Returns:
+            None
+        """
+        index = bucket_of(micros)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += micros
+        if self.min is None or micros < self.min:
+            self.min = micros
+        if micros > self.max:
+            self.max = micros
+
+    def quantile(self, fraction):
+        """Returns the value below which a fraction of the durations fall.
+
+        Args:
+            fraction: The quantile as a fraction, e.g. 0.99.
+
+        Returns:
+            int: The upper bound in microseconds of the bucket holding the
+            quantile (capped at the largest recorded value), or 0 if nothing
+            was recorded.
+        """
+        if not self.count:
+            return 0
+        rank = max(1, round(fraction * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(bucket_bounds(index)[1], self.max)
+        return self.max
+
+    def merge(self, other):
+        """Adds another histogram's counts to this one.
+
+        Args:
+            other: The LatencyHistogram to add.
+
+        Returns:
+            None
+        """
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def copy(self):
+        """Returns an independent copy of the histogram.
+
+        Args:
+            None
+
+        Returns:
+            LatencyHistogram: The copy.
+        """
+        other = LatencyHistogram()
+        other.counts = dict(self.counts)
+        other.count = self.count
+        other.total = self.total
+        other.min = self.min
+        other.max = self.max
+        return other
+
+    def summary(self):
+        """Returns the histogram's statistics.
+
+        Args:
+            None
+
+        Returns:
+            dict: "count", "mean_ms", "max_ms" and one "p<N>_ms" entry per
+            quantile in `QUANTILES`.
+        """
+        result = {
+            "count": self.count,
+            "mean_ms": self.total / self.count / 1000 if self.count else 0.0,
+        }
+        for fraction in QUANTILES:
+            result[f"p{fraction * 100:g}_ms"] = self.quantile(fraction) / 1000
+        result["max_ms"] = self.max / 1000
+        return result
+
+
+class CommandMetrics:
+    """Latency, count and error statistics per command handler.
+
+    Commands are keyed by their handler name (so ``n`` and ``go north`` are
+    both ``move``); choices made in a conversation are keyed ``dialogue``.
+
+    Args:
+        profile: How many of the slowest commands to keep `cProfile` results
+            for. Profiling every command is costly, so this is 0 (off) by
+            default.
+    """
+
+    def __init__(self, profile=0):
+        self.profile = profile
+        self.histograms = {}
+        self.errors = {}
+        self.started = time.time()
+        self._slowest = []
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def call(self, verb, handler, args, text=None):
+        """Runs a command handler and records how long it took.
+
+        Args:
+            verb: The name the command is counted under.
+            handler: The callable to run.
+            args: The arguments to pass it.
+            text: The command as typed, shown with profiles of slow commands.
+
+        Returns:
+            The handler's return value. Exceptions are counted as errors and
+            re-raised.
+        """
+        profiler = cProfile.Profile() if self.profile else None
+        failed = True
+        start = time.perf_counter_ns()
+        try:
+            result = handler(*args) if profiler is None else profiler.runcall(handler, *args)
+            failed = False
+            return result
+        finally:
+            micros = (time.perf_counter_ns() - start) // 1000
+            self.record(verb, micros, failed)
+            if profiler is not None:
+                self._keep_profile(micros, verb, text, profiler)
+
+    def record(self, verb, micros, failed=False):
+        """Records one command's duration.
+
+        Args:
+            verb: The name the command is counted under.
+            micros: The duration in whole microseconds.
+            failed: Whether the command raised an exception.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            histogram = self.histograms.get(verb)
+            if histogram is None:
+                histogram = self.histograms[verb] = LatencyHistogram()
+            histogram.record(micros)
+            if failed:
+                self.errors[verb] = self.errors.get(verb, 0) + 1
+
+    def snapshot(self):
+        """Returns the statistics of every command.
+
+        Args:
+            None
+
+        Returns:
+            dict: Maps each verb to its histogram summary (see
+            `LatencyHistogram.summary`) plus its "errors" count, with an
+            "all" entry covering every command.
+        """
+        with self._lock:
+            total = LatencyHistogram()
+            result = {}
+            for verb in sorted(self.histograms):
+                histogram = self.histograms[verb]
+                total.merge(histogram)
+                result[verb] = dict(histogram.summary(), errors=self.errors.get(verb, 0))
+            result["all"] = dict(total.summary(), errors=sum(self.errors.values()))
+        return result
+
+    def copy_histograms(self):
+        """Returns copies of the histograms and error counts.
+
+        Only the copying is done while holding the lock, so callers polling
+        the metrics (such as `src.prometheus`) can compute quantiles without
+        delaying the commands being recorded.
+
+        Args:
+            None
+
+        Returns:
+            dict: Maps each verb to a (LatencyHistogram, errors) tuple.
+        """
+        with self._lock:
+            return {
+                verb: (histogram.copy(), self.errors.get(verb, 0)) for verb, histogram in self.histograms.items()
+            }
+
+    def slowest(self):
+        """Returns the profiled slowest commands, slowest first.
+
+        Args:
+            None
+
+        Returns:
+            list: (milliseconds, verb, text, profile) tuples, where profile is
+            the `pstats` report of the command's 15 most expensive calls.
+        """
+        with self._lock:
+            kept = sorted(self._slowest, reverse=True)
+        result = []
+        for micros, _, verb, text, profiler in kept:
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(15)
+            result.append((micros / 1000, verb, text, out.getvalue()))
+        return result
+
+    def report(self, profiles=False):
+        """Formats the statistics as a table.
+
+        Args:
+            profiles: Whether to append the profiles of the slowest commands.
+
+        Returns:
+            str: The report.
+        """
+        rows = self.snapshot()
+        lines = [
+            f"{'command':<12}{'count':>8}{'errors':>8}{'mean':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}  (ms)"
+        ]
+        for verb, row in rows.items():
+            if verb == "all" and len(rows) > 1:
+                lines.append("-" * len(lines[0]))
+            lines.append(
+                f"{verb:<12}{row['count']:>8}{row['errors']:>8}{row['mean_ms']:>9.3f}{row['p50_ms']:>9.3f}"
+                f"{row['p90_ms']:>9.3f}{row['p99_ms']:>9.3f}{row['max_ms']:>9.3f}"
+            )
+        if self.profile:
+            lines.append("")
+            lines.append(f"Slowest commands (profiling the slowest {self.profile}):")
+            for millis, verb, text, profile in self.slowest():
+                lines.append(f"  {millis:9.3f} ms  {verb}: {text}")
+                if profiles:
+                    lines.append(profile)
+        return "\n".join(lines)
+
+    def reset(self):
+        """Clears all statistics.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.histograms = {}
+            self.errors = {}
+            self._slowest = []
+            self.started = time.time()
+
+    def _keep_profile(self, micros, verb, text, profiler):
+        with self._lock:
+            self._sequence += 1
+            entry = (micros, self._sequence, verb, text, profiler)
+            if len(self._slowest) < self.profile:
+                heapq.heappush(self._slowest, entry)
+            elif micros > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
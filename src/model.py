@@ -0,0 +1,366 @@
+"""
+Compact world model classes.
+
+Rooms, items, characters, exits and events are stored in `__slots__` classes
+instead of plain dictionaries. Every class also implements the mapping
+protocol (``obj["key"]``, ``obj.get(...)``, ``"key" in obj``) so that content
+JSON, ``modify_room``/``modify_item`` property writes and save files keep
+working unchanged. Keys that are not declared fields are kept in a small
+per-object ``extra`` dictionary, created only when needed.
+
+A field whose value is None is treated as absent, exactly like a missing key
+in the original dictionaries.
+"""
+from collections.abc import MutableMapping
+
+DIRECTIONS = (
+    "north", "south", "east", "west",
+    "northeast", "northwest", "southeast", "southwest",
+    "up", "down",
+)
+_DIRECTION_INDEX = {direction: i for i, direction in enumerate(DIRECTIONS)}
+
+
+class Model:
+    """Base class for slotted world objects with a dictionary-compatible view.
+
+    Subclasses list their fields in ``__slots__``; slots starting with an
+    underscore are internal and not part of the dictionary view. ``RENAMED``
+    maps a content key to a differently named slot, for keys that would
+    shadow a mapping method (a room's ``items``). ``DEFAULTS`` maps fields
+    that are always present to a factory creating their initial value.
+
+    Models are registered as ``MutableMapping`` virtual subclasses rather than
+    inheriting from it, which keeps ``isinstance`` checks on them cheap.
+    """
+
+    __slots__ = ("extra",)
+    RENAMED = {}
+    DEFAULTS = {}
+
+    def __init__(self, data=None):
+        self.extra = None
+        for _, attr in self.FIELDS:
+            factory = self.DEFAULTS.get(attr)
+            setattr(self, attr, factory() if factory else None)
+        if data:
+            for key, value in data.items():
+                self[key] = value
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        key_for = {attr: key for key, attr in cls.RENAMED.items()}
+        cls.FIELDS = tuple(
+            (key_for.get(attr, attr), attr) for attr in cls.__slots__ if not attr.startswith("_")
+        )
+        cls.KEYS = dict(cls.FIELDS)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Builds an object, and any nested model objects, from content data.
+
+        Args:
+            data: The dictionary loaded from JSON (or a model object).
+
+        Returns:
+            Model: The new object.
+        """
+        return cls(data)
+
+    def _convert(self, attr, value):
+        """Hook for subclasses to normalize a value assigned to a field."""
+        return value
+
+    def __getitem__(self, key):
+        attr = self.KEYS.get(key)
+        if attr is not None:
+            value = getattr(self, attr)
+            if value is not None:
+                return value
+        elif self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        attr = self.KEYS.get(key)
+        if attr is not None:
+            value = getattr(self, attr)
+            return default if value is None else value
+        if self.extra is not None:
+            return self.extra.get(key, default)
+        return default
+
+    def __setitem__(self, key, value):
+        attr = self.KEYS.get(key)
+        if attr is not None:
+            setattr(self, attr, self._convert(attr, value))
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        attr = self.KEYS.get(key)
+        if attr is not None and getattr(self, attr) is not None:
+            factory = self.DEFAULTS.get(attr)
+            setattr(self, attr, factory() if factory else None)
+        elif attr is None and self.extra and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        attr = self.KEYS.get(key)
+        if attr is not None:
+            return getattr(self, attr) is not None
+        return self.extra is not None and key in self.extra
+
+    def __iter__(self):
+        for key, attr in self.FIELDS:
+            if getattr(self, attr) is not None:
+                yield key
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def keys(self):
+        return self.to_dict().keys()
+
+    def values(self):
+        return self.to_dict().values()
+
+    def items(self):
+        return self.to_dict().items()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def update(self, other=(), **kwargs):
+        for key, value in dict(other, **kwargs).items():
+            self[key] = value
+
+    def __eq__(self, other):
+        if isinstance(other, (Model, dict)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def to_dict(self):
+        """Returns a plain dictionary view of the object (not a deep copy)."""
+        data = {}
+        for key, attr in self.FIELDS:
+            value = getattr(self, attr)
+            if value is not None:
+                data[key] = value
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+MutableMapping.register(Model)
+
+
+def _build_events(events):
+    """Converts an ``{trigger: [event, ...]}`` mapping into Event objects."""
+    return {trigger: [Event.from_dict(event) for event in handlers] for trigger, handlers in events.items()}
+
+
+class Event(Model):
+    """A conditional list of actions attached to a room, item, character or the world."""
+
+    __slots__ = ("condition", "actions", "repeatable", "triggered")
+
+
+class Item(Model):
+    """An item instance. Containers hold further items in ``contents``."""
+
+    __slots__ = (
+        "name", "description", "adjectives", "synonyms", "instance_id",
+        "is_container", "is_open", "is_locked",
+        "contents", "events",
+    )
+
+    @classmethod
+    def from_dict(cls, data):
+        item = cls(data)
+        if item.contents is not None:
+            item.contents = [Item.from_dict(child) for child in item.contents]
+        if item.events is not None:
+            item.events = _build_events(item.events)
+        return item
+
+
+class Character(Model):
+    """A non-player character placed in a room."""
+
+    __slots__ = ("name", "description", "adjectives", "synonyms", "template", "stats", "dialogue", "events")
+
+    @classmethod
+    def from_dict(cls, data):
+        character = cls(data)
+        if character.events is not None:
+            character.events = _build_events(character.events)
+        return character
+
+
+class Exits(MutableMapping):
+    """A room's exits, mapping direction names to destination room ids.
+
+    The standard compass directions are stored in a fixed-size list indexed
+    by direction; any other direction name goes into a small dictionary.
+    """
+
+    __slots__ = ("_targets", "_other")
+
+    def __init__(self, exits=None):
+        self._targets = [None] * len(DIRECTIONS)
+        self._other = None
+        if exits:
+            for direction, target in exits.items():
+                self[direction] = target
+
+    def __getitem__(self, direction):
+        i = _DIRECTION_INDEX.get(direction)
+        if i is not None:
+            target = self._targets[i]
+            if target is not None:
+                return target
+        elif self._other and direction in self._other:
+            return self._other[direction]
+        raise KeyError(direction)
+
+    def get(self, direction, default=None):
+        i = _DIRECTION_INDEX.get(direction)
+        if i is not None:
+            target = self._targets[i]
+            return default if target is None else target
+        if self._other:
+            return self._other.get(direction, default)
+        return default
+
+    def __contains__(self, direction):
+        return self.get(direction) is not None
+
+    def __setitem__(self, direction, target):
+        i = _DIRECTION_INDEX.get(direction)
+        if i is not None:
+            self._targets[i] = target
+        else:
+            if self._other is None:
+                self._other = {}
+            self._other[direction] = target
+
+    def __delitem__(self, direction):
+        if direction not in self:
+            raise KeyError(direction)
+        i = _DIRECTION_INDEX.get(direction)
+        if i is not None:
+            self._targets[i] = None
+        else:
+            del self._other[direction]
+
+    def __iter__(self):
+        for direction, target in zip(DIRECTIONS, self._targets):
+            if target is not None:
+                yield direction
+        if self._other:
+            yield from self._other
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self):
+        """Returns the exits as a plain dictionary."""
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"Exits({self.to_dict()!r})"
+
+
+class Room(Model):
+    """A location in the world."""
+
+    __slots__ = (
+        "id", "description",
+        "first_arrival_text", "transition_text", "examination_text", "nth_arrival_text",
+        "exits", "contents", "characters", "events",
+    )
+    RENAMED = {"items": "contents"}
+    DEFAULTS = {"exits": Exits, "contents": list, "characters": list, "events": dict}
+
+    @classmethod
+    def from_dict(cls, data):
+        room = cls(data)
+        room.contents = [Item.from_dict(item) for item in room.contents]
+        room.characters = [Character.from_dict(character) for character in room.characters]
+        room.events = _build_events(room.events)
+        return room
+
+    def _convert(self, attr, value):
+        if attr == "exits" and not isinstance(value, Exits):
+            return Exits(value)
+        if attr == "nth_arrival_text" and value:
+            # JSON object keys are strings; visit counts are integers.
+            return {int(k) if isinstance(k, str) and k.isdigit() else k: v for k, v in value.items()}
+        if value is None and attr in self.DEFAULTS:
+            return self.DEFAULTS[attr]()
+        return value
+
+
+class WorldMap(dict):
+    """The rooms of the world keyed by room id.
+
+    Plain dictionaries stored in the map are wrapped in Room objects (without
+    converting the items or characters they hold).
+    """
+
+    def __init__(self, rooms=None):
+        super().__init__()
+        if rooms:
+            self.update(rooms)
+
+    def __setitem__(self, room_id, room):
+        if not isinstance(room, Room):
+            room = Room(room)
+        super().__setitem__(room_id, room)
+
+    def update(self, *args, **kwargs):
+        for room_id, room in dict(*args, **kwargs).items():
+            self[room_id] = room
+
+    def setdefault(self, room_id, room=None):
+        if room_id not in self:
+            self[room_id] = room if room is not None else {}
+        return self[room_id]
+
+
+def build_world(rooms):
+    """Builds a WorldMap of model objects from loaded or saved room data.
+
+    Args:
+        rooms: A dictionary of room dictionaries keyed by room id.
+
+    Returns:
+        WorldMap: The world with rooms, items, characters and events converted.
+    """
+    world = WorldMap()
+    for room_id, room in rooms.items():
+        world[room_id] = Room.from_dict(room)
+    return world
@@ -0,0 +1,102 @@
+"""Pool of pre-built games for starting sessions without building a world.
+
+This module contains the ControlPool class. Building a Control loads every
+data file and constructs the world, which puts a burst of new players behind
+that work. A pool builds fresh Controls ahead of time on a background thread,
+so a new session only takes one from the pool.
+"""
+import threading
+from collections import deque
+from src.control import Control
+
+
+class ControlPool:
+    """Keeps fresh Control instances ready to hand out.
+
+    A pool is a drop-in `control_factory` for a SessionManager: calling it
+    returns a Control. When the pool is empty the Control is built on the
+    spot, and a background thread refills the pool up to `size`.
+
+    Args:
+        size: The number of Controls to keep ready.
+        factory: Called with no arguments to build each Control.
+        fill: Whether to build the first `size` Controls before returning.
+    """
+
+    def __init__(self, size=16, factory=Control, fill=True):
+        self.size = size
+        self.factory = factory
+        self.hits = 0
+        self.misses = 0
+        # Guards the counters: servers call the pool from many threads.
+        self._lock = threading.Lock()
+        self._ready = deque()
+        self._wanted = threading.Event()
+        self._closed = False
+        if fill:
+            self.fill()
+        self._thread = threading.Thread(target=self._refill, name="control-pool", daemon=True)
+        self._thread.start()
+
+    def __call__(self):
+        try:
+            control = self._ready.popleft()
+        except IndexError:
+            control = None
+        with self._lock:
+            if control is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if control is None:
+            control = self.factory()
+        self._wanted.set()
+        return control
+
+    def __len__(self):
+        return len(self._ready)
+
+    def fill(self):
+        """Builds Controls on the calling thread until the pool is full.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        while len(self._ready) < self.size and not self._closed:
+            self._ready.append(self.factory())
+
+    def stats(self):
+        """Returns counters describing the pool.
+
+        Args:
+            None
+
+        Returns:
+            dict: "ready" (Controls waiting), "hits" (handed out from the
+            pool) and "misses" (built on demand because the pool was empty).
+        """
+        with self._lock:
+            return {"ready": len(self._ready), "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        """Stops the refill thread and drops the waiting Controls.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._closed = True
+        self._wanted.set()
+        self._thread.join()
+        self._ready.clear()
+
+    def _refill(self):
+        while not self._closed:
+            self._wanted.wait()
+            self._wanted.clear()
+            self.fill()
@@ -0,0 +1,262 @@
+"""Prometheus metrics exporter for the servers.
+
+This module collects a server's operational metrics and serves them at
+``/metrics`` in the Prometheus text exposition format, from a small HTTP
+server on its own port and threads. The metrics cover the session table
+(sessions open, in memory and hibernated, games rebuilt from hibernation,
+input lines), commands per verb with their errors and latency quantiles
+(from the SessionManager's `src.metrics.CommandMetrics`), global event
+passes and evaluations, pending timers, the duration and size of autosaves
+and hibernation snapshots, the hits and misses of the pool of pre-built
+games and the process's resident memory.
+
+Scraping never holds a lock for longer than it takes to copy counters: the
+histograms are copied under their locks and the quantiles computed
+afterwards, and the games' counters are read without locking.
+
+Collected metrics are lists of families, ``(name, type, help, samples)``
+tuples where each sample is a ``(name, labels, value)`` tuple, so the
+supervisor of a multi-process server can merge its workers' metrics.
+"""
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.metrics import QUANTILES
+from src.sessions import resident_memory
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _summary(name, labels, histogram, unit):
+    # The samples of a Prometheus summary for a LatencyHistogram whose
+    # values are counted in 1/unit of the metric's unit.
+    samples = [
+        (name, labels + (("quantile", f"{fraction:g}"),), histogram.quantile(fraction) / unit)
+        for fraction in QUANTILES
+    ]
+    samples.append((f"{name}_sum", labels, histogram.total / unit))
+    samples.append((f"{name}_count", labels, histogram.count))
+    return samples
+
+
+def collect(sessions):
+    """Collects the metrics of a session table and its process.
+
+    Args:
+        sessions: The SessionManager.
+
+    Returns:
+        list: The metric families, ``(name, type, help, samples)`` tuples.
+    """
+    stats = sessions.stats()
+    families = [
+        ("textgame_sessions", "gauge", "Open sessions.", [("textgame_sessions", (), stats["sessions"])]),
+        ("textgame_sessions_in_memory", "gauge", "Sessions whose game is in memory.",
+         [("textgame_sessions_in_memory", (), stats["started"] - stats["hibernated"])]),
+        ("textgame_sessions_hibernated", "gauge", "Sessions whose game is hibernated on disk.",
+         [("textgame_sessions_hibernated", (), stats["hibernated"])]),
+        ("textgame_session_wakeups_total", "counter", "Games rebuilt from hibernation snapshots.",
+         [("textgame_session_wakeups_total", (), sessions.wakeups)]),
+        ("textgame_input_lines_total", "counter", "Input lines handled.",
+         [("textgame_input_lines_total", (), stats["lines"])]),
+    ]
+
+    if sessions.metrics is not None:
+        commands, errors, latencies = [], [], []
+        for verb, (histogram, failed) in sorted(sessions.metrics.copy_histograms().items()):
+            labels = (("verb", verb),)
+            commands.append(("textgame_commands_total", labels, histogram.count))
+            errors.append(("textgame_command_errors_total", labels, failed))
+            latencies.extend(_summary("textgame_command_latency_seconds", labels, histogram, 1e6))
+        families.append(("textgame_commands_total", "counter", "Commands run, by verb.", commands))
+        families.append(("textgame_command_errors_total", "counter", "Commands that raised an exception.", errors))
+        families.append(("textgame_command_latency_seconds", "summary", "Command latency, by verb.", latencies))
+
+    counters = sessions.game_counters()
+    families.extend([
+        ("textgame_global_event_passes_total", "counter", "Checks of the global events.",
+         [("textgame_global_event_passes_total", (), counters["global_event_passes"])]),
+        ("textgame_global_event_evaluations_total", "counter", "Global event conditions evaluated.",
+         [("textgame_global_event_evaluations_total", (), counters["global_event_evaluations"])]),
+        ("textgame_timers_pending", "gauge", "Timers waiting to fire in the games in memory.",
+         [("textgame_timers_pending", (), counters["timers"])]),
+    ])
+
+    durations, sizes = [], []
+    for kind, (times, bytes_written) in sorted(sessions.save_stats().items()):
+        labels = (("kind", kind),)
+        durations.extend(_summary("textgame_save_duration_seconds", labels, times, 1e6))
+        sizes.extend(_summary("textgame_save_size_bytes", labels, bytes_written, 1))
+    families.append(("textgame_save_duration_seconds", "summary", "Time to write a save or snapshot.", durations))
+    families.append(("textgame_save_size_bytes", "summary", "Size of the saves and snapshots written.", sizes))
+
+    if "pool" in stats:
+        pool = stats["pool"]
+        families.extend([
+            ("textgame_pool_hits_total", "counter", "New sessions given a pre-built game.",
+             [("textgame_pool_hits_total", (), pool["hits"])]),
+            ("textgame_pool_misses_total", "counter", "New sessions whose game was built on demand.",
+             [("textgame_pool_misses_total", (), pool["misses"])]),
+            ("textgame_pool_ready", "gauge", "Pre-built games waiting.", [("textgame_pool_ready", (), pool["ready"])]),
+        ])
+
+    resident = resident_memory()
+    if resident is not None:
+        families.append(("process_resident_memory_bytes", "gauge", "Resident memory size in bytes.",
+                         [("process_resident_memory_bytes", (), resident)]))
+    return families
+
+
+def label_families(families, labels):
+    """Adds labels to every sample of some metric families.
+
+    Args:
+        families: The metric families.
+        labels: ``(name, value)`` pairs to add, e.g. ``(("worker", "0"),)``.
+
+    Returns:
+        list: The labelled families.
+    """
+    return [
+        (name, kind, text, [(sample, labels + sample_labels, value) for sample, sample_labels, value in samples])
+        for name, kind, text, samples in families
+    ]
+
+
+def merge_families(*groups):
+    """Merges lists of metric families, joining the samples of families with the same name.
+
+    Args:
+        *groups: Lists of metric families, such as one per worker.
+
+    Returns:
+        list: The merged families, in the order their names first appear.
+    """
+    merged = {}
+    for families in groups:
+        for name, kind, text, samples in families:
+            if name in merged:
+                merged[name][3].extend(samples)
+            else:
+                merged[name] = (name, kind, text, list(samples))
+    return list(merged.values())
+
+
+def format_metrics(families):
+    """Formats metric families in the Prometheus text exposition format.
+
+    Args:
+        families: The metric families.
+
+    Returns:
+        str: The exposition, ending with a newline.
+    """
+    lines = []
+    for name, kind, text, samples in families:
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample, labels, value in samples:
+            if labels:
+                pairs = ",".join(f'{label}="{_escape(str(label_value))}"' for label, label_value in labels)
+                sample = f"{sample}{{{pairs}}}"
+            lines.append(f"{sample} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serves ``GET /metrics``."""
+
+    server_version = "TextGameTemplate"
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = format_metrics(self.server.collect()).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood stderr.
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """Serves metrics for Prometheus on its own threads.
+
+    Args:
+        collect: Called with no arguments on every scrape; returns the
+            metric families (see `collect`).
+        host: The interface to listen on.
+        port: The port to listen on (0 picks a free one).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, collect, host="127.0.0.1", port=9100):
+        super().__init__((host, port), MetricsRequestHandler)
+        self.collect = collect
+
+    @property
+    def port(self):
+        """int: The port the server is listening on."""
+        return self.server_address[1]
+
+    def start_background(self):
+        """Serves scrapes on a daemon thread.
+
+        Args:
+            None
+
+        Returns:
+            threading.Thread: The serving thread.
+        """
+        thread = threading.Thread(target=self.serve_forever, name="metrics-exporter", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """Stops serving and closes the socket.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self.shutdown()
+        self.server_close()
+
+
+def start_exporter(collect, host="127.0.0.1", port=9100):
+    """Starts serving metrics in the background.
+
+    Args:
+        collect: Returns the metric families on each scrape.
+        host: The interface to listen on.
+        port: The port to listen on.
+
+    Returns:
+        MetricsServer: The running server.
+    """
+    server = MetricsServer(collect, host, port)
+    server.start_background()
+    print(f"Serving metrics on {host}:{server.port}/metrics")
+    return server
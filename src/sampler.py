@@ -0,0 +1,299 @@
+"""On-demand sampling profiler for live servers.
+
+This module contains the SamplingProfiler class, which samples the Python
+stacks of every thread from a background thread (using
+`sys._current_frames`) at a fixed interval, and writes them in the
+collapsed-stack format read by flame graph tools (``flamegraph.pl``,
+speedscope, Firefox Profiler), one ``frame;frame;frame count`` line per
+distinct stack. Unlike `cProfile`, the running code is not slowed down
+beyond the sampling itself, so it can be switched on in a loaded server.
+
+Frames are named ``file.py:Class.method`` (``file.py:method`` before
+Python 3.11, whose code objects lack a qualified name). Below the Game frames that run
+content, a frame naming the content is added: ``[room cellar: enter]``
+under `Game.process_events`, ``[global 3]`` under the global event being
+checked and ``[action set_true]`` under `Game._perform_action`, so time can
+be traced back to the data files as well as to code.
+
+A profile is started for a number of seconds with `profile_for`, by the
+signal installed with `install_signal_handler` (``kill -USR2 <pid>`` in
+server mode) or through the HTTP API's ``POST /admin/profile``.
+"""
+import collections
+import os
+import signal
+import sys
+import threading
+import time
+from src.event_trace import source_label
+
+DEFAULT_INTERVAL = 0.005
+DEFAULT_SECONDS = 30
+# Stacks whose innermost frame is in one of these files are threads waiting
+# for work (sockets, selectors, locks, sleeps), left out unless asked for.
+IDLE_FILES = frozenset(("selectors.py", "threading.py", "socket.py", "queue.py", "connection.py"))
+# Game methods whose frames are followed by a frame naming their content.
+_CONTENT_FRAMES = frozenset(("process_events", "_run_global_event", "_perform_action"))
+
+
+def _content_label(code_name, frame):
+    # Names the content a Game frame is running, or returns None.
+    try:
+        if code_name == "process_events":
+            local = frame.f_locals
+            return f"[{source_label(local['source'])}: {local['trigger']}]"
+        if code_name == "_run_global_event":
+            return f"[global {frame.f_locals['index']}]"
+        if code_name == "_perform_action":
+            return f"[action {frame.f_locals['action'].get('type')}]"
+    except (KeyError, AttributeError, TypeError):
+        pass
+    return None
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread at a fixed interval.
+
+    Args:
+        interval: Seconds between samples.
+        include_idle: Whether to keep the samples of threads waiting for
+            work (see `IDLE_FILES`).
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, include_idle=False):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.started = None
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._labels = {}
+
+    @property
+    def running(self):
+        """bool: Whether the profiler is sampling."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds=None, on_finish=None):
+        """Starts sampling on a background thread.
+
+        Args:
+            seconds: Stop after this many seconds, or None to sample until `stop`.
+            on_finish: Called with the profiler when sampling stops, or None.
+
+        Returns:
+            None
+
+        Raises:
+            RuntimeError: If the profiler is already running.
+        """
+        if self.running:
+            raise RuntimeError("The profiler is already running")
+        self._stop.clear()
+        self.started = time.time()
+        self._thread = threading.Thread(
+            target=self._run, args=(seconds, on_finish), name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stops sampling and waits for the sampling thread to finish.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def wait(self, timeout=None):
+        """Waits for sampling (and its `on_finish` callback) to end.
+
+        Args:
+            timeout: The most seconds to wait, or None.
+
+        Returns:
+            bool: True if the profiler has stopped.
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return not self.running
+
+    def sample(self):
+        """Takes one sample of every other thread's stack.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        me = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            if not self.include_idle and os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                content = _content_label(code.co_name, frame) if code.co_name in _CONTENT_FRAMES else None
+                if content is not None:
+                    stack.append(content)
+                stack.append(self._label(code))
+                frame = frame.f_back
+            stack.append(f"thread {names.get(ident, ident)}")
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+        self.samples += 1
+
+    def collapsed(self):
+        """Returns the samples in the collapsed-stack format.
+
+        Args:
+            None
+
+        Returns:
+            str: One ``frame;frame;frame count`` line per distinct stack,
+            outermost frame first, most frequent stacks first.
+        """
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top(self, limit=10):
+        """Returns the functions most often on the stack.
+
+        Args:
+            limit: How many functions to return.
+
+        Returns:
+            list: (frame, samples) tuples, most sampled first. Each frame is
+            counted once per sample, however deep the recursion.
+        """
+        counts = collections.Counter()
+        for stack, count in self.stacks.items():
+            for frame in set(stack):
+                counts[frame] += count
+        return counts.most_common(limit)
+
+    def write(self, path):
+        """Writes the collapsed stacks to a file.
+
+        Args:
+            path: The file to write.
+
+        Returns:
+            str: The path written.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            f.write(self.collapsed())
+        return path
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            # co_qualname is new in Python 3.11.
+            name = getattr(code, "co_qualname", code.co_name)
+            label = self._labels[code] = f"{os.path.basename(code.co_filename)}:{name}"
+        return label
+
+    def _run(self, seconds, on_finish):
+        start = time.monotonic()
+        deadline = start + seconds if seconds is not None else None
+        try:
+            while not self._stop.is_set():
+                self.sample()
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                self._stop.wait(self.interval)
+        finally:
+            self.elapsed += time.monotonic() - start
+            if on_finish is not None:
+                on_finish(self)
+
+
+_active = None
+_active_lock = threading.Lock()
+
+
+def profile_path(directory):
+    """Returns a new file name for a profile of this process.
+
+    Args:
+        directory: The directory to write it in.
+
+    Returns:
+        str: The path.
+    """
+    stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+    return os.path.join(directory, f"profile-{os.getpid()}-{stamp}.folded")
+
+
+def profile_for(seconds=DEFAULT_SECONDS, path=None, interval=DEFAULT_INTERVAL, stream=sys.stderr):
+    """Profiles the process in the background for a number of seconds.
+
+    Only one such profile runs at a time in a process.
+
+    Args:
+        seconds: How long to sample.
+        path: Where to write the collapsed stacks when done, or None.
+        interval: Seconds between samples.
+        stream: Where to report the file written, or None.
+
+    Returns:
+        SamplingProfiler: The running profiler (see `SamplingProfiler.wait`).
+
+    Raises:
+        RuntimeError: If a profile is already running.
+    """
+    global _active
+
+    def finish(profiler):
+        if path is not None:
+            profiler.write(path)
+            if stream is not None:
+                print(f"Profile of {profiler.samples} samples written to {path}", file=stream)
+
+    with _active_lock:
+        if _active is not None and _active.running:
+            raise RuntimeError("A profile is already running")
+        _active = SamplingProfiler(interval)
+        _active.start(seconds, finish)
+        return _active
+
+
+def install_signal_handler(directory, seconds=DEFAULT_SECONDS, signum=None):
+    """Makes a signal start a profile of the process.
+
+    Each time the signal is received, the process is profiled for `seconds`
+    and the collapsed stacks written to `directory`. Must be called from
+    the main thread.
+
+    Args:
+        directory: Where profiles are written.
+        seconds: How long each profile samples.
+        signum: The signal, by default SIGUSR2.
+
+    Returns:
+        bool: True if the handler was installed (not on platforms without
+        the signal).
+    """
+    if signum is None:
+        signum = getattr(signal, "SIGUSR2", None)
+    if signum is None:
+        return False
+
+    def handler(received, frame):
+        try:
+            profile_for(seconds, profile_path(directory))
+        except RuntimeError:
+            pass
+
+    signal.signal(signum, handler)
+    return True
@@ -0,0 +1,233 @@
+"""Asyncio TCP/telnet server hosting many game sessions in one process.
+
+This module contains the GameServer class. Each connection gets its own
+session (see `src.sessions`) and speaks a plain line protocol: the client
+sends a command line, the server replies with the responses and a ``> ``
+prompt. Telnet negotiation bytes sent by telnet clients are ignored.
+
+Players are told their game's id when they connect. A game left without
+quitting is autosaved, and ``resume <id>`` continues it on a later
+connection.
+"""
+import asyncio
+import os
+import signal
+from src.metrics import CommandMetrics
+from src.prometheus import collect, start_exporter
+from src.sampler import install_signal_handler
+from src.sessions import SessionManager
+from src.startup import finish as finish_startup
+
+PROMPT = "> "
+IAC = 255
+# Telnet commands followed by an option byte (WILL, WONT, DO, DONT).
+_OPTION_COMMANDS = range(251, 255)
+SB, SE = 250, 240
+
+
+def strip_telnet(data):
+    """Removes telnet command sequences from received bytes.
+
+    Args:
+        data: The bytes received from the client.
+
+    Returns:
+        bytes: The data without IAC sequences.
+    """
+    if IAC not in data:
+        return data
+    out = bytearray()
+    i, n = 0, len(data)
+    while i < n:
+        byte = data[i]
+        if byte != IAC:
+            out.append(byte)
+            i += 1
+            continue
+        command = data[i + 1] if i + 1 < n else None
+        if command == IAC:
+            out.append(IAC)
+            i += 2
+        elif command == SB:
+            end = data.find(bytes((IAC, SE)), i + 2)
+            i = n if end < 0 else end + 2
+        elif command in _OPTION_COMMANDS:
+            i += 3
+        else:
+            i += 2
+    return bytes(out)
+
+
+class GameServer:
+    """Serves game sessions over TCP.
+
+    Args:
+        host: The interface to listen on.
+        port: The port to listen on (0 picks a free one).
+        sessions: The SessionManager to use. Defaults to one autosaving to `save_dir`.
+        save_dir: Where sessions are autosaved on shutdown or disconnect.
+        write_buffer_limit: Bytes of queued output above which the server waits
+            for a slow client to catch up before reading its next command.
+    """
+
+    def __init__(self, host="127.0.0.1", port=4000, sessions=None, save_dir="saves",
+                 write_buffer_limit=64 * 1024):
+        self.host = host
+        self.port = port
+        self.sessions = sessions if sessions is not None else SessionManager(save_dir)
+        self.write_buffer_limit = write_buffer_limit
+        self._server = None
+        self._connections = set()
+        self._closing = False
+
+    async def start(self):
+        """Starts listening. `port` is updated if a free port was requested.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        """Serves until `shutdown` is called (or SIGINT/SIGTERM is received).
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self._server is None:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        serving = asyncio.ensure_future(self._server.serve_forever())
+        stopping = asyncio.ensure_future(stop.wait())
+        await asyncio.wait((serving, stopping), return_when=asyncio.FIRST_COMPLETED)
+        stopping.cancel()
+        await self.shutdown()
+        serving.cancel()
+
+    async def adopt(self, sock):
+        """Serves a connection accepted elsewhere, e.g. by a supervisor.
+
+        Args:
+            sock: The connected socket.
+
+        Returns:
+            None
+        """
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        protocol = asyncio.StreamReaderProtocol(reader, self._handle_client)
+        await loop.connect_accepted_socket(lambda: protocol, sock)
+
+    async def shutdown(self):
+        """Stops accepting connections, autosaves every session and disconnects clients.
+
+        Args:
+            None
+
+        Returns:
+            list: The autosave files written.
+        """
+        self._closing = True
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        saved = self.sessions.autosave_all()
+        for writer in list(self._connections):
+            try:
+                writer.write(b"\r\nThe server is shutting down. Your game has been saved.\r\n")
+                writer.close()
+            except (ConnectionError, RuntimeError):
+                pass
+        return saved
+
+    async def _handle_client(self, reader, writer):
+        session = self.sessions.create(resumable=True)
+        self._connections.add(writer)
+        try:
+            writer.write(_encode(_greeting(self.sessions.intro(), session.id, self.sessions.save_dir)))
+            while not self._closing:
+                data = await reader.readline()
+                if not data:
+                    break
+                line = strip_telnet(data).decode("utf-8", "replace").strip()
+                outputs = session.handle_line(line) if line else []
+                if session.done:
+                    outputs.append("Thanks for playing!")
+                    writer.write(_encode("\n".join(outputs) + "\n"))
+                    break
+                text = "\n".join(outputs) + "\n" + PROMPT if outputs else PROMPT
+                writer.write(_encode(text))
+                # Output is buffered by the transport; only wait when a slow
+                # client lets it build up.
+                if writer.transport.get_write_buffer_size() > self.write_buffer_limit:
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            if not self._closing:
+                self.sessions.close(session.id, save=not session.done)
+            try:
+                writer.close()
+            except RuntimeError:
+                pass
+
+
+def _greeting(intro, session_id, save_dir):
+    if save_dir is None:
+        return f"{intro}\n{PROMPT}"
+    return (f"{intro}\nThis is game {session_id}. If you leave without quitting, "
+            f"type 'resume {session_id}' when you return to continue it.\n{PROMPT}")
+
+
+def _encode(text):
+    # Telnet clients expect CRLF line endings.
+    return text.replace("\n", "\r\n").encode("utf-8")
+
+
+def serve(host="127.0.0.1", port=4000, save_dir="saves", max_active=None, pool_size=0, metrics_port=None,
+          slowlog=None):
+    """Runs a GameServer until interrupted.
+
+    Args:
+        host: The interface to listen on.
+        port: The port to listen on.
+        save_dir: Where sessions are autosaved.
+        max_active: The most games kept in memory before idle sessions are
+            hibernated to disk, or None for no limit.
+        pool_size: The number of fresh games to keep built ahead of time.
+        metrics_port: If given, commands are timed and Prometheus metrics
+            are served on this port (see `src.prometheus`).
+        slowlog: A `src.slowlog.SlowCommandLog` for slow commands, or None.
+
+    Returns:
+        None
+    """
+    metrics = CommandMetrics() if metrics_port is not None else None
+    sessions = SessionManager(save_dir, max_active=max_active, pool_size=pool_size, metrics=metrics, slowlog=slowlog)
+    server = GameServer(host, port, sessions=sessions)
+    if metrics_port is not None:
+        start_exporter(lambda: collect(sessions), host, metrics_port)
+    if save_dir is not None:
+        install_signal_handler(os.path.join(save_dir, "profiles"))
+
+    async def run():
+        await server.start()
+        print(f"Serving on {server.host}:{server.port}")
+        finish_startup()
+        await server.serve_forever()
+
+    asyncio.run(run())
@@ -0,0 +1,735 @@
+"""Session table for serving many games from one process.
+
+This module contains the Session class, which pairs a session id with a
+Control instance, and the SessionManager class, which creates, finds, saves
+and closes sessions for the network servers.
+
+A SessionManager can be given limits on how many games stay in memory. When
+a session starts or wakes up and a limit is exceeded, the least recently used
+sessions are hibernated: their game is written to a compressed snapshot and
+dropped, and rebuilt from the snapshot on the session's next command.
+"""
+import json
+import os
+import re
+import secrets
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from itertools import islice
+from src.control import Control
+from src.flight_recorder import DEFAULT_SIZE as DEFAULT_TRACE_SIZE, FlightRecorder
+from src.memory import CATEGORIES, memory_report
+from src.metrics import LatencyHistogram
+from src.pool import ControlPool
+
+_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+RESUME_COMMAND = {"verb": "resume", "args": "word", "prompt": "Resume which game?"}
+
+
+def resident_memory():
+    """Returns the process's resident memory in bytes.
+
+    Args:
+        None
+
+    Returns:
+        int: The resident set size, or None where it cannot be read (it is
+        taken from /proc on Linux).
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class Session:
+    """One player's game.
+
+    The Control (and with it the Game and its world) is only created when the
+    session runs its first command, so connections that stay idle cost
+    little memory. Servers handling a session from several threads hold
+    `lock` while using it.
+
+    Args:
+        session_id: The session's id.
+        control_factory: Called with no arguments to create the Control.
+        manager: The SessionManager tracking the session's activity, if any.
+        recorder: A `src.flight_recorder.FlightRecorder` attached to the
+            session's game, kept across hibernation, or None.
+        resumable: Whether the player can take over an autosaved game with
+            ``resume <id>`` (see `SessionManager.resume`).
+    """
+
+    __slots__ = (
+        "id", "created", "last_active", "lines", "lock", "hibernated", "recorder", "resumable", "_control",
+        "_control_factory", "_manager"
+    )
+
+    def __init__(self, session_id, control_factory=Control, manager=None, recorder=None, resumable=False):
+        self.id = session_id
+        self.recorder = recorder
+        self.resumable = resumable
+        self.lock = threading.RLock()
+        self.created = time.time()
+        self.last_active = time.monotonic()
+        self.lines = 0
+        self.hibernated = None
+        self._control = None
+        self._control_factory = control_factory
+        self._manager = manager
+
+    @property
+    def started(self):
+        """bool: Whether the session's game has been created."""
+        return self._control is not None or self.hibernated is not None
+
+    @property
+    def control(self):
+        """Control: The session's command handling, created (or woken up) on first use."""
+        if self._control is None:
+            control = self._control_factory()
+            woke = self.hibernated is not None
+            if woke:
+                self._thaw(control)
+            control.game.recorder = self.recorder
+            if self._manager is not None:
+                control.metrics = self._manager.metrics
+                control.slowlog = self._manager.slowlog
+                # Players name a save slot, never a file on the server.
+                control.handlers["save"] = self._save_command
+                control.handlers["load"] = self._load_command
+                if self.resumable:
+                    control.register_command(RESUME_COMMAND, self._resume_command)
+            self._control = control
+            if self._manager is not None:
+                self._manager._activated(self, woke)
+        return self._control
+
+    @property
+    def game(self):
+        """Game: The session's game, created on first use."""
+        return self.control.game
+
+    @property
+    def done(self):
+        """bool: Whether the player has quit."""
+        return self._control is not None and self._control.done
+
+    def handle_line(self, line):
+        """Runs an input line (possibly several chained commands).
+
+        Args:
+            line: The line as typed by the player.
+
+        Returns:
+            list: The responses to show, in order.
+        """
+        self.last_active = time.monotonic()
+        self.lines += 1
+        if self._manager is not None:
+            self._manager._touch(self)
+        return self.control.handle_line(line)
+
+    def save(self, filename):
+        """Saves the session's game, if it was started.
+
+        Args:
+            filename: The file to save to.
+
+        Returns:
+            bool: True if the game was saved.
+        """
+        if self.hibernated is not None:
+            # Convert the snapshot rather than waking the game up.
+            data = self._read_snapshot()
+            data.pop("dialogue", None)
+            with open(filename, "w") as f:
+                json.dump(data, f, indent=4)
+            return True
+        if self._control is None:
+            return False
+        return not self._control.game.save_game(filename).startswith("Error")
+
+    def save_slot(self, slot=None):
+        """Saves the session's game to one of its slots in the save directory.
+
+        Args:
+            slot: The slot name, or None for the autosave file.
+
+        Returns:
+            str: The game's message, naming the file without its directory.
+
+        Raises:
+            ValueError: If the slot name is malformed or the session has no
+                save directory.
+        """
+        path = self._slot_path(slot)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return self.game.save_game(path).replace(path, os.path.basename(path))
+
+    def load_slot(self, slot=None):
+        """Loads the session's game from one of its slots in the save directory.
+
+        Args:
+            slot: The slot name, or None for the autosave file.
+
+        Returns:
+            str: The game's message, naming the file without its directory.
+
+        Raises:
+            ValueError: If the slot name is malformed or the session has no
+                save directory.
+        """
+        path = self._slot_path(slot)
+        return self.game.load_game(path).replace(path, os.path.basename(path))
+
+    def hibernate(self, path):
+        """Writes the game to a compressed snapshot and releases it.
+
+        The game is rebuilt from the snapshot when the session is next used.
+
+        Args:
+            path: The snapshot file to write.
+
+        Returns:
+            bool: True if the session was hibernated, False if it had no game.
+        """
+        if self._control is None:
+            return False
+        state = self._control.game.dump_state(compact=True, dialogue=True)
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(zlib.compress(state.encode("utf-8"), 1))
+        os.replace(temporary, path)
+        self.hibernated = path
+        self._control = None
+        return True
+
+    def dump_trace(self, path=None):
+        """Writes the session's flight recorder trace to a file.
+
+        The game's state is included if the game is in memory; a hibernated
+        session is not woken up.
+
+        Args:
+            path: The file to write. Defaults to a new file in the
+                recorder's dump directory.
+
+        Returns:
+            str: The file written, or None if the session has no recorder.
+        """
+        if self.recorder is None:
+            return None
+        game = self._control.game if self._control is not None else None
+        return self.recorder.dump(path or self.recorder.dump_path(), game)
+
+    def discard_snapshot(self):
+        """Deletes the session's hibernation snapshot, if it has one.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self.hibernated is not None:
+            try:
+                os.remove(self.hibernated)
+            except FileNotFoundError:
+                pass
+            self.hibernated = None
+
+    def _slot_path(self, slot):
+        path = self._manager.save_path(self.id, slot) if self._manager is not None else None
+        if path is None:
+            raise ValueError("Saving is disabled on this server")
+        return path
+
+    def _save_command(self, name):
+        return self._slot_command(self.save_slot, name)
+
+    def _load_command(self, name):
+        return self._slot_command(self.load_slot, name)
+
+    def _slot_command(self, method, name):
+        # "save game" and "save game.json" both use the slot "game".
+        slot = name[:-len(".json")] if name.endswith(".json") else name
+        try:
+            return method(slot)
+        except ValueError:
+            if self._manager.save_dir is None:
+                return "Saving is disabled on this server."
+            return "Save names may only use letters, digits, '-' and '_'."
+
+    def _resume_command(self, session_id):
+        try:
+            return self._manager.resume(self, session_id)
+        except ValueError as e:
+            return str(e)
+
+    def _read_snapshot(self):
+        with open(self.hibernated, "rb") as f:
+            return json.loads(zlib.decompress(f.read()))
+
+    def _thaw(self, control):
+        control.game.restore_state(self._read_snapshot())
+        self.discard_snapshot()
+
+
+class SessionManager:
+    """Creates and tracks sessions by id.
+
+    Safe to use from several threads.
+
+    Args:
+        save_dir: Directory for autosaves, or None to disable them.
+        control_factory: Called with no arguments to create each session's Control.
+        id_prefix: Prepended to generated session ids.
+        max_active: The most games kept in memory before the least recently
+            used sessions are hibernated, or None for no limit.
+        max_memory: A resident memory size in bytes. While the process is
+            above it, each session that starts or wakes up hibernates the
+            least recently used one. None for no limit.
+        hibernate_dir: Where hibernation snapshots are written. Defaults to
+            a "hibernated" directory inside `save_dir`.
+        pool_size: If nonzero, games for new sessions come from a ControlPool
+            keeping this many built ahead of time (see `src.pool`).
+        trace_size: How many records each session's flight recorder keeps
+            (see `src.flight_recorder`), or 0 for no recorder.
+        trace_dir: Where traces are dumped when a command raises an
+            exception or a dump is requested. Defaults to a "traces"
+            directory inside `save_dir`; with neither, traces are only kept
+            in memory.
+        metrics: A `src.metrics.CommandMetrics` shared by every session's
+            Control to time its commands, or None.
+        slowlog: A `src.slowlog.SlowCommandLog` shared by every session's
+            Control to log its slow commands, or None.
+    """
+
+    def __init__(self, save_dir=None, control_factory=Control, id_prefix="", max_active=None, max_memory=None,
+                 hibernate_dir=None, pool_size=0, trace_size=DEFAULT_TRACE_SIZE, trace_dir=None, metrics=None,
+                 slowlog=None):
+        self.save_dir = save_dir
+        self.pool = ControlPool(pool_size, control_factory) if pool_size else None
+        self.control_factory = self.pool if self.pool is not None else control_factory
+        self.id_prefix = id_prefix
+        self.max_active = max_active
+        self.max_memory = max_memory
+        if hibernate_dir is None and save_dir is not None:
+            hibernate_dir = os.path.join(save_dir, "hibernated")
+        self.hibernate_dir = hibernate_dir
+        if trace_dir is None and save_dir is not None:
+            trace_dir = os.path.join(save_dir, "traces")
+        self.trace_size = trace_size
+        self.trace_dir = trace_dir
+        self.metrics = metrics
+        self.slowlog = slowlog
+        # Games rebuilt from hibernation snapshots.
+        self.wakeups = 0
+        self._sessions = {}
+        # Sessions whose game is in memory, least recently used first.
+        self._active = OrderedDict()
+        self._lock = threading.Lock()
+        self._intro = None
+        self._closed_lines = 0
+        # Global event counters of games no longer in memory (see `game_counters`).
+        self._released_passes = 0
+        self._released_evaluations = 0
+        # Save durations (microseconds) and sizes (bytes) per kind of save.
+        self._saves = {}
+
+    def create(self, session_id=None, resumable=False):
+        """Creates a session.
+
+        Args:
+            session_id: The id to use. A random one is generated if omitted.
+            resumable: Whether the player can take over an autosaved game
+                with ``resume <id>``. Meant for clients that cannot name
+                their session when they connect, such as telnet players.
+
+        Returns:
+            Session: The new session.
+
+        Raises:
+            ValueError: If the id is malformed or already in use.
+        """
+        if session_id is None:
+            session_id = self.id_prefix + secrets.token_hex(8)
+        elif not _SESSION_ID.match(session_id):
+            raise ValueError(f"Invalid session id: {session_id!r}")
+        recorder = FlightRecorder(self.trace_size, session_id, self.trace_dir) if self.trace_size else None
+        session = Session(session_id, self.control_factory, self, recorder, resumable)
+        with self._lock:
+            if session_id in self._sessions:
+                raise ValueError(f"Session {session_id} already exists")
+            self._sessions[session_id] = session
+        return session
+
+    def get(self, session_id):
+        """Returns the session with an id, or None."""
+        return self._sessions.get(session_id)
+
+    def owns(self, session_id):
+        """Returns whether sessions with an id belong in this table.
+
+        A lone server hosts every session; sharded workers override this.
+
+        Args:
+            session_id: The session's id.
+
+        Returns:
+            bool: True if the session may be created or restored here.
+        """
+        return True
+
+    def restore(self, session_id):
+        """Recreates a session from its autosave file.
+
+        Args:
+            session_id: The session's id.
+
+        Returns:
+            Session: The restored session (or the live one, if it already
+            exists), or None if there is no usable autosave.
+        """
+        if not _SESSION_ID.match(session_id):
+            return None
+        path = self.save_path(session_id)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            session = self.create(session_id)
+        except ValueError:
+            return self.get(session_id)
+        with session.lock:
+            message = session.game.load_game(path)
+        if not message.startswith("Game loaded"):
+            self.close(session_id)
+            return None
+        return session
+
+    def resume(self, session, session_id):
+        """Continues an autosaved game in a live session, which takes over its id.
+
+        Later autosaves and save slots of the session use the resumed id, so
+        the game can be resumed again after the next disconnect.
+
+        Args:
+            session: The live session.
+            session_id: The id of the session that was autosaved.
+
+        Returns:
+            str: The message to show the player.
+
+        Raises:
+            ValueError: If saving is disabled, there is no autosave with that
+                id, or its session is open in this process. The message is
+                meant for the player.
+        """
+        if self.save_dir is None:
+            raise ValueError("Saving is disabled on this server.")
+        if session_id == session.id:
+            return "You are already playing that game."
+        if not _SESSION_ID.match(session_id) or not os.path.exists(self.save_path(session_id)):
+            raise ValueError(f"There is no saved game {session_id}.")
+        with session.lock:
+            previous_id = session.id
+            self._rename(session, session_id)
+            message = session.game.load_game(self.save_path(session_id))
+            if not message.startswith("Game loaded"):
+                self._rename(session, previous_id)
+                raise ValueError(f"Game {session_id} could not be loaded.")
+            return f"Welcome back. Game {session_id} resumed.\n{session.game.get_location_description()}"
+
+    def _rename(self, session, session_id):
+        with self._lock:
+            if session_id in self._sessions:
+                raise ValueError(f"Game {session_id} is being played on another connection.")
+            del self._sessions[session.id]
+            self._sessions[session_id] = session
+            if self._active.pop(session.id, None) is not None:
+                self._active[session_id] = session
+            session.id = session_id
+        if session.recorder is not None:
+            session.recorder.name = session_id
+
+    def close(self, session_id, save=False):
+        """Removes a session, optionally autosaving it first.
+
+        Args:
+            session_id: The session's id.
+            save: Whether to autosave the session's game.
+
+        Returns:
+            Session: The removed session, or None if there was none.
+        """
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            self._active.pop(session_id, None)
+            if session is not None:
+                self._closed_lines += session.lines
+                if session._control is not None:
+                    self._release(session._control.game)
+        if session is not None and save:
+            self.autosave(session)
+        if session is not None:
+            session.discard_snapshot()
+        return session
+
+    def hibernate(self, session):
+        """Writes a session's game to disk and releases it from memory.
+
+        Sessions that are in use by another thread, have quit or have no game
+        are left alone.
+
+        Args:
+            session: The session.
+
+        Returns:
+            bool: True if the session was hibernated.
+        """
+        if self.hibernate_dir is None or not session.lock.acquire(blocking=False):
+            return False
+        try:
+            if session.done:
+                return False
+            os.makedirs(self.hibernate_dir, exist_ok=True)
+            control = session._control
+            start = time.perf_counter_ns()
+            hibernated = session.hibernate(os.path.join(self.hibernate_dir, f"{session.id}.snapshot"))
+            if hibernated:
+                self._record_save("hibernate", start, session.hibernated)
+        finally:
+            session.lock.release()
+        if hibernated:
+            with self._lock:
+                self._active.pop(session.id, None)
+                self._release(control.game)
+        return hibernated
+
+    def _touch(self, session):
+        if self.max_active is None and self.max_memory is None:
+            return
+        with self._lock:
+            if session.id in self._active:
+                self._active.move_to_end(session.id)
+
+    def _activated(self, session, woke=False):
+        if woke:
+            with self._lock:
+                self.wakeups += 1
+        if self.max_active is None and self.max_memory is None:
+            return
+        with self._lock:
+            self._active[session.id] = session
+            excess = len(self._active) - self.max_active if self.max_active is not None else 0
+            if excess <= 0 and self.max_memory is not None:
+                memory = resident_memory()
+                # Freed games are reused by new ones rather than returned to
+                # the OS, so one eviction per activation holds memory steady.
+                excess = 1 if memory is not None and memory > self.max_memory else 0
+            victims = list(islice((other for other in self._active.values() if other is not session),
+                                  max(excess, 0)))
+        for victim in victims:
+            self.hibernate(victim)
+
+    def save_path(self, session_id, slot=None):
+        """Returns the save file for a session, or None if saves are disabled.
+
+        Args:
+            session_id: The session's id.
+            slot: An optional save slot name; the autosave file is used if omitted.
+
+        Returns:
+            str: The file path.
+
+        Raises:
+            ValueError: If the slot name is malformed.
+        """
+        if self.save_dir is None:
+            return None
+        if slot is None:
+            return os.path.join(self.save_dir, f"{session_id}.json")
+        if not isinstance(slot, str) or not _SESSION_ID.match(slot):
+            raise ValueError(f"Invalid save slot: {slot!r}")
+        return os.path.join(self.save_dir, f"{session_id}-{slot}.json")
+
+    def autosave(self, session):
+        """Saves a session's game to its autosave file.
+
+        Args:
+            session: The session.
+
+        Returns:
+            str: The file written, or None if nothing was saved.
+        """
+        path = self.save_path(session.id)
+        if path is None or not session.started:
+            return None
+        os.makedirs(self.save_dir, exist_ok=True)
+        with session.lock:
+            start = time.perf_counter_ns()
+            if not session.save(path):
+                return None
+            self._record_save("autosave", start, path)
+            return path
+
+    def _record_save(self, kind, start, path):
+        micros = (time.perf_counter_ns() - start) // 1000
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        with self._lock:
+            histograms = self._saves.get(kind)
+            if histograms is None:
+                histograms = self._saves[kind] = (LatencyHistogram(), LatencyHistogram())
+            histograms[0].record(micros)
+            histograms[1].record(size)
+
+    def _release(self, game):
+        # Called with the lock held when a game leaves memory.
+        self._released_passes += game.global_event_passes
+        self._released_evaluations += game.global_event_evaluations
+
+    def save_stats(self):
+        """Returns copies of the save duration and size histograms.
+
+        Args:
+            None
+
+        Returns:
+            dict: Maps each kind of save ("autosave", "hibernate") to a
+            (durations, sizes) tuple of LatencyHistograms, in microseconds
+            and bytes.
+        """
+        with self._lock:
+            return {kind: (times.copy(), sizes.copy()) for kind, (times, sizes) in self._saves.items()}
+
+    def game_counters(self):
+        """Sums the activity counters of every game, including released ones.
+
+        The games in memory are read without locking, so a game hibernated
+        during the call may be counted twice or not at all.
+
+        Args:
+            None
+
+        Returns:
+            dict: "global_event_passes" and "global_event_evaluations"
+            (totals since the table was created), and "timers" (timers
+            currently pending in the games in memory).
+        """
+        with self._lock:
+            passes = self._released_passes
+            evaluations = self._released_evaluations
+        timers = 0
+        for session in list(self):
+            control = session._control
+            if control is None:
+                continue
+            game = control.game
+            passes += game.global_event_passes
+            evaluations += game.global_event_evaluations
+            timers += len(game.time_system.timers)
+        return {"global_event_passes": passes, "global_event_evaluations": evaluations, "timers": timers}
+
+    def autosave_all(self, active_since=None):
+        """Saves every started session.
+
+        Args:
+            active_since: If given, only sessions that ran a command after
+                this `time.monotonic()` value are saved.
+
+        Returns:
+            list: The files written.
+        """
+        sessions = list(self)
+        if active_since is not None:
+            sessions = [session for session in sessions if session.last_active > active_since]
+        return [path for path in map(self.autosave, sessions) if path]
+
+    def stats(self):
+        """Returns counters describing the table.
+
+        Args:
+            None
+
+        Returns:
+            dict: "sessions" (open), "started" (with a game created),
+            "hibernated" (with the game on disk) and "lines" (input lines
+            handled, including by closed sessions), plus "pool" (see
+            `ControlPool.stats`) when a pool is used.
+        """
+        sessions = list(self)
+        stats = {
+            "sessions": len(sessions),
+            "started": sum(1 for session in sessions if session.started),
+            "hibernated": sum(1 for session in sessions if session.hibernated is not None),
+            "lines": self._closed_lines + sum(session.lines for session in sessions),
+        }
+        if self.pool is not None:
+            stats["pool"] = self.pool.stats()
+        return stats
+
+    def memory_report(self):
+        """Measures the memory of the sessions whose game is in memory.
+
+        Each game is walked in full (see `src.memory.memory_report`), which
+        takes a few milliseconds per session, so this is meant for sizing
+        servers rather than for frequent polling.
+
+        Args:
+            None
+
+        Returns:
+            dict: "sessions" (measured), "bytes" (summed per category, see
+            `src.memory.CATEGORIES`, and "total"), "per_session" (the mean
+            total) and "resident" (the process's resident memory, or None).
+        """
+        totals = dict.fromkeys(CATEGORIES + ("total",), 0)
+        count = 0
+        for session in list(self):
+            with session.lock:
+                control = session._control
+                if control is None:
+                    continue
+                sizes = memory_report(control.game)
+            count += 1
+            for category, size in sizes.items():
+                totals[category] += size
+        return {
+            "sessions": count,
+            "bytes": totals,
+            "per_session": totals["total"] // count if count else 0,
+            "resident": resident_memory(),
+        }
+
+    def intro(self):
+        """Returns the text shown to a new player, computed once.
+
+        Every new game starts in the same state, so the opening description
+        is shared rather than computed (and a world loaded) per session.
+
+        Args:
+            None
+
+        Returns:
+            str: The welcome message and opening room description.
+        """
+        if self._intro is None:
+            # Built outside the pool: a pooled game would be wasted on this.
+            factory = self.pool.factory if self.pool is not None else self.control_factory
+            game = factory().game
+            self._intro = "Welcome to TextGameTemplate!\n" + game.get_location_description(arrival=True)
+        return self._intro
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._sessions.values()))
@@ -0,0 +1,561 @@
+"""Shared persistent world for multiplayer games.
+
+This module contains the SharedWorld class, which holds one world and the
+Player entities living in it, the WorldScheduler, which applies every
+player's commands to that world from a single thread, and the
+SharedWorldServer, which hosts a shared world over TCP.
+
+Each player has their own Game for their location, inventory, stats and
+conversation, sharing the world's rooms, items, characters, variables, time
+and global events (see `Game`). Things a player does that others in the room
+can see (arriving, leaving, picking things up, speaking) are announced to
+them.
+"""
+import asyncio
+import json
+import os
+import re
+import signal
+import threading
+from collections import deque
+from concurrent.futures import Future
+from src.control import Control
+from src.game import Game
+from src.server import PROMPT, _encode, strip_telnet
+from src.startup import finish as finish_startup
+
+_PLAYER_NAME = re.compile(r"^[A-Za-z][A-Za-z0-9_-]{0,23}$")
+# Only this many other players are named by "look"; the rest are counted.
+LISTED_PLAYERS = 5
+
+
+class Player:
+    """A player entity in a shared world.
+
+    Args:
+        name: The player's name.
+        game: The player's Game, sharing the world.
+    """
+
+    __slots__ = ("name", "control", "online", "listener", "messages", "pending", "queue_room")
+
+    def __init__(self, name, game):
+        self.name = name
+        self.control = Control(game)
+        self.online = False
+        self.listener = None
+        self.messages = deque(maxlen=100)
+        self.pending = 0
+        self.queue_room = None
+
+    @property
+    def game(self):
+        """Game: The player's view of the world."""
+        return self.control.game
+
+    @property
+    def location(self):
+        """str: The id of the room the player is in."""
+        return self.control.game.player_location
+
+    def notify(self, text):
+        """Delivers a message about something another player did.
+
+        Args:
+            text: The message.
+
+        Returns:
+            None
+        """
+        if self.listener is not None:
+            self.listener(text)
+        else:
+            self.messages.append(text)
+
+
+class SharedWorld:
+    """One world inhabited by many players.
+
+    Not thread-safe: use a WorldScheduler to run commands from several
+    connections.
+
+    Args:
+        save_path: The file the world and its players are saved to and, if
+            it exists, loaded from. None to keep the world in memory only.
+    """
+
+    def __init__(self, save_path=None):
+        self.save_path = save_path
+        self.game = Game()
+        self.players = {}
+        self.occupants = {}
+        if save_path is not None and os.path.exists(save_path):
+            self.load(save_path)
+
+    def inventories(self):
+        """Returns every player's inventory, keyed by item index holder.
+
+        Args:
+            None
+
+        Returns:
+            dict: The inventory collections.
+        """
+        return {player.game.inventory_holder: player.game.inventory for player in self.players.values()}
+
+    def join(self, name):
+        """Brings a player into the world, creating them on first arrival.
+
+        Args:
+            name: The player's name.
+
+        Returns:
+            Player: The player.
+
+        Raises:
+            ValueError: If the name is malformed or the player is already playing.
+        """
+        if not _PLAYER_NAME.match(name):
+            raise ValueError("Names start with a letter and use letters, digits, '-' and '_' (24 at most).")
+        player = self.players.get(name)
+        if player is None:
+            player = self._create_player(name)
+        elif player.online:
+            raise ValueError(f"{name} is already playing.")
+        player.online = True
+        player.control.done = False
+        self.occupants.setdefault(player.location, set()).add(player)
+        self.broadcast(player.location, f"{name} arrives.", exclude=player)
+        return player
+
+    def leave(self, player):
+        """Takes a player out of the world. Their state is kept for their return.
+
+        Args:
+            player: The player.
+
+        Returns:
+            None
+        """
+        if not player.online:
+            return
+        player.online = False
+        player.listener = None
+        self.occupants.get(player.location, set()).discard(player)
+        self.broadcast(player.location, f"{player.name} leaves.")
+
+    def run(self, player, line):
+        """Runs a player's input line and announces its visible effects.
+
+        Args:
+            player: The player.
+            line: The line as typed.
+
+        Returns:
+            list: The responses to show the player.
+        """
+        start = player.location
+        items = self.game.world_map[start].contents
+        before = {id(item): item for item in items}
+        outputs = player.control.handle_line(line)
+        location = player.location
+
+        if location != start:
+            self.occupants.get(start, set()).discard(player)
+            self.broadcast(start, f"{player.name} leaves.")
+            self.broadcast(location, f"{player.name} arrives.", exclude=player)
+            self.occupants.setdefault(location, set()).add(player)
+        else:
+            after = {id(item): item for item in items}
+            inventory = player.game.inventory
+            for key, item in before.items():
+                if key not in after and item in inventory:
+                    self.broadcast(start, f"{player.name} picks up the {item['name']}.", exclude=player)
+            for key, item in after.items():
+                if key not in before and item not in inventory:
+                    self.broadcast(start, f"{player.name} puts down the {item['name']}.", exclude=player)
+        if player.control.done:
+            self.leave(player)
+        return outputs
+
+    def run_timer(self, holder, actions):
+        """Runs the actions of a timer for the player who started it.
+
+        Timers run when any player's command advances the shared clock; the
+        actions still apply to their owner, who is told the outcome.
+
+        Args:
+            holder: The owner's inventory holder (see `Game.inventory_holder`).
+            actions: The timer's action dictionaries.
+
+        Returns:
+            None
+        """
+        player = self.players.get(holder.partition(":")[2])
+        if player is None:
+            return
+        for action in actions:
+            msg = player.game.perform_action(action)
+            if msg:
+                player.notify(msg)
+
+    def broadcast(self, room_id, text, exclude=None):
+        """Sends a message to every player in a room.
+
+        Args:
+            room_id: The room id.
+            text: The message.
+            exclude: A player not to send it to, usually the one it is about.
+
+        Returns:
+            None
+        """
+        for player in self.occupants.get(room_id, ()):
+            if player is not exclude:
+                player.notify(text)
+
+    def save(self, path=None):
+        """Writes the world and every player to a file.
+
+        Args:
+            path: The file. Defaults to `save_path`.
+
+        Returns:
+            str: The file written.
+        """
+        path = path or self.save_path
+        data = {
+            "world": json.loads(self.game.dump_state(compact=True)),
+            "players": {name: json.loads(player.game.dump_player()) for name, player in self.players.items()},
+        }
+        temporary = path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(temporary, path)
+        return path
+
+    def load(self, path):
+        """Replaces the world and its players with those saved in a file.
+
+        Args:
+            path: The file.
+
+        Returns:
+            None
+        """
+        with open(path, "r") as f:
+            data = json.load(f)
+        self.game.restore_state(data["world"])
+        self.players = {}
+        self.occupants = {}
+        for name, state in data["players"].items():
+            self._create_player(name).game.restore_player(state)
+
+    def _create_player(self, name):
+        game = Game(world=self, inventory_holder=f"inventory:{name}")
+        player = Player(name, game)
+        world_message = "The world is saved for everyone by the server."
+        player.control.handlers["save"] = lambda filename: world_message
+        player.control.handlers["load"] = lambda filename: world_message
+        player.control.handlers["look"] = lambda: self._look(player)
+        player.control.register_command(
+            {"verb": "say", "args": "text", "prompt": "Say what?"},
+            lambda text: self._say(player, text)
+        )
+        self.players[name] = player
+        return player
+
+    def _look(self, player):
+        description = player.game.get_location_description()
+        others = sorted(other.name for other in self.occupants.get(player.location, ()) if other is not player)
+        if not others:
+            return description
+        if len(others) > LISTED_PLAYERS:
+            named = ", ".join(others[:LISTED_PLAYERS])
+            return f"{description}\nAlso here: {named} and {len(others) - LISTED_PLAYERS} others."
+        return f"{description}\nAlso here: {', '.join(others)}."
+
+    def _say(self, player, text):
+        self.broadcast(player.location, f'{player.name} says, "{text}"', exclude=player)
+        return f'You say, "{text}"'
+
+
+class WorldScheduler:
+    """Applies commands to a SharedWorld from a single thread.
+
+    Commands wait in per-room queues that are served in turn, one command per
+    room per turn, so a crowded room cannot starve the others and every room
+    sees its commands in order. A player's commands always run in the order
+    they were sent, and a player with `max_pending` commands waiting is asked
+    to slow down instead of growing the queue, which bounds how long any
+    command waits.
+
+    Args:
+        world: The SharedWorld.
+        max_pending: The most commands a player may have waiting.
+    """
+
+    def __init__(self, world, max_pending=8):
+        self.world = world
+        self.max_pending = max_pending
+        self._queues = {}
+        self._ready = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        """Starts the scheduler thread.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="world-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Runs the commands already queued, then stops the scheduler thread.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def submit(self, player, line):
+        """Queues a player's input line.
+
+        Args:
+            player: The player.
+            line: The line as typed.
+
+        Returns:
+            Future: Resolves to the list of responses for the player.
+        """
+        future = Future()
+        with self._condition:
+            if player.pending >= self.max_pending:
+                future.set_result(["You are sending commands too fast. Please wait."])
+                return future
+            if not player.pending:
+                player.queue_room = player.location
+            player.pending += 1
+            self._enqueue(player.queue_room, (player, self.world.run, (player, line), future))
+        return future
+
+    def call(self, function, *args):
+        """Queues a call that changes the world, such as `SharedWorld.join`.
+
+        Args:
+            function: The callable.
+            *args: Its arguments.
+
+        Returns:
+            Future: Resolves to the call's return value.
+        """
+        future = Future()
+        with self._condition:
+            self._enqueue(None, (None, function, args, future))
+        return future
+
+    def _enqueue(self, room_id, task):
+        queue = self._queues.get(room_id)
+        if queue is None:
+            queue = self._queues[room_id] = deque()
+        if not queue:
+            self._ready.append(room_id)
+            self._condition.notify()
+        queue.append(task)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._ready and self._running:
+                    self._condition.wait()
+                if not self._ready:
+                    return
+                room_id = self._ready.popleft()
+                queue = self._queues[room_id]
+                player, function, args, future = queue.popleft()
+                if queue:
+                    self._ready.append(room_id)
+            try:
+                result = function(*args)
+            except Exception as e:
+                result = e
+            if player is not None:
+                with self._condition:
+                    player.pending -= 1
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+class SharedWorldServer:
+    """Serves a shared world over TCP: every connection is a player in it.
+
+    Args:
+        host: The interface to listen on.
+        port: The port to listen on (0 picks a free one).
+        world: The SharedWorld. Defaults to one saved to `save_path`.
+        save_path: Where the world is saved on shutdown and every
+            `autosave_interval` seconds.
+        autosave_interval: Seconds between saves, or None to save only on shutdown.
+    """
+
+    def __init__(self, host="127.0.0.1", port=4000, world=None, save_path=None, autosave_interval=60.0):
+        self.host = host
+        self.port = port
+        self.world = world if world is not None else SharedWorld(save_path)
+        self.scheduler = WorldScheduler(self.world)
+        self.autosave_interval = autosave_interval
+        self._server = None
+        self._connections = set()
+        self._autosave = None
+
+    async def start(self):
+        """Starts the scheduler and listens. `port` is updated if a free port was requested.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self.scheduler.start()
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.world.save_path is not None and self.autosave_interval:
+            self._autosave = asyncio.ensure_future(self._autosave_periodically())
+
+    async def serve_forever(self):
+        """Serves until SIGINT/SIGTERM is received, then shuts down.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self._server is None:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        await stop.wait()
+        await self.shutdown()
+
+    async def shutdown(self):
+        """Stops accepting players, saves the world and disconnects everyone.
+
+        Args:
+            None
+
+        Returns:
+            str: The file the world was saved to, or None.
+        """
+        if self._autosave is not None:
+            self._autosave.cancel()
+        self._server.close()
+        await self._server.wait_closed()
+        for writer in list(self._connections):
+            try:
+                writer.write(b"\r\nThe server is shutting down. The world has been saved.\r\n")
+                writer.close()
+            except (ConnectionError, RuntimeError):
+                pass
+        saved = None
+        if self.world.save_path is not None:
+            saved = await asyncio.wrap_future(self.scheduler.call(self.world.save))
+        self.scheduler.stop()
+        return saved
+
+    async def _autosave_periodically(self):
+        while True:
+            await asyncio.sleep(self.autosave_interval)
+            await asyncio.wrap_future(self.scheduler.call(self.world.save))
+
+    async def _handle_client(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        self._connections.add(writer)
+        player = None
+        try:
+            writer.write(_encode(f"Welcome to TextGameTemplate!\nWhat is your name?\n{PROMPT}"))
+            while player is None:
+                data = await reader.readline()
+                if not data:
+                    return
+                name = strip_telnet(data).decode("utf-8", "replace").strip()
+                try:
+                    player = await asyncio.wrap_future(self.scheduler.call(self.world.join, name))
+                except ValueError as e:
+                    writer.write(_encode(f"{e}\nWhat is your name?\n{PROMPT}"))
+
+            player.listener = lambda text: loop.call_soon_threadsafe(_push, writer, text)
+            look = await asyncio.wrap_future(self.scheduler.submit(player, "look"))
+            writer.write(_encode("\n".join(look) + "\n" + PROMPT))
+            while True:
+                data = await reader.readline()
+                if not data:
+                    break
+                line = strip_telnet(data).decode("utf-8", "replace").strip()
+                outputs = await asyncio.wrap_future(self.scheduler.submit(player, line)) if line else []
+                if player.control.done:
+                    outputs.append("Thanks for playing!")
+                    writer.write(_encode("\n".join(outputs) + "\n"))
+                    break
+                writer.write(_encode("\n".join(outputs) + "\n" + PROMPT if outputs else PROMPT))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            if player is not None and player.online:
+                self.scheduler.call(self.world.leave, player)
+            try:
+                writer.close()
+            except RuntimeError:
+                pass
+
+
+def _push(writer, text):
+    # Announcements arrive between prompts; start them on a fresh line.
+    if not writer.is_closing():
+        writer.write(_encode(f"\n{text}\n"))
+
+
+def serve_shared(host="127.0.0.1", port=4000, save_dir="saves"):
+    """Runs a SharedWorldServer until interrupted.
+
+    Args:
+        host: The interface to listen on.
+        port: The port to listen on.
+        save_dir: Where the world is saved, as ``world.json``.
+
+    Returns:
+        None
+    """
+    os.makedirs(save_dir, exist_ok=True)
+    server = SharedWorldServer(host, port, save_path=os.path.join(save_dir, "world.json"))
+
+    async def run():
+        await server.start()
+        print(f"Serving a shared world on {server.host}:{server.port}")
+        finish_startup()
+        await server.serve_forever()
+
+    asyncio.run(run())
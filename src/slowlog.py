@@ -0,0 +1,356 @@
+"""Slow-command log with the state needed to reproduce each slow command.
+
+This module contains the SlowCommandLog class. Given to a Control (as its
+`slowlog`), it times every command and, for those taking longer than a
+threshold, appends a JSON Lines entry with the command, its total time and
+a breakdown into phases:
+
+    parse       matching the words against the command grammar
+    events      room, item, character and global event processing, including
+                condition checks (but not the actions they perform)
+    actions     the actions performed
+    rendering   the rest of the handler: game logic and building the response
+
+The breakdown comes from a `PhaseTimer` installed as the game's `tracer`
+(see `src.event_trace`) only while a command runs.
+
+To make slow commands reproducible, the log keeps a checkpoint of each game:
+its compressed state, taken every `interval` input lines and whenever the
+game's state was restored (a session woken from hibernation or restored
+from an autosave, a loaded game or a ``--state`` file), and the lines run
+since. A slow entry names the checkpoint's snapshot file (written on first
+use, named by its content hash, or null for a fresh game) and lists those
+lines, so replaying them in batch mode from the snapshot reproduces the
+command. Deferred global event checks (see `Control.handle_line`) run
+between commands and are not timed.
+
+Run ``python -m src.slowlog LOG`` to list the entries; ``--script N`` prints
+the batch script reproducing entry N (for ``main.py --batch FILE --state
+SNAPSHOT``) and ``--reproduce N`` replays it and times the command again.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import weakref
+import zlib
+from src.batch import BatchRunner
+from src.control import Control
+
+DEFAULT_THRESHOLD_MS = 50.0
+DEFAULT_INTERVAL = 200
+PHASES = ("parse", "events", "actions", "rendering")
+
+
+class PhaseTimer:
+    """Splits the time spent in a game's tracer hook into events and actions.
+
+    Installed as a Game's `tracer`. Times are exclusive: an action performed
+    by an event counts under "actions" only. Another tracer (such as an
+    `src.event_trace.EventTracer`) can be chained as `inner`.
+
+    Args:
+        inner: The tracer the game had, called for every traced operation, or None.
+    """
+
+    __slots__ = ("inner", "events", "actions", "_nested")
+
+    def __init__(self, inner=None):
+        self.inner = inner
+        self.events = 0
+        self.actions = 0
+        self._nested = 0
+
+    def run(self, kind, detail, source, function, *args):
+        """Runs a traced operation and adds its exclusive time to its phase.
+
+        Args:
+            kind: The operation's kind ("action", or an event kind).
+            detail: Passed on to `inner`.
+            source: Passed on to `inner`.
+            function: The callable to run.
+            *args: Its arguments.
+
+        Returns:
+            The function's return value.
+        """
+        outer = self._nested
+        self._nested = 0
+        start = time.perf_counter_ns()
+        try:
+            if self.inner is not None:
+                return self.inner.run(kind, detail, source, function, *args)
+            return function(*args)
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            if kind == "action":
+                self.actions += elapsed - self._nested
+            else:
+                self.events += elapsed - self._nested
+            self._nested = outer + elapsed
+
+
+class _Checkpoint:
+    # A game's state at the start of a run of lines (None for a new game),
+    # the game's restore count then, and the lines since.
+
+    __slots__ = ("state", "restores", "lines")
+
+    def __init__(self, state=None, restores=0):
+        self.state = state
+        self.restores = restores
+        self.lines = []
+
+
+class SlowCommandLog:
+    """Logs commands slower than a threshold, with a reproducible snapshot reference.
+
+    One log may be shared by many Controls (and threads).
+
+    Args:
+        path: The JSON Lines file entries are appended to, or None to only
+            keep them in `entries`.
+        threshold_ms: Commands taking longer than this many milliseconds are logged.
+        snapshot_dir: Where checkpoint snapshots are written. Defaults to a
+            "snapshots" directory next to `path`.
+        interval: Input lines between checkpoints. Longer intervals cost
+            less but make reproducing a slow command replay more lines.
+        keep: How many recent entries `entries` holds (`logged` counts them all).
+    """
+
+    def __init__(self, path=None, threshold_ms=DEFAULT_THRESHOLD_MS, snapshot_dir=None,
+                 interval=DEFAULT_INTERVAL, keep=100):
+        self.path = path
+        self.threshold_ms = threshold_ms
+        if snapshot_dir is None and path is not None:
+            snapshot_dir = os.path.join(os.path.dirname(path) or ".", "snapshots")
+        self.snapshot_dir = snapshot_dir
+        self.interval = interval
+        self.keep = keep
+        self.entries = []
+        self.logged = 0
+        self._checkpoints = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def line(self, control, line):
+        """Notes an input line about to run, checkpointing the game when due.
+
+        Args:
+            control: The Control running the line.
+            line: The line as typed.
+
+        Returns:
+            None
+        """
+        checkpoint = self._checkpoints.get(control)
+        game = control.game
+        if checkpoint is None or len(checkpoint.lines) >= self.interval or checkpoint.restores != game.restores:
+            if checkpoint is None and not game.restores:
+                # A game that has neither run a line nor been restored is new.
+                checkpoint = _Checkpoint()
+            else:
+                state = game.dump_state(compact=True, dialogue=True)
+                checkpoint = _Checkpoint(zlib.compress(state.encode("utf-8"), 1), game.restores)
+            with self._lock:
+                self._checkpoints[control] = checkpoint
+        checkpoint.lines.append(line)
+
+    def call(self, control, words, verb, handler, args, parse_ns):
+        """Runs a command handler, logging the command if it is slow.
+
+        Args:
+            control: The Control running the command.
+            words: The command's words.
+            verb: The handler name the command is counted under.
+            handler: The callable to run.
+            args: The arguments to pass it.
+            parse_ns: The nanoseconds spent parsing the command.
+
+        Returns:
+            The handler's return value.
+        """
+        game = control.game
+        timer = PhaseTimer(game.tracer)
+        game.tracer = timer
+        start = time.perf_counter_ns()
+        try:
+            if control.metrics is not None:
+                return control.metrics.call(verb, handler, args, " ".join(words))
+            return handler(*args)
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            game.tracer = timer.inner
+            total_ms = (elapsed + parse_ns) / 1e6
+            if total_ms > self.threshold_ms:
+                phases = {
+                    "parse": parse_ns / 1e6,
+                    "events": timer.events / 1e6,
+                    "actions": timer.actions / 1e6,
+                    "rendering": (elapsed - timer.events - timer.actions) / 1e6,
+                }
+                self._log(control, " ".join(words), verb, total_ms, phases)
+
+    def _log(self, control, command, verb, total_ms, phases):
+        checkpoint = self._checkpoints.get(control)
+        if checkpoint is None:
+            checkpoint = _Checkpoint()
+        entry = {
+            "time": time.time(),
+            "command": command,
+            "verb": verb,
+            "ms": round(total_ms, 3),
+            "phases": {phase: round(phases[phase], 3) for phase in PHASES},
+            "snapshot": self._write_snapshot(checkpoint.state),
+            "replay": checkpoint.lines[:-1],
+            "line": checkpoint.lines[-1] if checkpoint.lines else command,
+        }
+        with self._lock:
+            self.logged += 1
+            self.entries.append(entry)
+            del self.entries[:-self.keep]
+            if self.path is not None:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def _write_snapshot(self, state):
+        # Returns the snapshot's file name, or None for the initial state.
+        if state is None or self.snapshot_dir is None:
+            return None
+        data = zlib.decompress(state)
+        name = hashlib.sha1(data).hexdigest()[:16] + ".json"
+        path = os.path.join(self.snapshot_dir, name)
+        if not os.path.exists(path):
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            temporary = f"{path}.{threading.get_ident()}.tmp"
+            with open(temporary, "wb") as f:
+                f.write(data)
+            os.replace(temporary, path)
+        return name
+
+
+def load_log(path):
+    """Reads the entries of a slow-command log file.
+
+    Args:
+        path: The log file.
+
+    Returns:
+        list: The entries, oldest first.
+    """
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def replay_script(entry):
+    """Returns the batch script reproducing a slow command.
+
+    Args:
+        entry: A log entry.
+
+    Returns:
+        list: The input lines to replay from the entry's snapshot, ending
+        with the line holding the slow command.
+    """
+    return entry["replay"] + [entry["line"]]
+
+
+def load_snapshot(control, path):
+    """Restores a checkpoint snapshot (or any compact game state) into a game.
+
+    Args:
+        control: The Control whose game is restored.
+        path: The snapshot file.
+
+    Returns:
+        None
+    """
+    with open(path, "r") as f:
+        control.game.restore_state(json.load(f))
+
+
+def reproduce(entry, snapshot_dir=None):
+    """Replays a slow command from its snapshot and times it again.
+
+    Args:
+        entry: A log entry.
+        snapshot_dir: The directory holding the entry's snapshot.
+
+    Returns:
+        dict: The entry logged for the command when run again (every
+        command in its line is logged, whatever its duration).
+    """
+    control = Control()
+    if entry["snapshot"] is not None:
+        load_snapshot(control, os.path.join(snapshot_dir or ".", entry["snapshot"]))
+    BatchRunner(control).run(entry["replay"])
+    log = SlowCommandLog(threshold_ms=-1.0)
+    control.slowlog = log
+    control.handle_line(entry["line"])
+    for logged in log.entries:
+        if logged["command"] == entry["command"]:
+            return logged
+    return log.entries[-1] if log.entries else None
+
+
+def format_entry(index, entry):
+    """Formats a log entry as one line.
+
+    Args:
+        index: The entry's position in the log.
+        entry: The entry.
+
+    Returns:
+        str: The formatted entry.
+    """
+    phases = " ".join(f"{phase} {entry['phases'][phase]:.2f}" for phase in PHASES)
+    snapshot = entry["snapshot"] or "fresh game"
+    return f"{index:>4} {entry['ms']:>9.2f} ms  {entry['command']!r} ({phases}) from {snapshot} " \
+           f"+{len(entry['replay'])} lines"
+
+
+def main(argv=None):
+    """Lists, scripts or reproduces slow commands from the command line.
+
+    Args:
+        argv: The command line arguments. Defaults to sys.argv[1:].
+
+    Returns:
+        int: The exit status.
+    """
+    parser = argparse.ArgumentParser(description="Inspect and reproduce logged slow commands")
+    parser.add_argument("log", help="the slow-command log (JSON Lines)")
+    parser.add_argument("--snapshots", help="the snapshot directory (default: 'snapshots' next to the log)")
+    parser.add_argument("--script", type=int, metavar="N", help="print the batch script reproducing entry N")
+    parser.add_argument("--reproduce", type=int, metavar="N", help="replay entry N and time its command again")
+    args = parser.parse_args(argv)
+
+    entries = load_log(args.log)
+    snapshot_dir = args.snapshots or os.path.join(os.path.dirname(args.log) or ".", "snapshots")
+    selected = args.script if args.script is not None else args.reproduce
+    if selected is not None and not -len(entries) <= selected < len(entries):
+        parser.error(f"The log has {len(entries)} entries.")
+    if args.script is not None:
+        entry = entries[args.script]
+        if entry["snapshot"] is not None:
+            print(f"# python main.py --batch FILE --state {os.path.join(snapshot_dir, entry['snapshot'])}")
+        print("\n".join(replay_script(entry)))
+        return 0
+    if args.reproduce is not None:
+        entry = entries[args.reproduce]
+        print(format_entry(args.reproduce, entry))
+        again = reproduce(entry, snapshot_dir)
+        if again is None:
+            print("The command did not run again.", file=sys.stderr)
+            return 1
+        print(format_entry(args.reproduce, dict(again, snapshot=entry["snapshot"], replay=entry["replay"])))
+        return 0
+    for index, entry in enumerate(entries):
+        print(format_entry(index, entry))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
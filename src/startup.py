@@ -0,0 +1,206 @@
+"""Startup phase timing.
+
+This module records how long each phase of starting the game takes, from
+the imports in ``main.py`` to the first room description: listing the data
+directories, parsing the JSON files, merging character templates, resolving
+the item and character references of rooms (and the deep copies that
+makes), building the world and its indexes, the global data and the
+command grammar.
+
+Recording is enabled by the ``TEXTGAME_STARTUP_PROFILE`` environment
+variable. Set to ``1``, a summary is printed on stderr once the game is
+ready; set to a file name ending in ``.json``, a Chrome trace-event file
+(for chrome://tracing or https://ui.perfetto.dev) is written there as well.
+When the variable is unset, or once `finish` has been called, `phase`
+returns a shared context manager that does nothing. Servers call `finish`
+once they are listening, so sessions created later are not recorded.
+"""
+import atexit
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+ENVIRONMENT_VARIABLE = "TEXTGAME_STARTUP_PROFILE"
+
+
+class StartupProfiler:
+    """Records nested, timed startup phases.
+
+    Args:
+        trace_path: Where `finish` writes the Chrome trace, or None.
+        stream: Where `finish` writes the summary, or None.
+    """
+
+    def __init__(self, trace_path=None, stream=None):
+        self.trace_path = trace_path
+        self.stream = stream
+        self.origin = time.perf_counter_ns()
+        self.spans = []
+        self.finished = False
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Times the code in a ``with`` block as a phase.
+
+        Phases started inside another phase are nested in it. Once
+        `finish` has been called nothing more is recorded.
+
+        Args:
+            name: The phase's name.
+
+        Yields:
+            None
+        """
+        if self.finished:
+            yield
+            return
+        parents = getattr(self._local, "path", ())
+        path = self._local.path = parents + (name,)
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self._local.path = parents
+            self.spans.append((path, start, time.perf_counter_ns(), threading.get_ident()))
+
+    def summary(self):
+        """Totals the phases by their place in the nesting, in the order they first started.
+
+        Args:
+            None
+
+        Returns:
+            list: (name, depth, count, milliseconds) tuples. Phases run
+            several times within the same parent phases (such as parsing
+            each file) are added up.
+        """
+        totals = {}
+        for path, start, end, _ in sorted(self.spans, key=lambda span: span[1]):
+            count, nanos = totals.get(path, (0, 0))
+            totals[path] = (count + 1, nanos + end - start)
+        return [(path[-1], len(path) - 1, count, nanos / 1e6) for path, (count, nanos) in totals.items()]
+
+    def report(self):
+        """Formats the summary as an indented table.
+
+        Args:
+            None
+
+        Returns:
+            str: The report.
+        """
+        elapsed = (max((span[2] for span in self.spans), default=self.origin) - self.origin) / 1e6
+        lines = [f"Startup: {elapsed:.1f} ms", f"{'ms':>9}{'count':>7}  phase"]
+        for name, depth, count, millis in self.summary():
+            lines.append(f"{millis:>9.2f}{count:>7}  {'  ' * depth}{name}")
+        return "\n".join(lines)
+
+    def trace_events(self):
+        """Returns the phases as Chrome trace events.
+
+        Args:
+            None
+
+        Returns:
+            dict: A trace-event document with one complete ("X") event per
+            phase, in microseconds since the profiler was created.
+        """
+        pid = os.getpid()
+        events = [
+            {
+                "name": path[-1], "ph": "X", "pid": pid, "tid": thread,
+                "ts": (start - self.origin) / 1e3, "dur": (end - start) / 1e3,
+            }
+            for path, start, end, thread in sorted(self.spans, key=lambda span: span[1])
+        ]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def finish(self):
+        """Stops recording and writes the summary and trace, once.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self.finished:
+            return
+        self.finished = True
+        if self.stream is not None:
+            print(self.report(), file=self.stream)
+        if self.trace_path:
+            with open(self.trace_path, "w") as f:
+                json.dump(self.trace_events(), f)
+            if self.stream is not None:
+                print(f"Startup trace written to {self.trace_path}", file=self.stream)
+
+
+_NO_PHASE = contextlib.nullcontext()
+_profiler = None
+
+
+def phase(name):
+    """Times a startup phase when startup profiling is enabled.
+
+    Args:
+        name: The phase's name.
+
+    Returns:
+        A context manager timing the ``with`` block, or one doing nothing.
+    """
+    if _profiler is None or _profiler.finished:
+        return _NO_PHASE
+    return _profiler.phase(name)
+
+
+def finish():
+    """Ends startup profiling, reporting it if it was enabled.
+
+    Args:
+        None
+
+    Returns:
+        None
+    """
+    if _profiler is not None:
+        _profiler.finish()
+
+
+def enable(trace_path=None, stream=sys.stderr):
+    """Starts recording startup phases.
+
+    Args:
+        trace_path: Where to write the Chrome trace, or None.
+        stream: Where to print the summary, or None.
+
+    Returns:
+        StartupProfiler: The profiler.
+    """
+    global _profiler
+    _profiler = StartupProfiler(trace_path, stream)
+    return _profiler
+
+
+def disable():
+    """Stops recording startup phases, without reporting them.
+
+    Args:
+        None
+
+    Returns:
+        None
+    """
+    global _profiler
+    _profiler = None
+
+
+_setting = os.environ.get(ENVIRONMENT_VARIABLE, "")
+if _setting and _setting != "0":
+    enable(_setting if _setting.endswith(".json") else None)
+    # Servers finish once listening; this covers modes that exit earlier.
+    atexit.register(finish)
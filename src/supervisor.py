@@ -0,0 +1,652 @@
+"""Multi-process sharded session server.
+
+One Python process runs game logic on one core. The Supervisor class forks
+worker processes, each hosting its own session table, and hands every
+accepted connection to a worker over a Unix socket. Workers are forked after
+the game modules and content are loaded, so they start warm.
+
+Session ids carry the shard that owns them (``"<shard>-<token>"``). HTTP
+connections are routed to the worker owning the session named in the first
+request; new sessions and TCP connections go to the workers in turn. Workers
+autosave active sessions periodically. When a worker dies, its shards are
+handed to the surviving workers, which restore those sessions from their
+last autosave on first use, and a replacement worker is started.
+"""
+import json
+import multiprocessing
+import os
+import re
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
+from multiprocessing.connection import wait
+from src.control import Control
+from src.metrics import CommandMetrics
+from src.prometheus import label_families, merge_families, start_exporter
+from src.prometheus import collect as collect_metrics
+from src.sampler import install_signal_handler
+from src.sessions import SessionManager
+from src.startup import disable as disable_startup, finish as finish_startup
+
+_REQUEST_SESSION = re.compile(rb"^[A-Z]+ /sessions/(\d+)-")
+# A worker that dies sooner than this after starting is restarted only after
+# the same delay, so a crashing worker cannot fork in a tight loop.
+RESTART_DELAY = 1.0
+# HTTP connections that send nothing for this long before routing are closed.
+ROUTE_TIMEOUT = 10.0
+# Connections are routed on their request line, read without consuming it.
+# One still incomplete after this many bytes or ROUTE_TIMEOUT is routed on
+# what has arrived; until then it is peeked at again every PARTIAL_POLL seconds.
+MAX_REQUEST_LINE = 1024
+PARTIAL_POLL = 0.01
+# How long the supervisor waits for a worker to answer a stats or metrics request.
+CONTROL_TIMEOUT = 2.0
+
+
+def shard_of(session_id):
+    """Returns the shard number encoded in a session id.
+
+    Args:
+        session_id: The session's id.
+
+    Returns:
+        int: The shard, or None if the id does not name one.
+    """
+    prefix, separator, _ = session_id.partition("-")
+    if separator and prefix.isdigit():
+        return int(prefix)
+    return None
+
+
+class ShardedSessions(SessionManager):
+    """The session table of one worker process.
+
+    Args:
+        shard: The worker's home shard; ids it generates start with it.
+        save_dir: Directory for autosaves, or None to disable them.
+        control_factory: Called with no arguments to create each session's Control.
+        **limits: `max_active`, `max_memory`, `hibernate_dir` and the other
+            options of SessionManager.
+    """
+
+    def __init__(self, shard, save_dir=None, control_factory=Control, **limits):
+        super().__init__(save_dir, control_factory, id_prefix=f"{shard}-", **limits)
+        self.home = shard
+        self.shards = frozenset((shard,))
+
+    def owns(self, session_id):
+        return shard_of(session_id) in self.shards
+
+    def get(self, session_id):
+        """Returns the session with an id, restoring it if its worker died."""
+        session = super().get(session_id)
+        if session is None and self.owns(session_id) and shard_of(session_id) != self.home:
+            session = self.restore(session_id)
+        return session
+
+
+class _Worker:
+    """The supervisor's handle on one worker process."""
+
+    __slots__ = ("slot", "shard", "process", "control", "handoff", "started")
+
+    def __init__(self, slot, shard, process, control, handoff):
+        self.slot = slot
+        self.shard = shard
+        self.process = process
+        self.control = control
+        self.handoff = handoff
+        self.started = time.monotonic()
+
+
+class Supervisor:
+    """Forks worker processes and routes connections to them.
+
+    Args:
+        host: The interface to listen on.
+        port: The port to listen on (0 picks a free one).
+        workers: The number of worker processes. Defaults to the CPU count.
+        protocol: "tcp" for the telnet line protocol or "http" for the JSON API.
+        save_dir: Where sessions are autosaved.
+        autosave_interval: Seconds between a worker's autosaves of its active
+            sessions, which bounds the progress lost if the worker dies.
+        max_active: The most games each worker keeps in memory before
+            hibernating idle sessions, or None for no limit.
+        pool_size: The number of fresh games each worker keeps built ahead of time.
+        metrics: Whether workers time their commands, for `collect`.
+        slowlog: A `src.slowlog.SlowCommandLog` each worker logs its slow
+            commands to (workers append to the same file), or None.
+        admin_token: With "http", the bearer token enabling the workers'
+            admin endpoints, or None.
+    """
+
+    def __init__(self, host="127.0.0.1", port=4000, workers=None, protocol="tcp", save_dir="saves",
+                 autosave_interval=30.0, max_active=None, pool_size=0, metrics=False, slowlog=None,
+                 admin_token=None):
+        if protocol not in ("tcp", "http"):
+            raise ValueError(f"Unknown protocol: {protocol!r}")
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.protocol = protocol
+        self.save_dir = save_dir
+        self.autosave_interval = autosave_interval
+        self.max_active = max_active
+        self.pool_size = pool_size
+        self.metrics = metrics
+        self.slowlog = slowlog
+        self.admin_token = admin_token
+        self.restarts = 0
+        self._context = multiprocessing.get_context("fork")
+        self._listener = None
+        self._selector = None
+        self._workers = {}
+        self._owners = {}
+        self._next_shard = 0
+        self._next_worker = 0
+        self._respawns = []
+        self._unrouted = {}
+        # Connections whose request line has only partly arrived.
+        self._partial = {}
+        self._stopping = False
+        # Guards the control pipes, as `stats` may be called from any thread.
+        self._control_lock = threading.Lock()
+        # Numbers the requests sent to workers; replies carry the number back.
+        self._sequence = 0
+
+    def start(self):
+        """Starts listening and forks the workers. `port` is updated if a free port was requested.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._listener = socket.create_server((self.host, self.port), backlog=1024)
+        self._listener.setblocking(False)
+        self.port = self._listener.getsockname()[1]
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        # Load the game code and data once so every fork inherits it.
+        SessionManager().intro()
+        for slot in range(self.workers):
+            self._spawn(slot)
+
+    def serve_forever(self):
+        """Routes connections until `stop` is called (or SIGINT/SIGTERM is received).
+
+        Args:
+            None
+
+        Returns:
+            list: The autosave files written on shutdown.
+        """
+        if self._listener is None:
+            self.start()
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(sig, lambda signum, frame: self.stop())
+            if hasattr(signal, "SIGUSR2"):
+                # Profiling the supervisor is of little use: profile every worker.
+                signal.signal(signal.SIGUSR2, lambda signum, frame: self._signal_workers(signum))
+        while not self._stopping:
+            for key, _ in self._selector.select(timeout=PARTIAL_POLL if self._partial else 0.5):
+                if key.fileobj is self._listener:
+                    self._accept()
+                elif isinstance(key.data, _Worker):
+                    self._worker_died(key.data)
+                else:
+                    self._selector.unregister(key.fileobj)
+                    self._route(key.fileobj, self._unrouted.pop(key.fileobj))
+            for conn, accepted in list(self._partial.items()):
+                del self._partial[conn]
+                self._route(conn, accepted)
+            self._respawn_due()
+            self._expire_unrouted()
+        return self.shutdown()
+
+    def stop(self):
+        """Asks `serve_forever` to shut down. Safe to call from any thread.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._stopping = True
+
+    def shutdown(self):
+        """Closes the listener, stops every worker and collects their autosaves.
+
+        Args:
+            None
+
+        Returns:
+            list: The autosave files written.
+        """
+        if self._listener is not None:
+            for conn in [*self._unrouted, *self._partial]:
+                conn.close()
+            self._unrouted.clear()
+            self._partial.clear()
+            self._selector.close()
+            self._listener.close()
+            self._listener = None
+        saved = []
+        for worker in list(self._workers.values()):
+            with self._control_lock:
+                saved.extend(self._request(worker, "stop", 10) or ())
+        for worker in list(self._workers.values()):
+            worker.process.join(5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.control.close()
+            worker.handoff.close()
+        self._workers.clear()
+        return saved
+
+    def stats(self):
+        """Collects and sums the counters of every worker.
+
+        Args:
+            None
+
+        Returns:
+            dict: The totals of each worker's session counters, "restarts",
+            and "workers", the list of per-worker reports.
+        """
+        reports = []
+        with self._control_lock:
+            for worker in list(self._workers.values()):
+                report = self._request(worker, "stats")
+                if report is not None:
+                    reports.append(dict(report, slot=worker.slot))
+        totals = {key: sum(report[key] for report in reports) for key in ("sessions", "started", "hibernated", "lines")}
+        return dict(totals, restarts=self.restarts, workers=reports)
+
+    def collect(self):
+        """Collects every worker's Prometheus metrics (see `src.prometheus`).
+
+        Args:
+            None
+
+        Returns:
+            list: The merged metric families, each worker's samples labelled
+            with its ``worker`` slot, plus the supervisor's own.
+        """
+        groups = []
+        with self._control_lock:
+            for worker in list(self._workers.values()):
+                families = self._request(worker, "metrics")
+                if families is not None:
+                    groups.append(label_families(families, (("worker", str(worker.slot)),)))
+        own = [
+            ("textgame_workers", "gauge", "Worker processes.", [("textgame_workers", (), len(self._workers))]),
+            ("textgame_worker_restarts_total", "counter", "Workers restarted after dying.",
+             [("textgame_worker_restarts_total", (), self.restarts)]),
+        ]
+        return merge_families(own, *groups)
+
+    def _request(self, worker, kind, timeout=CONTROL_TIMEOUT):
+        # Sends a request to a worker and returns its reply, or None if the
+        # worker is gone or too slow. Replies to earlier requests that timed
+        # out arrive late and are dropped. The caller holds _control_lock.
+        self._sequence += 1
+        sequence = self._sequence
+        deadline = time.monotonic() + timeout
+        try:
+            worker.control.send((kind, sequence))
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not worker.control.poll(remaining):
+                    return None
+                reply_sequence, reply = worker.control.recv()
+                if reply_sequence == sequence:
+                    return reply
+        except (EOFError, OSError):
+            return None
+
+    def _signal_workers(self, signum):
+        for worker in list(self._workers.values()):
+            try:
+                os.kill(worker.process.pid, signum)
+            except (ProcessLookupError, TypeError):
+                pass
+
+    def _spawn(self, slot):
+        shard = self._next_shard
+        self._next_shard += 1
+        control, child_control = self._context.Pipe()
+        handoff, child_handoff = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        inherited = [self._listener, control, handoff]
+        for other in self._workers.values():
+            inherited.extend((other.control, other.handoff))
+        process = self._context.Process(
+            target=_worker_main,
+            args=(shard, self.protocol, child_control, child_handoff, self.save_dir, self.autosave_interval,
+                  self.max_active, self.pool_size, self.metrics, self.slowlog, self.admin_token, inherited),
+            daemon=True
+        )
+        process.start()
+        child_control.close()
+        child_handoff.close()
+
+        worker = _Worker(slot, shard, process, control, handoff)
+        self._workers[slot] = worker
+        self._owners[shard] = worker
+        self._selector.register(process.sentinel, selectors.EVENT_READ, worker)
+        return worker
+
+    def _worker_died(self, worker):
+        self._selector.unregister(worker.process.sentinel)
+        worker.process.join()
+        with self._control_lock:
+            worker.control.close()
+        worker.handoff.close()
+        del self._workers[worker.slot]
+        print(f"Worker {worker.slot} (pid {worker.process.pid}) exited with code {worker.process.exitcode}",
+              file=sys.stderr)
+
+        # Hand the dead worker's shards to the survivors, which restore its
+        # sessions from their autosaves.
+        orphaned = [shard for shard, owner in self._owners.items() if owner is worker]
+        survivors = list(self._workers.values())
+        for i, shard in enumerate(orphaned):
+            if survivors:
+                self._owners[shard] = survivors[i % len(survivors)]
+            else:
+                del self._owners[shard]
+        for survivor in survivors:
+            self._push_shards(survivor)
+
+        delay = RESTART_DELAY if time.monotonic() - worker.started < RESTART_DELAY else 0.0
+        self._respawns.append((time.monotonic() + delay, worker.slot, orphaned if not survivors else []))
+        self.restarts += 1
+
+    def _respawn_due(self):
+        now = time.monotonic()
+        due = [entry for entry in self._respawns if entry[0] <= now]
+        for entry in due:
+            self._respawns.remove(entry)
+            _, slot, orphaned = entry
+            worker = self._spawn(slot)
+            for shard in orphaned:
+                self._owners[shard] = worker
+            if orphaned:
+                self._push_shards(worker)
+
+    def _push_shards(self, worker):
+        shards = [shard for shard, owner in self._owners.items() if owner is worker]
+        with self._control_lock:
+            try:
+                worker.control.send(("shards", shards))
+            except OSError:
+                pass
+
+    def _accept(self):
+        try:
+            conn, _ = self._listener.accept()
+        except BlockingIOError:
+            return
+        if self.protocol == "http":
+            # Route once the first request has arrived and names its session.
+            self._unrouted[conn] = time.monotonic()
+            self._selector.register(conn, selectors.EVENT_READ)
+            return
+        self._route(conn)
+
+    def _expire_unrouted(self):
+        deadline = time.monotonic() - ROUTE_TIMEOUT
+        for conn, accepted in list(self._unrouted.items()):
+            if accepted < deadline:
+                self._selector.unregister(conn)
+                del self._unrouted[conn]
+                conn.close()
+
+    def _route(self, conn, accepted=None):
+        try:
+            worker = None
+            if self.protocol == "http":
+                head = conn.recv(MAX_REQUEST_LINE, socket.MSG_PEEK)
+                if not head:
+                    return
+                if (b"\n" not in head and len(head) < MAX_REQUEST_LINE
+                        and time.monotonic() - accepted < ROUTE_TIMEOUT):
+                    # The request line arrived in pieces: matching now could
+                    # send the request to the wrong worker.
+                    self._partial[conn] = accepted
+                    conn = None
+                    return
+                if head.startswith(b"GET /stats "):
+                    # Collecting stats waits on every worker: answer it off
+                    # the routing loop so new connections are not held up.
+                    threading.Thread(target=self._send_stats, args=(conn,), name="stats", daemon=True).start()
+                    conn = None
+                    return
+                match = _REQUEST_SESSION.match(head)
+                if match:
+                    worker = self._owners.get(int(match.group(1)))
+            if worker is None:
+                worker = self._next_live_worker()
+            if worker is not None:
+                socket.send_fds(worker.handoff, [b"c"], [conn.fileno()])
+        except OSError:
+            pass
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _next_live_worker(self):
+        workers = list(self._workers.values())
+        if not workers:
+            return None
+        self._next_worker = (self._next_worker + 1) % len(workers)
+        return workers[self._next_worker]
+
+    def _send_stats(self, conn):
+        try:
+            conn.settimeout(2)
+            conn.recv(65536)
+            data = json.dumps(self.stats()).encode("utf-8")
+            conn.sendall(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: close\r\n"
+                + f"Content-Length: {len(data)}\r\n\r\n".encode("ascii") + data
+            )
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+
+def _worker_main(shard, protocol, control, handoff, save_dir, autosave_interval, max_active, pool_size, metrics,
+                 slowlog, admin_token, inherited):
+    # Runs in the forked worker process.
+    for obj in inherited:
+        if obj is not None:
+            obj.close()
+    # Ctrl+C reaches the whole process group; the supervisor decides when to stop.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Startup is profiled (and reported) by the supervisor.
+    disable_startup()
+    if save_dir is not None:
+        install_signal_handler(os.path.join(save_dir, "profiles"))
+    # The pool's refill thread must be started here: threads do not survive fork.
+    sessions = ShardedSessions(
+        shard, save_dir, max_active=max_active, pool_size=pool_size, metrics=CommandMetrics() if metrics else None,
+        slowlog=slowlog
+    )
+    if protocol == "http":
+        _run_http_worker(sessions, control, handoff, autosave_interval, admin_token)
+    else:
+        _run_tcp_worker(sessions, control, handoff, autosave_interval)
+
+
+def _control_reply(sessions, message):
+    # Returns (reply, stop); the reply is None for messages that expect none.
+    # Requests carry a sequence number, sent back with the reply as
+    # (sequence, payload); the reply to "stop" is sent once sessions are saved.
+    kind = message[0]
+    if kind == "shards":
+        sessions.shards = frozenset(message[1])
+        return None, False
+    if kind == "stats":
+        return (message[1], dict(sessions.stats(), pid=os.getpid(), shards=sorted(sessions.shards))), False
+    if kind == "metrics":
+        return (message[1], collect_metrics(sessions)), False
+    if kind == "stop":
+        return None, True
+    return None, False
+
+
+def _receive_sockets(handoff):
+    # Returns the sockets passed by the supervisor, or None once it has gone.
+    try:
+        message, fds, _, _ = socket.recv_fds(handoff, 16, 1)
+    except BlockingIOError:
+        return []
+    if not message and not fds:
+        return None
+    return [socket.socket(fileno=fd) for fd in fds]
+
+
+def _run_http_worker(sessions, control, handoff, autosave_interval, admin_token):
+    from src.http_api import ApiServer
+
+    server = ApiServer(sessions=sessions, bind_and_activate=False, admin_token=admin_token)
+    last_save = time.monotonic()
+    running = True
+    stop_sequence = None
+    while running:
+        timeout = max(0.0, last_save + autosave_interval - time.monotonic())
+        for ready in wait([control, handoff], timeout):
+            if ready is handoff:
+                accepted = _receive_sockets(handoff)
+                if accepted is None:
+                    running = False
+                    break
+                for sock in accepted:
+                    sock.setblocking(True)
+                    try:
+                        server.process_request(sock, sock.getpeername())
+                    except OSError:
+                        sock.close()
+            else:
+                try:
+                    message = control.recv()
+                except EOFError:
+                    running = False
+                    break
+                reply, stop = _control_reply(sessions, message)
+                if stop:
+                    stop_sequence = message[1]
+                    running = False
+                    break
+                if reply is not None:
+                    control.send(reply)
+        if time.monotonic() >= last_save + autosave_interval:
+            now = time.monotonic()
+            sessions.autosave_all(active_since=last_save)
+            last_save = now
+
+    saved = sessions.autosave_all()
+    server.server_close()
+    _send_quietly(control, (stop_sequence, saved))
+
+
+def _run_tcp_worker(sessions, control, handoff, autosave_interval):
+    import asyncio
+    from src.server import GameServer
+
+    server = GameServer(sessions=sessions)
+    saved = []
+    stop_sequence = []
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        stopped = loop.create_future()
+        handoff.setblocking(False)
+
+        def stop():
+            if not stopped.done():
+                stopped.set_result(None)
+
+        def on_handoff():
+            accepted = _receive_sockets(handoff)
+            if accepted is None:
+                stop()
+                return
+            for sock in accepted:
+                loop.create_task(server.adopt(sock))
+
+        def on_control():
+            try:
+                message = control.recv()
+            except EOFError:
+                stop()
+                return
+            reply, should_stop = _control_reply(sessions, message)
+            if should_stop:
+                stop_sequence.append(message[1])
+                stop()
+            elif reply is not None:
+                control.send(reply)
+
+        def autosave(since):
+            now = time.monotonic()
+            sessions.autosave_all(active_since=since)
+            loop.call_later(autosave_interval, autosave, now)
+
+        loop.add_reader(handoff.fileno(), on_handoff)
+        loop.add_reader(control.fileno(), on_control)
+        loop.call_later(autosave_interval, autosave, time.monotonic())
+        await stopped
+        loop.remove_reader(handoff.fileno())
+        loop.remove_reader(control.fileno())
+        saved.extend(await server.shutdown())
+
+    asyncio.run(run())
+    _send_quietly(control, (stop_sequence[0] if stop_sequence else None, saved))
+
+
+def _send_quietly(control, message):
+    try:
+        control.send(message)
+    except OSError:
+        pass
+
+
+def serve_sharded(host="127.0.0.1", port=4000, workers=None, protocol="tcp", save_dir="saves", max_active=None,
+                  pool_size=0, metrics_port=None, slowlog=None, admin_token=None):
+    """Runs a Supervisor until interrupted.
+
+    Args:
+        host: The interface to listen on.
+        port: The port to listen on.
+        workers: The number of worker processes. Defaults to the CPU count.
+        protocol: "tcp" or "http".
+        save_dir: Where sessions are autosaved.
+        max_active: The most games each worker keeps in memory, or None.
+        pool_size: The number of fresh games each worker keeps built ahead of time.
+        metrics_port: If given, workers time their commands and the
+            supervisor serves every worker's Prometheus metrics on this port.
+        slowlog: A `src.slowlog.SlowCommandLog` for the workers' slow commands, or None.
+        admin_token: With "http", the bearer token enabling the admin endpoints, or None.
+
+    Returns:
+        None
+    """
+    supervisor = Supervisor(host, port, workers, protocol, save_dir, max_active=max_active, pool_size=pool_size,
+                            metrics=metrics_port is not None, slowlog=slowlog, admin_token=admin_token)
+    supervisor.start()
+    if metrics_port is not None:
+        start_exporter(supervisor.collect, host, metrics_port)
+    print(f"Serving {protocol} on {host}:{supervisor.port} with {supervisor.workers} workers")
+    finish_startup()
+    saved = supervisor.serve_forever()
+    print(f"Saved {len(saved)} sessions.")
@@ -7,12 +7,51 @@ interactions, stats, dialogue, and edge cases.
 
 import unittest
 from unittest.mock import patch, call
+from contextlib import redirect_stdout
 import os
+import re
+import subprocess
+import sys
 import json
 import shutil
+import io
+import asyncio
+import tempfile
+import http.client
+import multiprocessing
+import signal
+import socket
+import threading
+import time
+import collections
 from src.control import Control
 from src.game import Game
+from src.batch import BatchRunner
+from src.bench_history import append_run, compare_runs, find_run, load_history, make_run, mann_whitney_u
+from src.benchmarks import BENCHMARKS, make_game, measure, run_suite
+from src.benchmarks import main as benchmarks_main
+from src.character_index import CharacterCollection
+from src.commands import CommandGrammar, split_commands
+from src.event_trace import EventTracer
+from src.flight_recorder import FlightRecorder
+from src.item_index import ItemCollection
+from src.forkserver import ForkServer
 from src.loader import load_characters, load_templates
+from src.http_api import ApiServer, serve_http
+from src.loadgen import run_http_load, run_tcp_load
+from src.memory import CATEGORIES, allocation_diff, deep_size, memory_report
+from src.metrics import CommandMetrics, LatencyHistogram, bucket_bounds, bucket_of
+from src import sampler
+from src.sampler import SamplingProfiler, install_signal_handler, profile_for
+from src.server import GameServer, strip_telnet
+from src.supervisor import Supervisor, _Worker, shard_of
+from src.sessions import Session, SessionManager
+from src.slowlog import SlowCommandLog, load_snapshot, replay_script, reproduce
+from src.shared_world import SharedWorld, SharedWorldServer, WorldScheduler
+from src.model import Event, Exits, Item, Room
+from src.pool import ControlPool
+from src.prometheus import MetricsServer, collect, format_metrics, label_families, merge_families
+from src import startup
 
 
 class TestControl(unittest.TestCase):
@@ -285,12 +324,12 @@ class TestCoverageImprovements(unittest.TestCase):
         # Test add_item
         action_add = {"type": "add_item", "item": item}
         self.game.perform_action(action_add)
-        self.assertIn(item, self.game.inventory)
+        self.assertIn("test_item", [i["name"] for i in self.game.inventory])
 
         # Test remove_item
         action_remove = {"type": "remove_item", "item_name": "test_item"}
         self.game.perform_action(action_remove)
-        self.assertNotIn(item, self.game.inventory)
+        self.assertNotIn("test_item", [i["name"] for i in self.game.inventory])
 
     def test_perform_action_set_val(self):
         """Test set_val action.
@@ -2016,5 +2055,1805 @@ class TestBugFixes(unittest.TestCase):
         self.assertIn("Welcome to C", output)
 
 
+class TestItemIndex(unittest.TestCase):
+    def setUp(self):
+        self.game = Game()
+        self.game.player_location = "start"
+
+    def test_item_state_resolves_item_in_other_room(self):
+        """item_state finds items outside the current room via the index."""
+        condition = {"item_state": {"item": "sword", "property": "name", "value": "sword"}}
+        with patch.object(self.game, "_find_item_system", wraps=self.game._find_item_system) as search:
+            self.assertTrue(self.game.check_condition(condition))
+        # Only the inventory and the current room are searched directly.
+        self.assertEqual(search.call_count, 2)
+
+    def test_modify_item_in_other_room(self):
+        """modify_item changes an item that is not near the player."""
+        self.game.perform_action({
+            "type": "modify_item",
+            "item_name": "sword",
+            "property": "description",
+            "value": "A dull sword."
+        })
+        sword = self.game.item_index.find("sword")[0]
+        self.assertEqual(sword["description"], "A dull sword.")
+
+    def test_index_follows_take_drop_and_put(self):
+        """Moving items keeps their indexed location up to date."""
+        self.game.take_item("key")
+        key = self.game.item_index.find("key")[0]
+        self.assertEqual(self.game.item_index.location(key)[1], "inventory")
+
+        self.game.move_player("north")
+        self.game.drop_item("key")
+        self.assertEqual(self.game.item_index.location(key)[1], "hallway")
+
+        bag = {"name": "bag", "description": "A bag.", "is_container": True, "is_open": True, "contents": []}
+        self.game.perform_action({"type": "add_item", "item": bag})
+        bag = self.game.item_index.find("bag")[0]
+        self.game.take_item("key")
+        self.game.put_item("key", "bag")
+        self.assertIs(self.game.item_index.location(key)[1], bag)
+
+        self.game.perform_action({"type": "remove_item", "item_name": "bag"})
+        self.assertIsNone(self.game.item_index.location(key))
+        self.assertEqual(self.game.item_index.find("key"), [])
+
+    def test_stale_index_is_rebuilt(self):
+        """Items moved behind the index's back are still found."""
+        sword = self.game.world_map["kitchen"]["items"][0]
+        self.game.world_map["kitchen"]["items"] = []
+        self.game.world_map["cellar"]["items"] = [sword]
+
+        condition = {"item_state": {"item": "sword", "property": "name", "value": "sword"}}
+        self.assertTrue(self.game.check_condition(condition))
+        self.assertEqual(self.game.item_index.location(sword)[1], "cellar")
+
+
+class TestItemInstances(unittest.TestCase):
+    def setUp(self):
+        self.game = Game()
+        self.game.player_location = "start"
+        self.bag = {"name": "bag", "description": "A bag.", "is_container": True, "is_open": True, "contents": []}
+        self.game.inventory.append(self.bag)
+
+    def test_items_get_unique_instance_ids(self):
+        """Every item in the world has its own instance id."""
+        ids = [item["instance_id"] for item in self.game.item_index._items.values()]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertIn("instance_id", self.bag)
+        self.assertIs(self.game.item_index.get(self.bag["instance_id"]), self.bag)
+
+    def test_copies_get_new_instance_ids(self):
+        """Adding a copy of an item already in the world gives it a fresh id."""
+        copy_of_bag = json.loads(json.dumps(self.bag, default=list))
+        self.game.inventory.append(copy_of_bag)
+        self.assertNotEqual(copy_of_bag["instance_id"], self.bag["instance_id"])
+        self.assertEqual(len(self.game.inventory), 2)
+
+    def test_parent_references_follow_moves(self):
+        """Parents are updated when items move, including nested contents."""
+        self.game.take_item("key")
+        key = self.game.inventory[-1]
+        self.game.put_item("key", "bag")
+        self.assertIs(self.game.item_index.parent(key), self.bag["contents"])
+
+        self.game.drop_item("bag")
+        self.assertIs(self.game.item_index.parent(self.bag), self.game.world_map["start"]["items"])
+        self.assertIs(self.game.item_index.parent(key), self.bag["contents"])
+        self.assertTrue(self.game.check_condition(
+            {"item_state": {"item": "key", "property": "name", "value": "key"}}))
+
+    def test_cannot_put_container_inside_itself(self):
+        """The cycle check walks up the parent chain."""
+        pouch = {"name": "pouch", "description": "A pouch.", "is_container": True, "is_open": True, "contents": []}
+        self.game.inventory.append(pouch)
+        self.game.put_item("pouch", "bag")
+        self.game.take_item("pouch")
+        self.game.put_item("bag", "pouch")
+        self.assertIn(self.bag, pouch["contents"])
+        self.game.take_item("bag")
+        self.assertEqual(self.game.put_item("pouch", "bag"), "You put the pouch in the bag.")
+        self.assertEqual(
+            self.game.put_item("bag", "bag"),
+            "You can't put an item inside itself or its own contents."
+        )
+
+    def test_collections_remove_by_identity(self):
+        """Removal is keyed by instance id and rejects unknown items."""
+        self.game.inventory.remove(self.bag)
+        self.assertNotIn(self.bag, self.game.inventory)
+        self.assertIsNone(self.game.item_index.parent(self.bag))
+        with self.assertRaises(ValueError):
+            self.game.inventory.remove({"name": "bag"})
+
+    def test_remove_item_action_only_takes_from_inventory(self):
+        """remove_item removes the carried item, not one of the same name in the room."""
+        room_bag = {"name": "bag", "description": "Another bag.", "contents": []}
+        self.game.world_map["start"]["items"].append(room_bag)
+        self.game.perform_action({"type": "remove_item", "item_name": "bag"})
+        self.assertNotIn(self.bag, self.game.inventory)
+        self.assertIn(room_bag, self.game.world_map["start"]["items"])
+        self.assertIs(self.game.item_index.parent(room_bag), self.game.world_map["start"]["items"])
+
+    def test_repeated_add_item_adds_a_copy_each_time(self):
+        """Firing the same add_item twice gives two items and leaves the action alone."""
+        action = {"type": "add_item", "item": {"name": "coin", "description": "A coin."}}
+        self.game.perform_action(action)
+        self.game.perform_action(action)
+        self.assertEqual([item["name"] for item in self.game.inventory].count("coin"), 2)
+        self.assertNotIn("instance_id", action["item"])
+
+    def test_modify_room_items_are_copied(self):
+        """Replacing a room's items twice from one action keeps both rooms' items."""
+        action = {"type": "modify_room", "room_id": "start", "property": "items",
+                  "value": [{"name": "coin", "description": "A coin."}]}
+        self.game.perform_action(action)
+        self.game.perform_action(dict(action, room_id="kitchen"))
+        self.assertEqual([item["name"] for item in self.game.world_map["start"]["items"]], ["coin"])
+        self.assertEqual([item["name"] for item in self.game.world_map["kitchen"]["items"]], ["coin"])
+        self.assertNotIn("instance_id", action["value"][0])
+
+    def test_collection_indexing(self):
+        """Collections index like lists from either end."""
+        coins = [{"name": f"coin{number}", "description": "A coin."} for number in range(5)]
+        self.game.inventory.extend(coins)
+        items = list(self.game.inventory)
+        for position in range(-len(items), len(items)):
+            self.assertIs(self.game.inventory[position], items[position])
+        self.assertEqual(self.game.inventory[1:3], items[1:3])
+        with self.assertRaises(IndexError):
+            self.game.inventory[len(items)]
+        self.assertIs(self.game.inventory.pop(), coins[-1])
+
+    def test_save_load_round_trips_ids_and_parents(self):
+        """Instance ids and container nesting survive save/load."""
+        self.game.take_item("key")
+        self.game.put_item("key", "bag")
+        key_id = self.game.item_index.find("key")[0]["instance_id"]
+        bag_id = self.bag["instance_id"]
+
+        save_file = "test_save_instances.json"
+        self.addCleanup(lambda: os.path.exists(save_file) and os.remove(save_file))
+        self.assertEqual(self.game.save_game(save_file), f"Game saved to {save_file}.")
+
+        new_game = Game()
+        new_game.load_game(save_file)
+        bag = new_game.item_index.get(bag_id)
+        key = new_game.item_index.get(key_id)
+        self.assertEqual(bag["name"], "bag")
+        self.assertIs(new_game.item_index.parent(bag), new_game.inventory)
+        self.assertIs(new_game.item_index.parent(key), bag["contents"])
+
+        # New items never reuse a loaded id.
+        new_game.perform_action({"type": "add_item", "item": {"name": "coin", "description": "A coin."}})
+        coin = new_game.item_index.find("coin")[0]
+        self.assertGreater(coin["instance_id"], max(key_id, bag_id))
+
+
+class TestWorldModel(unittest.TestCase):
+    def setUp(self):
+        self.game = Game()
+
+    def test_world_is_built_from_slotted_models(self):
+        """Content is loaded into compact model objects."""
+        room = self.game.world_map["start"]
+        self.assertIsInstance(room, Room)
+        self.assertIsInstance(room.exits, Exits)
+        self.assertIsInstance(room.contents[0], Item)
+        self.assertFalse(hasattr(room, "__dict__"))
+        self.assertFalse(hasattr(room.contents[0], "__dict__"))
+
+        key = {"name": "key", "description": "A small, rusty key.", "instance_id": 1}
+        self.assertLess(sys.getsizeof(Item(key)), sys.getsizeof(key))
+
+    def test_models_behave_like_dicts(self):
+        """Models support the mapping protocol, including undeclared keys."""
+        item = Item({"name": "lamp", "description": "A lamp.", "is_lit": False})
+        self.assertEqual(item["name"], "lamp")
+        self.assertEqual(item.name, "lamp")
+        self.assertFalse(item["is_lit"])
+        self.assertNotIn("is_container", item)
+        self.assertIsNone(item.get("contents"))
+        self.assertEqual(item.get("weight", 3), 3)
+
+        item["is_lit"] = True
+        item["is_open"] = True
+        self.assertTrue(item.is_open)
+        self.assertEqual(
+            item.to_dict(),
+            {"name": "lamp", "description": "A lamp.", "is_open": True, "is_lit": True}
+        )
+        with self.assertRaises(KeyError):
+            item["weight"]
+
+    def test_plain_rooms_are_wrapped(self):
+        """Rooms assigned as plain dicts become Room objects."""
+        self.game.world_map["test_room"] = {"description": "A test room.", "exits": {"south": "start"}}
+        room = self.game.world_map["test_room"]
+        self.assertIsInstance(room, Room)
+        self.assertEqual(room["exits"]["south"], "start")
+        self.assertEqual(list(room.contents), [])
+
+    def test_modify_room_exits(self):
+        """modify_room can replace a room's exits with a plain dict."""
+        self.game.perform_action({
+            "type": "modify_room",
+            "room_id": "start",
+            "property": "exits",
+            "value": {"up": "sky_castle"}
+        })
+        self.assertIsInstance(self.game.world_map["start"].exits, Exits)
+        self.assertIn("arrive at the Sky Castle", self.game.move_player("up"))
+
+    def test_model_properties_survive_save_load(self):
+        """Declared and custom properties round-trip through save files."""
+        self.game.perform_action({
+            "type": "modify_item", "item_name": "sword", "property": "sharpness", "value": 7
+        })
+        self.game.world_map["hallway"]["exits"]["west"] = "kitchen"
+
+        save_file = "test_save_model.json"
+        self.addCleanup(lambda: os.path.exists(save_file) and os.remove(save_file))
+        self.game.save_game(save_file)
+
+        new_game = Game()
+        new_game.load_game(save_file)
+        sword = new_game.item_index.find("sword")[0]
+        self.assertEqual(sword["sharpness"], 7)
+        self.assertEqual(new_game.world_map["hallway"]["exits"]["west"], "kitchen")
+        self.assertEqual(new_game.world_map["hallway"].nth_arrival_text, {2: "You find yourself back in the long hallway."})
+
+
+class TestGameStateStorage(unittest.TestCase):
+    def setUp(self):
+        self.game = Game()
+
+    def test_exits_map_directions_to_room_ids(self):
+        """Compass exits and custom directions resolve to room ids."""
+        room = self.game.world_map["start"]
+        self.assertEqual(room.exits.get("north"), "hallway")
+        room.exits["through the mirror"] = "cellar"
+        self.assertEqual(room.exits.to_dict()["through the mirror"], "cellar")
+        self.assertIsNone(room.exits.get("nowhere"))
+
+    def test_unknown_rooms_have_no_visits(self):
+        """Rooms never entered count zero visits."""
+        self.assertEqual(self.game.visited_counts["cellar"], 0)
+        self.assertTrue(self.game.check_condition({"visited": {"room": "cellar", "count": 0, "op": "eq"}}))
+
+    def test_state_keeps_names_in_save_files(self):
+        """Visit counts and variables are saved keyed by name."""
+        self.game.game_state["test_symbol_saved"] = 3
+        self.game.move_player("north")
+
+        save_file = "test_save_symbols.json"
+        self.addCleanup(lambda: os.path.exists(save_file) and os.remove(save_file))
+        self.game.save_game(save_file)
+        with open(save_file, "r") as f:
+            data = json.load(f)
+        self.assertEqual(data["game_state"]["test_symbol_saved"], 3)
+        self.assertEqual(data["visited_counts"]["hallway"], 1)
+
+        new_game = Game()
+        new_game.load_game(save_file)
+        self.assertEqual(new_game.game_state["test_symbol_saved"], 3)
+        self.assertEqual(new_game.visited_counts["hallway"], 1)
+
+
+class TestCharacterIndex(unittest.TestCase):
+    def setUp(self):
+        self.game = Game()
+        self.game.world_map["start"]["characters"].extend(
+            [{"name": f"villager{i}", "description": f"Villager {i}."} for i in range(50)]
+            + [{"name": "sage", "description": "Old sage.", "stats": {"wis": 18}}]
+        )
+
+    def test_room_lookup_by_name(self):
+        """Characters are found by name (with articles) from the room index."""
+        self.assertEqual(self.game.examine_item("the sage"), "Old sage.")
+        self.assertIsInstance(self.game.world_map["start"]["characters"], CharacterCollection)
+        self.assertEqual(self.game.examine_item("villager49"), "Villager 49.")
+        self.assertIn("no one named ghost", self.game.talk_to_character("ghost"))
+
+    def test_find_character_in_world(self):
+        """The world-wide registry reports where a character is."""
+        guard, room_id = self.game.find_character("guard")
+        self.assertIsNotNone(guard)
+        self.assertIn(guard, self.game.world_map[room_id]["characters"])
+
+        sage, room_id = self.game.find_character("sage")
+        self.assertEqual(room_id, "start")
+        self.game._room_characters("start").move(sage, self.game._room_characters("hallway"))
+        self.assertEqual(self.game.find_character("sage"), (sage, "hallway"))
+        self.assertIn("no one named sage", self.game.talk_to_character("sage"))
+
+        self.game._room_characters("hallway").remove(sage)
+        self.assertEqual(self.game.find_character("sage"), (None, None))
+
+    def test_renamed_character_is_found(self):
+        """Renaming a character in place does not hide it from lookups."""
+        sage, _ = self.game.find_character("sage")
+        sage["name"] = "hermit"
+        self.assertEqual(self.game.examine_item("hermit"), "Old sage.")
+        self.assertEqual(self.game.find_character("hermit")[0], sage)
+
+    def test_dialogue_holds_npc_reference(self):
+        """NPC stat conditions use the NPC the dialogue was started with."""
+        sage, _ = self.game.find_character("sage")
+        sage["dialogue"] = {
+            "start_node": "start",
+            "nodes": {"start": {"text": "Hmm.", "options": [
+                {"text": "Ask for wisdom", "condition": {"npc_stat_ge": {"wis": 15}}},
+                {"text": "Leave"}
+            ]}}
+        }
+        msg = self.game.talk_to_character("sage")
+        self.assertIs(self.game.current_character, sage)
+        self.assertIn("1. Ask for wisdom", msg)
+
+        sage["stats"]["wis"] = 3
+        self.assertNotIn("Ask for wisdom", self.game._get_dialogue_text())
+        self.game.end_dialogue()
+        self.assertIsNone(self.game.current_character)
+
+
+class TestCommandGrammar(unittest.TestCase):
+    def setUp(self):
+        self.grammar = CommandGrammar()
+
+    def test_verbs_and_aliases(self):
+        """Verbs, aliases and direction words resolve to handlers and arguments."""
+        command, args, error = self.grammar.parse(["x", "rusty", "key"])
+        self.assertEqual((command.handler, args, error), ("examine", ("rusty key",), None))
+        command, args, _ = self.grammar.parse(["ne"])
+        self.assertEqual((command.handler, args), ("move", ("northeast",)))
+        command, args, _ = self.grammar.parse(["go", "u"])
+        self.assertEqual((command.handler, args), ("move", ("up",)))
+        command, args, _ = self.grammar.parse(["wait"])
+        self.assertEqual(args, (10,))
+        self.assertEqual(self.grammar.parse(["dance"]), (None, None, None))
+
+    def test_multi_word_phrases_use_longest_match(self):
+        """'talk to' is matched as one phrase, 'talk' alone still works."""
+        _, args, _ = self.grammar.parse(["talk", "to", "guard"])
+        self.assertEqual(args, ("guard",))
+        _, args, _ = self.grammar.parse(["talk", "guard"])
+        self.assertEqual(args, ("guard",))
+        _, _, error = self.grammar.parse(["talk", "to"])
+        self.assertEqual(error, "Talk to whom?")
+
+    def test_prepositions(self):
+        """Split arguments report usage or prompts when incomplete."""
+        _, args, _ = self.grammar.parse(["put", "gold", "coin", "in", "chest"])
+        self.assertEqual(args, ("gold coin", "chest"))
+        self.assertEqual(self.grammar.parse(["put", "coin"])[2], "Usage: put <item> in <container>")
+        self.assertEqual(self.grammar.parse(["put", "in", "chest"])[2], "Put what in what?")
+
+    def test_bare_split_verb_shows_usage(self):
+        """A bare ``put`` shows its usage, as the old command loop did."""
+        self.assertEqual(self.grammar.parse(["put"])[2], "Usage: put <item> in <container>")
+
+    @patch("builtins.input")
+    @patch("builtins.print")
+    def test_register_command(self, mock_print, mock_input):
+        """New verbs can be added without touching the main loop."""
+        control = Control()
+        control.register_command(
+            {"verb": "shout", "aliases": ["yell"], "args": "text", "prompt": "Shout what?"},
+            lambda text: f"You shout '{text}'."
+        )
+        mock_input.side_effect = ["yell hello there", "shout", "quit"]
+        control.main_game_loop()
+        self.assertIn(call("You shout 'hello there'."), mock_print.call_args_list)
+        self.assertIn(call("Shout what?"), mock_print.call_args_list)
+
+
+class TestNounPhrases(unittest.TestCase):
+    def setUp(self):
+        self.game = Game()
+        self.game.world_map["start"]["items"].extend([
+            {"name": "rusty key", "description": "An old rusty key."},
+            {"name": "brass key", "description": "A polished brass key.", "synonyms": ["latchkey"]},
+            {
+                "name": "box", "description": "A wooden box.", "is_container": True, "is_open": True,
+                "contents": [{"name": "golden_coin", "description": "A coin.", "adjectives": ["shiny"]}]
+            },
+        ])
+
+    def test_adjectives_and_synonyms(self):
+        """Phrases may use any words of the name, adjectives or synonyms."""
+        self.assertEqual(self.game.examine_item("polished latchkey"), "You don't see a polished latchkey here.")
+        self.assertEqual(self.game.examine_item("latchkey"), "A polished brass key.")
+        self.assertEqual(self.game.take_item("shiny coin"), "You take the golden_coin from the box.")
+        self.assertEqual(self.game.drop_item("golden coin"), "You drop the golden_coin.")
+        self.assertEqual(self.game.examine_item("grumpy soldier"), "A grumpy looking guard standing by the door.")
+
+    def test_exact_name_wins(self):
+        """An exact name match is preferred over partial matches."""
+        self.assertEqual(self.game.take_item("key"), "You take the key.")
+
+    def test_disambiguation_prompt(self):
+        """A phrase matching differently named items asks which one is meant."""
+        self.game.take_item("key")
+        self.assertEqual(
+            self.game.take_item("key"),
+            "Which do you mean, the rusty key or the brass key?"
+        )
+        self.assertEqual(self.game.take_item("brass key"), "You take the brass key.")
+        self.assertEqual(self.game.put_item("brass", "box"), "You put the brass key in the box.")
+
+    def test_resolves_through_index(self):
+        """Hits in crowded rooms come from the vocabulary index, not a scan."""
+        self.game.world_map["start"]["items"].extend(
+            {"name": f"pebble{i}", "description": "A pebble."} for i in range(500)
+        )
+        with patch.object(self.game, "_scan_items", side_effect=AssertionError("scanned")):
+            self.assertEqual(self.game.take_item("pebble250"), "You take the pebble250.")
+            self.assertEqual(self.game.examine_item("guard"), "A grumpy looking guard standing by the door.")
+
+    def test_misses_do_not_scan(self):
+        """An unknown phrase is answered from the index without walking the room."""
+        self.game.world_map["start"]["items"].extend(
+            {"name": f"pebble{i}", "description": "A pebble."} for i in range(500)
+        )
+        self.game._room_items()
+        with patch.object(ItemCollection, "__iter__", side_effect=AssertionError("iterated")):
+            self.assertEqual(self.game.take_item("unicorn"), "There is no unicorn here.")
+
+    def test_items_renamed_by_events(self):
+        """Items renamed by modify_item are found under their new name."""
+        self.game.perform_action({"type": "modify_item", "item_name": "box", "property": "name", "value": "crate"})
+        with patch.object(self.game, "_scan_items", side_effect=AssertionError("scanned")):
+            self.assertEqual(self.game.close_item("crate"), "You close the crate.")
+
+    def test_items_changed_behind_index(self):
+        """Items renamed directly are found only when a scan is asked for."""
+        box = self.game.item_index.find("box")[0]
+        box["name"] = "crate"
+        scopes = [(self.game._room_items(), 0, None)]
+        self.assertIsNone(self.game._resolve_item("crate", scopes)[0])
+        self.assertIs(self.game._resolve_item("crate", scopes, scan=True)[0], box)
+        self.assertEqual(self.game.close_item("crate"), "You close the crate.")
+
+
+class TestBatchRunner(unittest.TestCase):
+    def test_run_writes_buffered_responses(self):
+        """Responses go to the output sink; blank and comment lines are skipped."""
+        output = io.StringIO()
+        runner = BatchRunner(output=output, buffer_size=2)
+        stats = runner.run(["n", "", "# back", "s", "take key", "i"])
+        self.assertEqual(stats["commands"], 4)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertIn("long hallway", lines[0])
+        self.assertEqual(lines[2:], ["You take the key.", "You are carrying: key."])
+
+    def test_quit_stops_the_run(self):
+        """Commands after quit are not run."""
+        runner = BatchRunner()
+        stats = runner.run(["take key", "quit", "drop key"])
+        self.assertEqual(stats["commands"], 2)
+        self.assertTrue(runner.control.done)
+        self.assertEqual(runner.game.get_inventory(), "You are carrying: key.")
+
+    def test_transcript(self):
+        """Each command is recorded as a JSON line."""
+        transcript = io.StringIO()
+        BatchRunner(transcript=transcript).run(["n", "dance"])
+        records = [json.loads(line) for line in transcript.getvalue().splitlines()]
+        self.assertEqual([r["command"] for r in records], ["n", "dance"])
+        self.assertEqual(records[0]["location"], "hallway")
+        self.assertEqual(records[1]["response"], "Unknown command.")
+
+
+class TestCommandChaining(unittest.TestCase):
+    def setUp(self):
+        self.control = Control()
+        self.game = self.control.game
+        # Counts the global event checks that actually run.
+        self.game.global_events.append(Event.from_dict({
+            "condition": {},
+            "actions": [{"type": "modify_player_stat", "stat": "checks", "value": 1, "operation": "add"}],
+            "repeatable": True
+        }))
+
+    def test_split_commands(self):
+        """Periods and 'then' separate commands; dotted file names do not."""
+        self.assertEqual(
+            split_commands("Take key. n then open chest."),
+            [["take", "key"], ["n"], ["open", "chest"]]
+        )
+        self.assertEqual(split_commands("save game.json"), [["save", "game.json"]])
+        self.assertEqual(split_commands(". then ."), [])
+
+    def test_handle_line_runs_each_command(self):
+        """Chained commands run in order and stop at quit."""
+        outputs = self.control.handle_line("take key. n then s. quit. drop key")
+        self.assertEqual(outputs[0], "You take the key.")
+        self.assertIn("long hallway", outputs[1])
+        self.assertEqual(len(outputs), 3)
+        self.assertTrue(self.control.done)
+        self.assertEqual(self.game.get_inventory(), "You are carrying: key.")
+
+    @patch("builtins.input")
+    @patch("builtins.print")
+    def test_one_print_per_line(self, mock_print, mock_input):
+        """All responses to a line are written together."""
+        mock_input.side_effect = ["take key. i", "quit"]
+        self.control.main_game_loop()
+        self.assertIn(call("You take the key.\nYou are carrying: key."), mock_print.call_args_list)
+
+    def test_chained_waits_check_global_events_each_time(self):
+        """Chained waits fire time_eq events exactly as separate lines do."""
+        self.game.global_events.append(Event.from_dict({
+            "condition": {"time_eq": 10},
+            "actions": [{"type": "print", "message": "A bell rings."}]
+        }))
+        outputs = self.control.handle_line("wait 10. wait 10")
+        self.assertIn("A bell rings.", "\n".join(outputs))
+        self.assertEqual(self.game.player_stats["checks"], 2)
+        self.assertEqual(self.game.time_system.total_minutes, 20)
+
+    def test_events_apply_before_the_next_command(self):
+        """Global events triggered by a command apply before the next command runs."""
+        self.game.global_events.append(Event.from_dict({
+            "condition": {"not": {"var_true": "door_opened"}},
+            "actions": [{"type": "set_true", "target": "door_opened"}]
+        }))
+        self.control.handle_line("wait then look")
+        self.assertTrue(self.game.game_state["door_opened"])
+        self.assertEqual(self.game.player_stats["checks"], 1)
+
+
+class TestCommandMetrics(unittest.TestCase):
+    def test_histogram_buckets_keep_values_within_a_few_percent(self):
+        """Every value falls in its bucket, and buckets stay narrow."""
+        for value in (0, 1, 63, 64, 65, 1000, 123456, 10 ** 9):
+            lowest, highest = bucket_bounds(bucket_of(value))
+            self.assertLessEqual(lowest, value)
+            self.assertGreaterEqual(highest, value)
+            self.assertLessEqual(highest - lowest, max(1, value // 30))
+
+        histogram = LatencyHistogram()
+        for micros in range(1, 1001):
+            histogram.record(micros)
+        self.assertAlmostEqual(histogram.quantile(0.5), 500, delta=16)
+        self.assertAlmostEqual(histogram.quantile(0.99), 990, delta=32)
+        self.assertEqual(histogram.quantile(1.0), 1000)
+
+    def test_commands_are_counted_per_handler(self):
+        """Commands are measured per handler, and errors are counted and re-raised."""
+        metrics = CommandMetrics()
+        control = Control(metrics=metrics)
+        control.handle_line("n. s. go north. take key")
+        control.game.take_item = lambda name: 1 / 0
+        with self.assertRaises(ZeroDivisionError):
+            control.handle_line("take key")
+
+        stats = metrics.snapshot()
+        self.assertEqual(stats["move"]["count"], 3)
+        self.assertEqual(stats["take"]["count"], 2)
+        self.assertEqual(stats["take"]["errors"], 1)
+        self.assertEqual(stats["all"]["count"], 5)
+        self.assertIn("move", control.handle_line("stats")[0])
+
+    def test_stats_command_needs_metrics(self):
+        """Without metrics nothing is measured and there is no stats command."""
+        control = Control()
+        self.assertIsNone(control.metrics)
+        self.assertEqual(control.handle_line("stats"), ["Unknown command."])
+
+    def test_slowest_commands_are_profiled(self):
+        """Only the slowest commands keep their profile."""
+        metrics = CommandMetrics(profile=2)
+        control = Control(metrics=metrics)
+        control.game.get_inventory = lambda: time.sleep(0.02)
+        control.handle_line("look. i. look. look")
+
+        slowest = metrics.slowest()
+        self.assertEqual(len(slowest), 2)
+        millis, verb, text, profile = slowest[0]
+        self.assertEqual((verb, text), ("inventory", "i"))
+        self.assertGreaterEqual(millis, 20)
+        self.assertIn("sleep", profile)
+        self.assertIn("Slowest commands", metrics.report())
+
+
+class TestEventTracer(unittest.TestCase):
+    def setUp(self):
+        self.game = Game()
+        self.tracer = EventTracer()
+        self.game.tracer = self.tracer
+
+    def test_entries_are_attributed_to_their_source(self):
+        """Triggers, conditions and actions are counted per room, item and global event."""
+        self.game.world_map["start"]["events"] = {
+            "exit_north": [
+                {"condition": {"var_true": "door_locked"}, "actions": [{"type": "block", "message": "Locked."}]},
+                {"condition": {}, "actions": [{"type": "set_true", "target": "left_start"}]},
+            ]
+        }
+        self.game.global_events.append(Event.from_dict({
+            "condition": {"var_true": "left_start"},
+            "actions": [{"type": "print", "message": "You left."}],
+            "repeatable": True,
+        }))
+        index = len(self.game.global_events) - 1
+        self.game.move_player("north")
+        self.game.move_player("south")
+        self.game.pass_time(5)
+
+        entries = {(row["kind"], row["detail"], row["source"]): row for row in self.tracer.top(limit=100)}
+        self.assertEqual(entries[("events", "exit_north", "room start")]["calls"], 1)
+        self.assertEqual(entries[("condition", "", "room start")]["calls"], 1)
+        self.assertEqual(entries[("condition", "", "room start")]["passed"], 0)
+        self.assertEqual(entries[("action", "set_true", "room start")]["calls"], 1)
+        # Each move and the wait check the global events once.
+        self.assertEqual(entries[("global pass", "", "global")]["calls"], 3)
+        self.assertEqual(entries[("condition", "", f"global {index}")]["passed"], 3)
+        self.assertEqual(entries[("action", "print", f"global {index}")]["calls"], 3)
+
+    def test_report_lists_most_expensive_first(self):
+        """The report is sorted by total time."""
+        self.game.global_events.append(Event.from_dict({
+            "condition": {"item_state": {"item": "no such item", "property": "is_open", "value": True}},
+            "repeatable": True,
+        }))
+        for _ in range(3):
+            self.game.check_global_events()
+
+        rows = self.tracer.top()
+        self.assertEqual(rows[0]["kind"], "global pass")
+        self.assertEqual([row["total_ms"] for row in rows], sorted((row["total_ms"] for row in rows), reverse=True))
+        self.assertIn("global pass", self.tracer.report())
+        self.tracer.reset()
+        self.assertEqual(self.tracer.top(), [])
+
+    def test_game_without_tracer_is_unchanged(self):
+        """Without a tracer, conditions and events behave as before."""
+        self.game.tracer = None
+        self.assertTrue(self.game.check_condition({"not": {"var_true": "unset"}}))
+        self.assertFalse(self.game.check_condition({"not": {}}))
+        self.assertEqual(self.tracer.top(), [])
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_synthetic_world_scales_with_size(self):
+        """The generated world has the requested size and a reachable deep gem."""
+        game = make_game(20, depth=5)
+        self.assertEqual(len(game.world_map), 20)
+        self.assertEqual(len(game.global_events), 20)
+        self.assertEqual(len(game.time_system.timers), 20)
+        self.assertEqual(game.examine_item("gem"), "A glittering gem.")
+        self.assertIn("room_1", game.move_player("north") + game.player_location)
+        self.assertEqual(game.check_global_events(), [])
+
+    def test_measure_reports_time_per_operation(self):
+        """Each repetition reports the mean time of one operation."""
+        number, samples = measure(lambda: time.sleep(0.001), repetitions=3, warmup=0.005, min_time=0.005)
+        self.assertEqual(len(samples), 3)
+        self.assertGreaterEqual(number, 1)
+        for sample in samples:
+            self.assertGreaterEqual(sample, 0.001)
+
+    def test_suite_runs_every_benchmark(self):
+        """Every benchmark runs and leaves no scratch files behind."""
+        before = set(os.listdir(tempfile.gettempdir()))
+        report = run_suite(sizes=(5,), depth=3, repetitions=2, warmup=0.001, min_time=0.001)
+        self.assertEqual([result["name"] for result in report["results"]], list(BENCHMARKS))
+        for result in report["results"]:
+            self.assertEqual(result["size"], 5)
+            self.assertEqual(len(result["samples_us"]), 2)
+            self.assertGreater(result["median_us"], 0)
+        json.dumps(report)
+        self.assertEqual(set(os.listdir(tempfile.gettempdir())) - before, set())
+
+
+class TestBenchmarkHistory(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.history = os.path.join(self.tmp, "history.jsonl")
+
+    def run_with(self, samples, name="check_global_events", size=5):
+        return make_run({"python": "3", "results": [{"name": name, "size": size, "samples_us": samples}]})
+
+    def test_mann_whitney_u(self):
+        """The test gives the exact p-values of small samples and handles ties."""
+        self.assertEqual(mann_whitney_u([1, 2, 3], [4, 5, 6]), (0.0, 0.1))
+        u, p = mann_whitney_u(list(range(10)), list(range(10, 20)))
+        self.assertEqual(u, 0.0)
+        self.assertAlmostEqual(p, 1.0825e-05, places=8)
+        self.assertEqual(mann_whitney_u([1, 2, 3, 4], [1, 2, 3, 4])[1], 1.0)
+        self.assertLess(mann_whitney_u(list(range(40)), list(range(20, 60)))[1], 1e-6)
+
+    def test_runs_are_stored_with_their_origin(self):
+        """Runs record the machine and commit and can be found again."""
+        first = self.run_with([10.0] * 5)
+        second = self.run_with([20.0] * 5)
+        append_run(self.history, first)
+        append_run(self.history, second)
+
+        history = load_history(self.history)
+        self.assertEqual(len(history), 2)
+        self.assertEqual(len(history[0]["machine"]), 12)
+        self.assertIn("commit", history[0])
+        self.assertEqual(find_run(history, "latest")["results"], second["results"])
+        self.assertEqual(find_run(history, "-2")["results"], first["results"])
+        with self.assertRaises(LookupError):
+            find_run(history, "-3")
+        with self.assertRaises(LookupError):
+            find_run([], "latest")
+
+    def test_only_significant_changes_count(self):
+        """A change must exceed the threshold and be significant."""
+        baseline = self.run_with([100.0, 101.0, 99.0, 100.5, 99.5, 100.2, 99.8, 100.1])
+        slower = self.run_with([120.0, 121.0, 119.0, 120.5, 119.5, 120.2, 119.8, 120.1])
+        noisy = self.run_with([60.0, 140.0, 100.0, 150.0, 70.0, 130.0, 90.0, 110.0])
+        faster = self.run_with([80.0, 81.0, 79.0, 80.5, 79.5, 80.2, 79.8, 80.1])
+
+        self.assertEqual(compare_runs(baseline, slower)[0]["verdict"], "regression")
+        self.assertEqual(compare_runs(baseline, faster)[0]["verdict"], "improvement")
+        self.assertEqual(compare_runs(baseline, noisy)[0]["verdict"], "same")
+        self.assertEqual(compare_runs(baseline, slower, threshold=0.5)[0]["verdict"], "same")
+        self.assertEqual(compare_runs(baseline, self.run_with([1.0], name="other")), [])
+
+    def test_benchmark_command_fails_on_regression(self):
+        """Comparing against a much faster baseline exits with status 1."""
+        # Five repetitions a side are the fewest that can reach p < 0.05.
+        append_run(self.history, self.run_with([0.001, 0.002, 0.003, 0.004, 0.005]))
+        arguments = [
+            "check_global_events", "--sizes", "5", "--repetitions", "5", "--warmup", "0.001",
+            "--min-time", "0.001", "--history", self.history,
+        ]
+        with patch("sys.stdout", new_callable=io.StringIO) as out, patch("sys.stderr", new_callable=io.StringIO):
+            self.assertEqual(benchmarks_main(arguments + ["--compare", "latest"]), 1)
+            self.assertEqual(benchmarks_main(arguments), 0)
+        self.assertIn("1 regression(s) in 1 benchmark(s).", out.getvalue())
+        self.assertEqual(len(load_history(self.history)), 3)
+
+
+class TestMemoryReport(unittest.TestCase):
+    def test_deep_size_counts_shared_objects_once(self):
+        """Objects reachable twice are counted once, and `seen` carries across calls."""
+        shared = ["x" * 1000]
+        seen = set()
+        first = deep_size({"a": shared, "b": shared}, seen)
+        self.assertGreater(first, 1000)
+        self.assertLess(first, 2000)
+        self.assertEqual(deep_size(shared, seen), 0)
+        rock = Item.from_dict({"name": "rock"})
+        self.assertEqual(deep_size([rock], stop={id(rock)}), sys.getsizeof([rock]))
+
+    def test_report_splits_the_game_by_category(self):
+        """Growing one part of the game shows up in its category."""
+        game = make_game(10, depth=2)
+        before = memory_report(game)
+        self.assertEqual(set(before), set(CATEGORIES) | {"total"})
+        self.assertEqual(before["total"], sum(before[category] for category in CATEGORIES))
+
+        for minutes in range(200):
+            game.time_system.schedule_event(minutes, [{"type": "print", "message": f"Tick {minutes}"}])
+        game.inventory.append(Item.from_dict({"name": "scroll", "description": "y" * 5000}))
+        after = memory_report(game)
+        self.assertGreater(after["timers"] - before["timers"], 200 * 100)
+        self.assertGreater(after["inventory"] - before["inventory"], 5000)
+        self.assertLess(abs(after["rooms"] - before["rooms"]), 1000)
+
+    def test_session_manager_reports_games_in_memory(self):
+        """Only sessions with a game in memory are measured."""
+        sessions = SessionManager()
+        sessions.create().handle_line("look")
+        sessions.create()
+        report = sessions.memory_report()
+        self.assertEqual(report["sessions"], 1)
+        self.assertEqual(report["per_session"], report["bytes"]["total"])
+        self.assertGreater(report["bytes"]["characters"], 0)
+
+    def test_allocation_diff_lists_allocation_sites(self):
+        """The diff shows the memory kept by the call and where it came from."""
+        result, total, lines = allocation_diff(lambda: [bytearray(1000) for _ in range(100)], top=3)
+        self.assertEqual(len(result), 100)
+        self.assertGreater(total, 100 * 1000)
+        self.assertIn("tests.py", lines[0])
+
+
+class TestStartupProfiler(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(startup.disable)
+
+    def test_phases_are_nested_and_totalled(self):
+        """Repeated phases are added up under their parent phase."""
+        profiler = startup.StartupProfiler()
+        with profiler.phase("load"):
+            for _ in range(3):
+                with profiler.phase("parse"):
+                    pass
+        with profiler.phase("parse"):
+            pass
+        profiler.finish()
+        with profiler.phase("late"):
+            pass
+
+        self.assertEqual(
+            [(name, depth, count) for name, depth, count, _ in profiler.summary()],
+            [("load", 0, 1), ("parse", 1, 3), ("parse", 0, 1)]
+        )
+        self.assertIn("    parse", profiler.report())
+
+    def test_game_startup_is_recorded(self):
+        """Creating a game records the loading phases, and finishing writes a Chrome trace."""
+        trace = os.path.join(tempfile.mkdtemp(), "startup.json")
+        self.addCleanup(shutil.rmtree, os.path.dirname(trace))
+        profiler = startup.enable(trace, stream=None)
+        Control()
+        startup.finish()
+
+        names = {name for name, _, _, _ in profiler.summary()}
+        for name in ("Game.__init__", "load_world_data", "parse json", "resolve references", "deepcopy",
+                     "merge template", "build world", "global data", "command grammar"):
+            self.assertIn(name, names)
+        with open(trace) as f:
+            events = json.load(f)["traceEvents"]
+        self.assertTrue(all(event["ph"] == "X" and event["dur"] >= 0 for event in events))
+        self.assertEqual(events[0]["name"], "Game.__init__")
+
+    def test_local_play_does_not_import_server_modules(self):
+        """main.py imports the server, batch and metrics modules only when used."""
+        heavy = ["asyncio", "cProfile", "http.server", "multiprocessing", "src.batch", "src.http_api",
+                 "src.metrics", "src.server", "src.slowlog", "src.supervisor"]
+        script = (
+            "import sys, main\n"
+            "print(sorted(set(sys.argv[1:]) & set(sys.modules)))\n"
+            "from src.slowlog import DEFAULT_THRESHOLD_MS\n"
+            "print(main.DEFAULT_SLOW_MS == DEFAULT_THRESHOLD_MS)\n"
+        )
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run([sys.executable, "-c", script] + heavy, cwd=root, capture_output=True, text=True)
+        self.assertEqual(result.stdout.splitlines(), ["[]", "True"], result.stderr)
+
+    def test_spans_stop_after_finish(self):
+        """Games built after startup finished, such as new sessions, are not recorded."""
+        profiler = startup.enable(stream=None)
+        SessionManager().create().handle_line("look")
+        startup.finish()
+        recorded = len(profiler.spans)
+        SessionManager().create().handle_line("look")
+        self.assertEqual(len(profiler.spans), recorded)
+        self.assertIs(startup.phase("a"), startup.phase("b"))
+
+    def test_servers_finish_startup_once_listening(self):
+        """A server reports its startup before it accepts the first connection."""
+        profiler = startup.enable(stream=None)
+        with patch("src.http_api.ApiServer.serve_forever", side_effect=KeyboardInterrupt), \
+                redirect_stdout(io.StringIO()):
+            serve_http(port=0, save_dir=None)
+        self.assertTrue(profiler.finished)
+
+    def test_disabled_phases_do_nothing(self):
+        """Without profiling, phases are a shared no-op."""
+        startup.disable()
+        self.assertIs(startup.phase("a"), startup.phase("b"))
+        startup.finish()
+
+
+class TestFlightRecorder(unittest.TestCase):
+    def setUp(self):
+        self.control = Control()
+        self.recorder = FlightRecorder(size=50, name="test")
+        self.control.game.recorder = self.recorder
+
+    def test_commands_events_actions_and_time_are_recorded(self):
+        """Each command is recorded with its handler, followed by what it caused."""
+        game = self.control.game
+        game.world_map["start"]["events"] = {
+            "exit_north": [{"condition": {}, "actions": [{"type": "set_true", "target": "left_start"}]}]
+        }
+        self.control.handle_line("n. xyzzy")
+
+        records = self.recorder.records()
+        self.assertEqual(
+            [record["kind"] for record in records], ["command", "event", "action", "time", "command"]
+        )
+        self.assertEqual((records[0]["command"], records[0]["handler"]), ("n", "move"))
+        self.assertEqual(records[1]["source"], "room start")
+        self.assertEqual(records[2]["action"], {"type": "set_true", "target": "left_start"})
+        self.assertEqual(records[3]["total_minutes"], game.time_system.total_minutes)
+        self.assertIsNone(records[4]["handler"])
+
+    def test_buffer_keeps_only_the_latest_records(self):
+        """Old records are dropped once the buffer is full."""
+        for _ in range(40):
+            self.control.handle_line("wait 1")
+        self.assertEqual(len(self.recorder), 50)
+        self.assertEqual(self.recorder.records()[-1]["kind"], "time")
+
+    def test_exception_dumps_trace_and_state(self):
+        """A command raising an exception writes the trace and the game state."""
+        dump_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dump_dir)
+        self.recorder.dump_dir = dump_dir
+        self.control.handle_line("take key")
+        with patch.object(Game, "get_inventory", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                self.control.handle_line("inventory")
+
+        (name,) = os.listdir(dump_dir)
+        with open(os.path.join(dump_dir, name)) as f:
+            dump = json.load(f)
+        self.assertEqual(dump["reason"], "exception")
+        self.assertEqual(dump["records"][-1]["error"], "RuntimeError: boom")
+        self.assertEqual(dump["records"][-2]["command"], "inventory")
+        self.assertIn("inventory", dump["state"])
+
+    def test_sessions_keep_their_trace_across_hibernation(self):
+        """A session's recorder survives hibernation and is served over HTTP."""
+        save_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, save_dir)
+        sessions = SessionManager(save_dir, trace_size=10)
+        session = sessions.create()
+        session.handle_line("take key")
+        sessions.hibernate(session)
+        session.handle_line("look")
+        self.assertEqual(
+            [record["command"] for record in session.recorder.records() if record["kind"] == "command"],
+            ["take key", "look"]
+        )
+        path = session.dump_trace()
+        self.assertEqual(os.path.dirname(path), os.path.join(save_dir, "traces"))
+        self.assertIsNone(SessionManager(trace_size=0).create().recorder)
+
+        server = ApiServer(port=0, sessions=sessions)
+        server.start_background()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        connection = http.client.HTTPConnection("127.0.0.1", server.port, timeout=10)
+        self.addCleanup(connection.close)
+        connection.request("GET", f"/sessions/{session.id}/trace")
+        response = connection.getresponse()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(len(json.loads(response.read())["records"]), len(session.recorder))
+
+
+class TestPrometheusExporter(unittest.TestCase):
+    def setUp(self):
+        self.save_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.save_dir)
+        self.sessions = SessionManager(self.save_dir, max_active=1, metrics=CommandMetrics())
+
+    def samples(self):
+        return {
+            (sample, labels): value
+            for _, _, _, samples in collect(self.sessions) for sample, labels, value in samples
+        }
+
+    def test_sessions_commands_events_and_saves_are_collected(self):
+        """Collected metrics cover sessions, commands, global events and saves."""
+        first = self.sessions.create()
+        first.handle_line("take key. n")
+        first.handle_line("wait 5")
+        passes = first.game.global_event_passes
+        self.sessions.create().handle_line("look")
+        self.sessions.autosave_all()
+
+        samples = self.samples()
+        self.assertEqual(samples[("textgame_sessions", ())], 2)
+        self.assertEqual(samples[("textgame_sessions_hibernated", ())], 1)
+        self.assertEqual(samples[("textgame_commands_total", (("verb", "take"),))], 1)
+        self.assertEqual(samples[("textgame_command_latency_seconds_count", (("verb", "move"),))], 1)
+        # The hibernated game's counters are kept.
+        self.assertEqual(samples[("textgame_global_event_passes_total", ())], passes)
+        self.assertEqual(samples[("textgame_save_duration_seconds_count", (("kind", "autosave"),))], 2)
+        self.assertEqual(samples[("textgame_save_size_bytes_count", (("kind", "hibernate"),))], 1)
+        self.assertGreater(samples[("textgame_save_size_bytes_sum", (("kind", "autosave"),))], 0)
+
+        first.handle_line("look")
+        self.assertEqual(self.samples()[("textgame_session_wakeups_total", ())], 1)
+
+    def test_text_format_and_merging(self):
+        """Families format as Prometheus text, and workers' families merge by name."""
+        family = [("x_total", "counter", "An x.", [("x_total", (("verb", 'say "hi"'),), 2)])]
+        merged = merge_families(label_families(family, (("worker", "0"),)), label_families(family, (("worker", "1"),)))
+        self.assertEqual(
+            format_metrics(merged),
+            '# HELP x_total An x.\n# TYPE x_total counter\n'
+            'x_total{worker="0",verb="say \\"hi\\""} 2\nx_total{worker="1",verb="say \\"hi\\""} 2\n'
+        )
+
+    def test_metrics_are_served_over_http(self):
+        """The exporter serves the metrics at /metrics."""
+        self.sessions.create().handle_line("look")
+        server = MetricsServer(lambda: collect(self.sessions), port=0)
+        server.start_background()
+        self.addCleanup(server.stop)
+        connection = http.client.HTTPConnection("127.0.0.1", server.port, timeout=10)
+        self.addCleanup(connection.close)
+        connection.request("GET", "/metrics")
+        response = connection.getresponse()
+        self.assertEqual(response.status, 200)
+        self.assertTrue(response.getheader("Content-Type").startswith("text/plain; version=0.0.4"))
+        self.assertIn('textgame_commands_total{verb="look"} 1\n', response.read().decode("utf-8"))
+        connection.request("GET", "/other")
+        self.assertEqual(connection.getresponse().status, 404)
+
+
+class TestSlowCommandLog(unittest.TestCase):
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.log_dir)
+        self.path = os.path.join(self.log_dir, "slow.jsonl")
+
+    def test_slow_commands_are_logged_with_phases(self):
+        """Commands over the threshold are logged with a parse/events/actions/rendering breakdown."""
+        log = SlowCommandLog(self.path, threshold_ms=-1)
+        control = Control(slowlog=log)
+        control.game.world_map["start"]["events"] = {
+            "exit_north": [{"condition": {}, "actions": [{"type": "set_true", "target": "left_start"}]}]
+        }
+        control.handle_line("take key. n")
+
+        with open(self.path) as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual([entry["verb"] for entry in entries], ["take", "move"])
+        phases = entries[1]["phases"]
+        self.assertEqual(set(phases), {"parse", "events", "actions", "rendering"})
+        self.assertGreater(phases["actions"], 0)
+        self.assertAlmostEqual(sum(phases.values()), entries[1]["ms"], delta=0.01)
+        self.assertIsNone(entries[1]["snapshot"])
+        self.assertEqual((entries[1]["replay"], entries[1]["line"]), ([], "take key. n"))
+        self.assertIsNone(control.game.tracer)
+
+    def test_fast_commands_are_not_logged(self):
+        """Commands under the threshold leave no entry."""
+        sessions = SessionManager(slowlog=SlowCommandLog(self.path, threshold_ms=1000))
+        sessions.create().handle_line("look. take key")
+        self.assertEqual(sessions.slowlog.logged, 0)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_entries_reproduce_from_their_snapshot(self):
+        """Replaying an entry's lines from its snapshot reaches the same state."""
+        log = SlowCommandLog(self.path, threshold_ms=-1, interval=3)
+        control = Control(slowlog=log)
+        for line in ("take key", "n", "wait 5", "s", "drop key"):
+            control.handle_line(line)
+        entry = log.entries[-1]
+        self.assertIsNotNone(entry["snapshot"])
+        self.assertEqual(replay_script(entry), ["s", "drop key"])
+
+        replayed = Control()
+        load_snapshot(replayed, os.path.join(self.log_dir, "snapshots", entry["snapshot"]))
+        BatchRunner(replayed).run(replay_script(entry))
+        self.assertEqual(replayed.game.dump_state(compact=True), control.game.dump_state(compact=True))
+
+        again = reproduce(entry, os.path.join(self.log_dir, "snapshots"))
+        self.assertEqual((again["command"], again["verb"]), ("drop key", "drop"))
+
+    def test_entries_of_restored_sessions_reproduce(self):
+        """A session woken from hibernation is checkpointed from its restored state."""
+        log = SlowCommandLog(self.path, threshold_ms=-1)
+        sessions = SessionManager(self.log_dir, slowlog=log)
+        session = sessions.create()
+        session.handle_line("take key. n")
+        self.assertTrue(sessions.hibernate(session))
+        session.handle_line("drop key")
+
+        entry = log.entries[-1]
+        self.assertIsNotNone(entry["snapshot"])
+        self.assertEqual(replay_script(entry), ["drop key"])
+        replayed = Control()
+        load_snapshot(replayed, os.path.join(self.log_dir, "snapshots", entry["snapshot"]))
+        BatchRunner(replayed).run(replay_script(entry))
+        self.assertEqual(replayed.game.dump_state(compact=True), session.game.dump_state(compact=True))
+
+        # Loading a save mid-session starts a new checkpoint as well.
+        session.save_slot("before")
+        session.handle_line("take key")
+        session.load_slot("before")
+        session.handle_line("look")
+        self.assertEqual(replay_script(log.entries[-1]), ["look"])
+
+
+class TestSamplingProfiler(unittest.TestCase):
+    def test_samples_name_game_methods_and_content(self):
+        """Stacks show Game methods, and the room event and action they run."""
+        game = Game()
+        game.world_map["start"]["events"] = {
+            "exit_north": [{"condition": {}, "actions": [{"type": "set_true", "target": "left_start"}]}]
+        }
+        entered, release = threading.Event(), threading.Event()
+        original = Game._perform_action
+
+        def _perform_action(game, action):
+            entered.set()
+            release.wait(5)
+            return original(game, action)
+
+        with patch.object(Game, "_perform_action", _perform_action):
+            thread = threading.Thread(target=game.move_player, args=("north",), name="player")
+            thread.start()
+            self.assertTrue(entered.wait(5))
+            profiler = SamplingProfiler(include_idle=True)
+            profiler.sample()
+            release.set()
+            thread.join()
+
+        (stack,) = [stack for stack in profiler.stacks if stack[0] == "thread player"]
+        self.assertIn("game.py:Game.move_player", stack)
+        events = stack.index("game.py:Game.process_events")
+        self.assertEqual(stack[events + 1], "[room start: exit_north]")
+        self.assertEqual(stack[-1], "threading.py:Condition.wait")
+        self.assertIn("[action set_true]", stack)
+        self.assertIn("thread player;", profiler.collapsed())
+
+    def test_frames_without_qualified_names(self):
+        """Code objects from before Python 3.11 are labelled by their plain name."""
+        code = collections.namedtuple("Code", "co_filename co_name")("/src/game.py", "move_player")
+        self.assertEqual(SamplingProfiler()._label(code), "game.py:move_player")
+
+    def test_idle_threads_are_left_out(self):
+        """Threads waiting for work are not sampled by default."""
+        waiting = threading.Event()
+        thread = threading.Thread(target=waiting.wait, args=(5,), name="idle")
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(waiting.set)
+        profiler = SamplingProfiler()
+        profiler.sample()
+        self.assertFalse(any(stack[0] == "thread idle" for stack in profiler.stacks))
+        self.assertEqual(profiler.samples, 1)
+
+    def test_signal_profiles_the_process_for_a_while(self):
+        """The signal starts a timed profile that writes collapsed stacks; one runs at a time."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        previous = signal.getsignal(signal.SIGUSR2)
+        self.addCleanup(signal.signal, signal.SIGUSR2, previous)
+        self.assertTrue(install_signal_handler(directory, seconds=0.05))
+
+        os.kill(os.getpid(), signal.SIGUSR2)
+        with self.assertRaises(RuntimeError):
+            profile_for(1, None)
+        self.assertTrue(sampler._active.wait(5))
+        (name,) = os.listdir(directory)
+        self.assertTrue(name.startswith(f"profile-{os.getpid()}-") and name.endswith(".folded"))
+
+
+class TestGameServer(unittest.TestCase):
+    def setUp(self):
+        self.save_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.save_dir)
+
+    def test_strip_telnet(self):
+        """Telnet negotiation is removed from client input."""
+        self.assertEqual(strip_telnet(b"\xff\xfb\x01look\xff\xff\r\n"), b"look\xff\r\n")
+        self.assertEqual(strip_telnet(b"\xff\xfa\x18\x00xterm\xff\xf0n\r\n"), b"n\r\n")
+
+    def test_sessions_are_independent_and_autosaved(self):
+        """Each connection has its own game; shutdown autosaves started sessions."""
+        async def scenario():
+            server = GameServer(port=0, sessions=SessionManager(self.save_dir))
+            await server.start()
+            first = await asyncio.open_connection("127.0.0.1", server.port)
+            second = await asyncio.open_connection("127.0.0.1", server.port)
+            intro = await first[0].readuntil(b"> ")
+            await second[0].readuntil(b"> ")
+
+            first[1].write(b"take key\r\n")
+            taken = await first[0].readuntil(b"> ")
+            second[1].write(b"i\r\n")
+            inventory = await second[0].readuntil(b"> ")
+
+            saved = await server.shutdown()
+            for _, writer in (first, second):
+                writer.close()
+            return intro, taken, inventory, saved
+
+        intro, taken, inventory, saved = asyncio.run(scenario())
+        self.assertIn(b"Welcome to TextGameTemplate!", intro)
+        self.assertIn(b"You take the key.\r\n", taken)
+        self.assertIn(b"Your inventory is empty.", inventory)
+        self.assertEqual(len(saved), 2)
+
+        new_game = Game()
+        results = []
+        for path in saved:
+            new_game.load_game(path)
+            results.append(new_game.get_inventory())
+        self.assertIn("You are carrying: key.", results)
+
+    def test_save_commands_stay_in_the_save_directory(self):
+        """save and load name slots in the save directory, never a path."""
+        outside = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, outside)
+        escaped = os.path.join(outside, "escaped.json")
+
+        async def scenario():
+            server = GameServer(port=0, sessions=SessionManager(self.save_dir))
+            await server.start()
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            await reader.readuntil(b"> ")
+            replies = []
+            for line in (f"save {escaped}", "save ../escaped", "load /etc/hostname", "take key",
+                         "save game.json", "drop key", "load game", "i"):
+                writer.write(line.encode() + b"\r\n")
+                replies.append((await reader.readuntil(b"> ")).decode())
+            session_id = next(iter(server.sessions._sessions))
+            await server.shutdown()
+            writer.close()
+            return session_id, replies
+
+        session_id, replies = asyncio.run(scenario())
+        self.assertFalse(os.path.exists(escaped))
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(self.save_dir), "escaped.json")))
+        for reply in replies[:3]:
+            self.assertIn("Save names may only use letters, digits, '-' and '_'.", reply)
+        self.assertIn(f"Game saved to {session_id}-game.json.", replies[4])
+        self.assertTrue(os.path.exists(os.path.join(self.save_dir, f"{session_id}-game.json")))
+        self.assertIn(f"Game loaded from {session_id}-game.json.", replies[6])
+        self.assertIn("You are carrying: key.", replies[7])
+
+    def test_save_commands_without_save_directory(self):
+        """Servers without a save directory refuse save and load."""
+        session = SessionManager().create()
+        self.assertEqual(session.handle_line("save game"), ["Saving is disabled on this server."])
+        self.assertEqual(session.handle_line("load game"), ["Saving is disabled on this server."])
+
+    def test_disconnected_games_can_be_resumed(self):
+        """A game autosaved on disconnect is continued with the id shown on connecting."""
+        async def scenario():
+            server = GameServer(port=0, sessions=SessionManager(self.save_dir))
+            await server.start()
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            greeting = (await reader.readuntil(b"> ")).decode()
+            writer.write(b"take key\r\n")
+            await reader.readuntil(b"> ")
+            writer.close()
+            session_id = re.search(r"This is game (\S+)\.", greeting).group(1)
+            path = os.path.join(self.save_dir, f"{session_id}.json")
+            for _ in range(100):
+                if os.path.exists(path):
+                    break
+                await asyncio.sleep(0.02)
+
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            await reader.readuntil(b"> ")
+            replies = []
+            for line in ("resume nosuchgame", f"resume {session_id}", "i"):
+                writer.write(line.encode() + b"\r\n")
+                replies.append((await reader.readuntil(b"> ")).decode())
+            ids = list(server.sessions._sessions)
+            await server.shutdown()
+            writer.close()
+            return session_id, replies, ids
+
+        session_id, replies, ids = asyncio.run(scenario())
+        self.assertIn("There is no saved game nosuchgame.", replies[0])
+        self.assertIn(f"Welcome back. Game {session_id} resumed.", replies[1])
+        self.assertIn("You are carrying: key.", replies[2])
+        self.assertEqual(ids, [session_id])
+
+    def test_resume_refuses_games_in_play(self):
+        """A game open on another connection cannot be resumed twice."""
+        sessions = SessionManager(self.save_dir)
+        first = sessions.create(resumable=True)
+        first.handle_line("take key")
+        sessions.autosave(first)
+        second = sessions.create(resumable=True)
+        self.assertEqual(second.handle_line(f"resume {first.id}"),
+                         [f"Game {first.id} is being played on another connection."])
+        self.assertEqual(second.game.get_inventory(), "Your inventory is empty.")
+        self.assertEqual(sessions.create().handle_line(f"resume {first.id}"), ["Unknown command."])
+
+    def test_load_generator(self):
+        """The load generator drives several clients, which quit without leaving autosaves."""
+        async def scenario():
+            server = GameServer(port=0, sessions=SessionManager(self.save_dir))
+            await server.start()
+            report = await run_tcp_load("127.0.0.1", server.port, clients=5, commands=["look", "n", "s"])
+            await server.shutdown()
+            return report
+
+        report = asyncio.run(scenario())
+        self.assertEqual(report["errors"], 0)
+        self.assertEqual(report["commands"], 15)
+        self.assertGreater(report["latency_ms"]["max"], 0)
+        self.assertEqual(os.listdir(self.save_dir), [])
+
+
+class TestSessionHibernation(unittest.TestCase):
+    def setUp(self):
+        self.save_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.save_dir)
+        self.sessions = SessionManager(self.save_dir, max_active=2)
+
+    def test_least_recently_used_sessions_hibernate(self):
+        """Starting a game beyond the limit hibernates the least recently used one."""
+        first, second, third = (self.sessions.create() for _ in range(3))
+        first.handle_line("take key")
+        second.handle_line("look")
+        first.handle_line("look")
+        third.handle_line("look")
+
+        self.assertIsNone(first.hibernated)
+        self.assertTrue(os.path.exists(second.hibernated))
+        self.assertEqual(self.sessions.stats()["hibernated"], 1)
+
+        self.assertEqual(first.handle_line("i"), ["You are carrying: key."])
+        second.handle_line("n")
+        self.assertIsNone(second.hibernated)
+        self.assertIsNotNone(third.hibernated)
+
+    def test_rehydration_resumes_dialogue(self):
+        """A hibernated session continues exactly where it stopped."""
+        session = self.sessions.create()
+        session.handle_line("talk to guard")
+        self.assertTrue(self.sessions.hibernate(session))
+        self.assertFalse(session.started and session.hibernated is None)
+        self.assertIn("Bring me something shiny.", session.handle_line("1")[0])
+        self.assertTrue(session.game.dialogue_active)
+
+    def test_autosave_and_close_of_hibernated_session(self):
+        """Hibernated sessions autosave without waking up and leave no snapshot behind."""
+        session = self.sessions.create()
+        session.handle_line("take key")
+        self.sessions.hibernate(session)
+        snapshot = session.hibernated
+
+        path = self.sessions.autosave(session)
+        self.assertIsNotNone(session.hibernated)
+        game = Game()
+        self.assertEqual(game.load_game(path), f"Game loaded from {path}.")
+        self.assertEqual(game.get_inventory(), "You are carrying: key.")
+
+        self.sessions.close(session.id)
+        self.assertFalse(os.path.exists(snapshot))
+
+    def test_unlimited_manager_never_hibernates(self):
+        """Without limits every game stays in memory."""
+        sessions = SessionManager(self.save_dir)
+        started = [sessions.create() for _ in range(3)]
+        for session in started:
+            session.handle_line("look")
+        self.assertEqual([session.hibernated for session in started], [None, None, None])
+        self.assertIsInstance(started[0], Session)
+
+
+class TestControlPool(unittest.TestCase):
+    def test_pool_hands_out_fresh_games_and_refills(self):
+        """Pooled games are independent and the pool refills in the background."""
+        pool = ControlPool(3)
+        self.addCleanup(pool.close)
+        self.assertEqual(len(pool), 3)
+        first, second = pool(), pool()
+        self.assertIsNot(first.game.world_map, second.game.world_map)
+        first.handle_line("take key")
+        self.assertEqual(second.handle_line("i"), ["Your inventory is empty."])
+
+        for _ in range(100):
+            if len(pool) == 3:
+                break
+            time.sleep(0.01)
+        self.assertEqual(pool.stats(), {"ready": 3, "hits": 2, "misses": 0})
+
+    def test_empty_pool_builds_on_demand(self):
+        """An exhausted pool still returns a game, counted as a miss."""
+        pool = ControlPool(0)
+        self.addCleanup(pool.close)
+        self.assertIsInstance(pool(), Control)
+        self.assertEqual(pool.misses, 1)
+
+    def test_session_manager_uses_pool(self):
+        """SessionManager draws new games from its pool."""
+        sessions = SessionManager(pool_size=2)
+        self.addCleanup(sessions.pool.close)
+        sessions.create().handle_line("look")
+        self.assertEqual(sessions.stats()["pool"]["hits"], 1)
+
+    def test_intro_does_not_use_the_pool(self):
+        """Rendering the intro builds its own game rather than taking a pooled one."""
+        sessions = SessionManager(pool_size=2)
+        self.addCleanup(sessions.pool.close)
+        self.assertIn("Welcome to TextGameTemplate!", sessions.intro())
+        self.assertEqual(sessions.pool.stats(), {"ready": 2, "hits": 0, "misses": 0})
+
+    def test_counters_are_exact_across_threads(self):
+        """Hits and misses add up to the calls made from many threads."""
+        pool = ControlPool(8, factory=object)
+        self.addCleanup(pool.close)
+
+        def take():
+            for _ in range(500):
+                pool()
+        threads = [threading.Thread(target=take) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(pool.hits + pool.misses, 4000)
+
+
+class TestForkServer(unittest.TestCase):
+    def test_connections_are_served_by_forked_children(self):
+        """Each connection gets its own process and is autosaved on disconnect."""
+        save_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, save_dir)
+        server = ForkServer(port=0, save_dir=save_dir)
+        server.start()
+        # Serve from another process, or the children would inherit this
+        # process's client sockets and never see them close.
+        process = multiprocessing.get_context("fork").Process(target=server.serve_forever)
+        process.start()
+        server.shutdown()
+
+        async def play():
+            first = await asyncio.open_connection("127.0.0.1", server.port)
+            second = await asyncio.open_connection("127.0.0.1", server.port)
+            intro = await first[0].readuntil(b"> ")
+            await second[0].readuntil(b"> ")
+            first[1].write(b"take key\r\n")
+            taken = await first[0].readuntil(b"> ")
+            second[1].write(b"i\r\n")
+            inventory = await second[0].readuntil(b"> ")
+            for _, writer in (first, second):
+                writer.close()
+            return intro, taken, inventory
+
+        try:
+            intro, taken, inventory = asyncio.run(play())
+            for _ in range(100):
+                if len(os.listdir(save_dir)) == 2:
+                    break
+                time.sleep(0.02)
+        finally:
+            process.terminate()
+            process.join()
+        self.assertIn(b"Welcome to TextGameTemplate!", intro)
+        self.assertIn(b"You take the key.\r\n", taken)
+        self.assertIn(b"Your inventory is empty.", inventory)
+        self.assertEqual(len(os.listdir(save_dir)), 2)
+
+
+class TestSharedWorld(unittest.TestCase):
+    def setUp(self):
+        self.world = SharedWorld()
+        self.alice = self.world.join("Alice")
+        self.bob = self.world.join("Bob")
+
+    def test_players_share_rooms_and_see_each_other(self):
+        """Players in a room see each other and what they do there."""
+        self.assertEqual(list(self.alice.messages), ["Bob arrives."])
+        self.assertEqual(self.world.run(self.alice, "take key"), ["You take the key."])
+        self.assertEqual(self.world.run(self.bob, "take key"), ["There is no key here."])
+        self.assertIn("Also here: Alice.", self.world.run(self.bob, "look")[0])
+
+        self.world.run(self.alice, "n")
+        self.world.run(self.bob, "say where are you")
+        self.assertEqual(list(self.bob.messages), ["Alice picks up the key.", "Alice leaves."])
+        self.assertNotIn('Bob says, "where are you"', self.alice.messages)
+
+    def test_players_have_their_own_inventory_and_conversation(self):
+        """Inventories, locations and dialogue state belong to each player."""
+        self.world.run(self.alice, "take key")
+        self.assertEqual(self.world.run(self.bob, "i"), ["Your inventory is empty."])
+        self.assertEqual(self.world.run(self.bob, "drop key"), ["You don't have a key."])
+        self.world.run(self.bob, "talk to guard")
+        self.assertTrue(self.bob.game.dialogue_active)
+        self.assertFalse(self.alice.game.dialogue_active)
+        self.assertEqual(self.world.run(self.alice, "save mine"), ["The world is saved for everyone by the server."])
+
+    def test_add_item_gives_each_player_their_own_item(self):
+        """One add_item action fired for two players gives each of them an item."""
+        action = {"type": "add_item", "item": {"name": "coin", "description": "A coin."}}
+        self.alice.game.perform_action(action)
+        self.bob.game.perform_action(action)
+        self.assertEqual([item["name"] for item in self.alice.game.inventory], ["coin"])
+        self.assertEqual([item["name"] for item in self.bob.game.inventory], ["coin"])
+
+    def test_timers_apply_to_the_player_who_started_them(self):
+        """A timer's actions reach its owner even when another player advances the clock."""
+        self.alice.game.perform_action({"type": "start_timer", "minutes": 5, "actions": [
+            {"type": "add_item", "item": {"name": "coin", "description": "A coin."}},
+            {"type": "print", "message": "A coin drops into your hand."},
+        ]})
+        self.alice.messages.clear()
+        self.world.run(self.bob, "wait 10")
+        self.assertEqual([item["name"] for item in self.alice.game.inventory], ["coin"])
+        self.assertEqual(list(self.bob.game.inventory), [])
+        self.assertEqual(list(self.alice.messages), ["A coin drops into your hand."])
+
+    def test_world_persists_with_its_players(self):
+        """Saving and reloading keeps the world and each player's state."""
+        save_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, save_dir)
+        path = os.path.join(save_dir, "world.json")
+        self.world.run(self.alice, "take key")
+        self.world.run(self.bob, "n")
+        self.world.save(path)
+
+        world = SharedWorld(path)
+        alice = world.join("Alice")
+        bob = world.join("Bob")
+        self.assertEqual(world.run(alice, "i"), ["You are carrying: key."])
+        self.assertEqual(bob.location, self.bob.location)
+        self.assertEqual(world.run(alice, "take key"), ["There is no key here."])
+        with self.assertRaises(ValueError):
+            world.join("Alice")
+
+    def test_scheduler_keeps_order_and_bounds_queues(self):
+        """Each player's commands run in order; a flooding player is told to wait."""
+        scheduler = WorldScheduler(self.world, max_pending=2)
+        futures = [scheduler.submit(self.alice, line) for line in ("take key", "n", "i")]
+        self.assertEqual(futures[2].result(0), ["You are sending commands too fast. Please wait."])
+        bob = scheduler.submit(self.bob, "look")
+        scheduler.start()
+        scheduler.stop()
+        self.assertEqual(futures[0].result(0), ["You take the key."])
+        self.assertIn("long hallway", futures[1].result(0)[0])
+        self.assertNotIn("Also here", bob.result(0)[0])
+
+    def test_server_relays_room_messages(self):
+        """Connected players are announced to each other."""
+        async def scenario():
+            server = SharedWorldServer(port=0, world=self.world)
+            await server.start()
+            first = await asyncio.open_connection("127.0.0.1", server.port)
+            await first[0].readuntil(b"> ")
+            first[1].write(b"Carol\r\n")
+            await first[0].readuntil(b"> ")
+            second = await asyncio.open_connection("127.0.0.1", server.port)
+            await second[0].readuntil(b"> ")
+            second[1].write(b"Dave\r\n")
+            await second[0].readuntil(b"> ")
+            arrival = await first[0].readuntil(b"Dave arrives.\r\n")
+            second[1].write(b"say hi\r\n")
+            said = await first[0].readuntil(b'Dave says, "hi"\r\n')
+            await server.shutdown()
+            for _, writer in (first, second):
+                writer.close()
+            return arrival, said
+
+        arrival, said = asyncio.run(scenario())
+        self.assertTrue(arrival.endswith(b"Dave arrives.\r\n"))
+        self.assertTrue(said.endswith(b'Dave says, "hi"\r\n'))
+
+
+class TestHttpApi(unittest.TestCase):
+    def setUp(self):
+        self.save_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.save_dir)
+        self.server = ApiServer(port=0, sessions=SessionManager(self.save_dir))
+        self.server.start_background()
+        self.connection = http.client.HTTPConnection("127.0.0.1", self.server.port, timeout=10)
+        self.addCleanup(self.connection.close)
+
+    def tearDown(self):
+        if self.server.socket.fileno() != -1:
+            self.server.stop()
+
+    def request(self, method, path, body=None, headers=()):
+        data = json.dumps(body) if body is not None else None
+        self.connection.request(method, path, body=data, headers={"Content-Type": "application/json", **dict(headers)})
+        response = self.connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    def test_session_commands_and_state(self):
+        """Commands run against a session and its room and inventory can be read."""
+        status, created = self.request("POST", "/sessions")
+        self.assertEqual(status, 201)
+        self.assertIn("Welcome to TextGameTemplate!", created["output"])
+        base = f"/sessions/{created['session_id']}"
+
+        status, result = self.request("POST", base + "/command", {"command": "take key. n"})
+        self.assertEqual(status, 200)
+        self.assertEqual(result["output"][0], "You take the key.")
+        self.assertFalse(result["done"])
+        self.assertEqual(self.request("GET", base + "/room")[1]["location"], result["location"])
+        self.assertEqual(self.request("GET", base + "/inventory")[1]["items"], ["key"])
+        self.assertEqual(self.request("GET", "/stats")[1], {"sessions": 1, "started": 1, "hibernated": 0, "lines": 1})
+
+        self.assertEqual(self.request("DELETE", base)[0], 200)
+        self.assertEqual(self.request("GET", base + "/room")[0], 404)
+
+    def test_unexpected_errors_are_reported(self):
+        """A command that raises gets a JSON 500, and the connection stays usable."""
+        session_id = self.request("POST", "/sessions")[1]["session_id"]
+        with patch.object(Session, "handle_line", side_effect=RuntimeError("boom")), \
+                patch("sys.stderr", new_callable=io.StringIO) as stderr:
+            status, result = self.request("POST", f"/sessions/{session_id}/command", {"command": "look"})
+        self.assertEqual((status, result), (500, {"error": "internal error"}))
+        self.assertIn("RuntimeError: boom", stderr.getvalue())
+        self.assertEqual(self.request("GET", f"/sessions/{session_id}/inventory")[0], 200)
+
+    def test_admin_profile(self):
+        """The admin endpoint samples the server for a while and returns the collapsed stacks."""
+        self.server.admin_token = "secret"
+        admin = {"Authorization": "Bearer secret"}
+        status, result = self.request("POST", "/admin/profile", {"seconds": 0.05}, admin)
+        self.assertEqual(status, 200)
+        self.assertGreater(result["samples"], 0)
+        self.assertTrue(os.path.exists(os.path.join(self.save_dir, "profiles", result["file"])))
+        self.assertEqual(self.request("POST", "/admin/profile", {"seconds": 1000}, admin)[0], 400)
+        self.assertEqual(self.request("GET", "/admin/profile", None, admin)[0], 405)
+
+    def test_admin_profile_is_refused(self):
+        """Without a configured token the endpoint does not exist; with one, it must be sent."""
+        self.assertEqual(self.request("POST", "/admin/profile", {"seconds": 0.05}), (404, {"error": "Not found"}))
+        self.server.admin_token = "secret"
+        for headers in ({}, {"Authorization": "Bearer guess"}):
+            status, result = self.request("POST", "/admin/profile", {"seconds": 0.05}, headers)
+            self.assertEqual((status, result), (403, {"error": "Admin token required"}))
+        self.assertFalse(os.path.exists(os.path.join(self.save_dir, "profiles")))
+
+    def test_save_slots(self):
+        """Saves go to named slots in the server's save directory."""
+        base = f"/sessions/{self.request('POST', '/sessions')[1]['session_id']}"
+        self.request("POST", base + "/command", {"command": "take key"})
+        status, result = self.request("POST", base + "/save", {"slot": "before"})
+        self.assertEqual(status, 200)
+        self.assertNotIn(self.save_dir, result["message"])
+        self.request("POST", base + "/command", {"command": "drop key"})
+        self.request("POST", base + "/load", {"slot": "before"})
+        self.assertEqual(self.request("GET", base + "/inventory")[1]["items"], ["key"])
+
+        self.assertEqual(self.request("POST", base + "/save", {"slot": "../escape"})[0], 400)
+        self.assertEqual(self.request("POST", base + "/save", {"slot": 5})[0], 400)
+
+    def test_save_commands_cannot_escape_the_save_directory(self):
+        """Commands sent through the API cannot save or load arbitrary paths."""
+        outside = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, outside)
+        escaped = os.path.join(outside, "escaped_save.json")
+        session_id = self.request("POST", "/sessions")[1]["session_id"]
+        base = f"/sessions/{session_id}"
+
+        for command in (f"save {escaped}", "load /etc/hostname"):
+            status, result = self.request("POST", base + "/command", {"command": command})
+            self.assertEqual(status, 200)
+            self.assertEqual(result["output"], ["Save names may only use letters, digits, '-' and '_'."])
+        self.assertFalse(os.path.exists(escaped))
+
+        result = self.request("POST", base + "/command", {"command": "save game"})[1]
+        self.assertEqual(result["output"], [f"Game saved to {session_id}-game.json."])
+        status, result = self.request("POST", base + "/load", {"slot": "game"})
+        self.assertEqual(result["message"], f"Game loaded from {session_id}-game.json.")
+
+    def test_errors(self):
+        """Bad requests get JSON errors with matching status codes."""
+        self.assertEqual(self.request("GET", "/nothing")[0], 404)
+        self.assertEqual(self.request("POST", "/sessions/missing/command", {"command": "look"})[0], 404)
+        base = f"/sessions/{self.request('POST', '/sessions')[1]['session_id']}"
+        status, result = self.request("POST", base + "/command", {"line": "look"})
+        self.assertEqual(status, 400)
+        self.assertIn("error", result)
+        self.assertEqual(self.request("GET", base + "/command")[0], 405)
+        self.assertEqual(self.request("POST", "/sessions", {"session_id": "bad id!"})[0], 400)
+
+    def test_stop_autosaves_and_load_generator(self):
+        """The benchmark client runs cleanly and stopping autosaves open sessions."""
+        report = run_http_load("127.0.0.1", self.server.port, clients=4, commands=["look", "n"])
+        self.assertEqual(report["errors"], 0)
+        self.assertEqual(report["commands"], 8)
+
+        base = f"/sessions/{self.request('POST', '/sessions')[1]['session_id']}"
+        self.request("POST", base + "/command", {"command": "take key"})
+        saved = self.server.stop()
+        self.assertEqual(len(saved), 1)
+        new_game = Game()
+        new_game.load_game(saved[0])
+        self.assertEqual(new_game.get_inventory(), "You are carrying: key.")
+
+
+class TestSupervisor(unittest.TestCase):
+    def setUp(self):
+        self.save_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.save_dir)
+
+    def start(self, protocol, **options):
+        supervisor = Supervisor(port=0, workers=2, protocol=protocol, save_dir=self.save_dir,
+                                autosave_interval=0.1, **options)
+        supervisor.start()
+        thread = threading.Thread(target=supervisor.serve_forever)
+        thread.start()
+
+        def stop():
+            supervisor.stop()
+            thread.join()
+        self.addCleanup(stop)
+        return supervisor
+
+    def request(self, port, method, path, body=None):
+        # A new connection per request, so each one is routed by the supervisor.
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        try:
+            connection.request(method, path, body=json.dumps(body) if body is not None else None)
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    def test_late_replies_are_dropped(self):
+        """A reply arriving after its request timed out is not taken for the next one."""
+        supervisor = Supervisor(port=0, workers=1, save_dir=self.save_dir)
+        ours, theirs = multiprocessing.Pipe()
+        self.addCleanup(ours.close)
+        self.addCleanup(theirs.close)
+        worker = _Worker(0, 0, None, ours, None)
+
+        self.assertIsNone(supervisor._request(worker, "stats", 0.05))
+        late = theirs.recv()
+        theirs.send((late[1], {"sessions": "late"}))
+
+        def answer():
+            request = theirs.recv()
+            theirs.send((request[1], {"sessions": request[0]}))
+        thread = threading.Thread(target=answer)
+        thread.start()
+        self.assertEqual(supervisor._request(worker, "metrics"), {"sessions": "metrics"})
+        thread.join()
+
+    def test_split_request_lines_are_routed_to_their_worker(self):
+        """A request line arriving in several segments still reaches the session's worker."""
+        supervisor = self.start("http")
+        session_id = self.request(supervisor.port, "POST", "/sessions")[1]["session_id"]
+        for _ in range(4):
+            with socket.create_connection(("127.0.0.1", supervisor.port), timeout=10) as conn:
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                conn.sendall(b"GET /sess")
+                time.sleep(0.05)
+                conn.sendall(f"ions/{session_id}/inventory HTTP/1.1\r\nHost: x\r\n".encode())
+                time.sleep(0.05)
+                conn.sendall(b"Connection: close\r\n\r\n")
+                response = b""
+                while chunk := conn.recv(65536):
+                    response += chunk
+            self.assertTrue(response.startswith(b"HTTP/1.1 200 "), response)
+
+    def test_metrics_are_collected_from_every_worker(self):
+        """The supervisor merges the workers' metrics, labelled by worker."""
+        supervisor = self.start("http", metrics=True)
+        session_id = self.request(supervisor.port, "POST", "/sessions")[1]["session_id"]
+        self.request(supervisor.port, "POST", f"/sessions/{session_id}/command", {"command": "look"})
+
+        text = format_metrics(supervisor.collect())
+        self.assertIn("textgame_workers 2\n", text)
+        self.assertEqual(text.count("# TYPE textgame_sessions gauge"), 1)
+        self.assertRegex(text, r'textgame_commands_total\{worker="\d",verb="look"\} 1\n')
+
+    def test_http_sessions_survive_worker_death(self):
+        """Sessions are routed by shard and restored elsewhere if their worker dies."""
+        supervisor = self.start("http")
+        session_id = self.request(supervisor.port, "POST", "/sessions")[1]["session_id"]
+        base = f"/sessions/{session_id}"
+        self.request(supervisor.port, "POST", base + "/command", {"command": "take key"})
+        for _ in range(5):
+            self.assertEqual(self.request(supervisor.port, "GET", base + "/inventory")[1]["items"], ["key"])
+
+        stats = self.request(supervisor.port, "GET", "/stats")[1]
+        self.assertEqual(len(stats["workers"]), 2)
+        self.assertEqual(stats["sessions"], 1)
+        owner = next(w for w in stats["workers"] if shard_of(session_id) in w["shards"])
+        time.sleep(0.3)  # Let the periodic autosave run.
+        os.kill(owner["pid"], signal.SIGKILL)
+
+        for _ in range(50):
+            stats = self.request(supervisor.port, "GET", "/stats")[1]
+            if stats["restarts"] and len(stats["workers"]) == 2:
+                break
+            time.sleep(0.1)
+        self.assertEqual(stats["restarts"], 1)
+        self.assertEqual(self.request(supervisor.port, "GET", base + "/inventory")[1]["items"], ["key"])
+
+    def test_tcp_load_across_workers(self):
+        """TCP connections are spread over the workers."""
+        supervisor = self.start("tcp")
+        report = asyncio.run(run_tcp_load("127.0.0.1", supervisor.port, clients=6, commands=["look", "n"]))
+        self.assertEqual(report["errors"], 0)
+        self.assertEqual(report["commands"], 12)
+        workers = supervisor.stats()["workers"]
+        self.assertEqual([w["lines"] > 0 for w in workers], [True, True])
+
+
 if __name__ == "__main__":
     unittest.main()
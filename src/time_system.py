@@ -17,8 +17,23 @@ class TimeSystem:
         Returns:
             list: A list of actions triggered by expired timers.
         """
-        self.total_minutes += minutes
         triggered_actions = []
+        for timer in self.advance(minutes):
+            triggered_actions.extend(timer["actions"])
+        return triggered_actions
+
+    def advance(self, minutes):
+        """Advances the game time and removes the timers that expired.
+
+        Args:
+            minutes: The number of minutes to advance.
+
+        Returns:
+            list: The expired timer dictionaries, earliest first. Each has
+            "actions" and, if it was scheduled with one, an "owner".
+        """
+        self.total_minutes += minutes
+        expired = []
 
         # Check for expired timers
         remaining_timers = []
@@ -27,25 +42,30 @@ class TimeSystem:
 
         for timer in self.timers:
             if self.total_minutes >= timer["trigger_time"]:
-                triggered_actions.extend(timer["actions"])
+                expired.append(timer)
             else:
                 remaining_timers.append(timer)
 
         self.timers = remaining_timers
-        return triggered_actions
+        return expired
 
-    def schedule_event(self, minutes, actions):
+    def schedule_event(self, minutes, actions, owner=None):
         """Schedules a list of actions to occur after a delay.
 
         Args:
             minutes: The delay in minutes.
             actions: A list of action dictionaries.
+            owner: Who the actions apply to when several players share the
+                clock (see `src.shared_world`), or None.
         """
         trigger_time = self.total_minutes + minutes
-        self.timers.append({
+        timer = {
             "trigger_time": trigger_time,
             "actions": actions
-        })
+        }
+        if owner is not None:
+            timer["owner"] = owner
+        self.timers.append(timer)
 
     def get_date_time_string(self):
         """Returns a formatted string of the current game time.
@@ -0,0 +1,119 @@
+"""
+Word index used to resolve the noun phrases players type.
+
+An object (item or character) is known by the words of its name (split on
+spaces and underscores) plus any ``adjectives`` and ``synonyms`` declared in
+its content. A phrase refers to an object when every word of the phrase,
+after leading articles, is one of the object's words, so ``rusty key``,
+``key`` and ``rusty`` all refer to a key with the adjective ``rusty``.
+"""
+
+ARTICLES = frozenset(("a", "an", "the"))
+
+
+def phrase_words(phrase):
+    """Splits a player's noun phrase into lowercase words, dropping leading articles.
+
+    Args:
+        phrase: The phrase typed by the player.
+
+    Returns:
+        list: The words of the phrase.
+    """
+    words = phrase.lower().replace("_", " ").split()
+    while words and words[0] in ARTICLES:
+        words.pop(0)
+    return words
+
+
+def object_words(obj):
+    """Returns the set of words an item or character can be referred to by.
+
+    Args:
+        obj: The item or character dictionary.
+
+    Returns:
+        frozenset: The object's words.
+    """
+    words = set(str(obj.get("name", "")).lower().replace("_", " ").split())
+    for key in ("adjectives", "synonyms"):
+        for word in obj.get(key) or ():
+            words.update(word.lower().replace("_", " ").split())
+    return frozenset(words)
+
+
+def refers_to(obj, words):
+    """Checks whether phrase words (see `phrase_words`) refer to an object.
+
+    Args:
+        obj: The item or character dictionary.
+        words: The words of the phrase.
+
+    Returns:
+        bool: True if every word is one of the object's words.
+    """
+    return bool(words) and object_words(obj).issuperset(words)
+
+
+class Vocabulary:
+    """An inverted index from words to the objects known by them."""
+
+    __slots__ = ("_words", "_postings")
+
+    def __init__(self):
+        self._words = {}
+        self._postings = {}
+
+    def add(self, key, obj):
+        """Indexes (or re-indexes) an object under its current words.
+
+        Args:
+            key: A key unique to the object (instance id or ``id()``).
+            obj: The item or character dictionary.
+        """
+        self.discard(key)
+        words = object_words(obj)
+        self._words[key] = words
+        for word in words:
+            self._postings.setdefault(word, {})[key] = obj
+
+    def discard(self, key):
+        """Removes an object from the index, if present.
+
+        Args:
+            key: The key the object was added with.
+        """
+        for word in self._words.pop(key, ()):
+            posting = self._postings[word]
+            del posting[key]
+            if not posting:
+                del self._postings[word]
+
+    def clear(self):
+        """Removes every object from the index."""
+        self._words = {}
+        self._postings = {}
+
+    def lookup(self, words):
+        """Returns the objects indexed under all of the given words.
+
+        Cost depends on the number of words and the size of the rarest
+        word's posting list, not on the number of indexed objects.
+
+        Args:
+            words: The words of a phrase (see `phrase_words`).
+
+        Returns:
+            list: The matching objects, in the order they were indexed.
+        """
+        if not words:
+            return []
+        postings = []
+        for word in set(words):
+            posting = self._postings.get(word)
+            if not posting:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        rarest, others = postings[0], postings[1:]
+        return [obj for key, obj in rarest.items() if all(key in posting for posting in others)]